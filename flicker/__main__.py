@@ -1,11 +1,16 @@
 from flicker.gui.windows.mainwindow import MainWindow
 from flicker.gui.application import FlickerApp
 
+import multiprocessing
 import sys
 
 
-app = FlickerApp(sys.argv)
+if __name__ == '__main__':
+    # worker processes of the content extraction re-import this module
+    multiprocessing.freeze_support()
 
-window = MainWindow()
-window.show()
-app.exec()
+    app = FlickerApp(sys.argv)
+
+    window = MainWindow()
+    window.show()
+    app.exec()
@@ -9,6 +9,7 @@ from flicker.gui.windows.hotkeywindow import HotkeyWindow
 from flicker.utils.hotkey_manager import HotkeyManager
 from flicker.utils.settings import Settings
 from flicker.services.proactive.intent_parser import IntentParser
+from flicker.services.memory.fs.shards import StorageShards
 
 from typing import Optional
 from traceback import format_exc
@@ -57,6 +58,11 @@ class FlickerApp(QApplication):
             font.setStyleStrategy(QFont.PreferAntialias)
             self.setFont(font)
 
+            # the databases of the removed data sources are dropped before the scans start
+            StorageShards.getInstance().configure({
+                datasource.root_directory: datasource.getDatabasePath()
+                for datasource in default_settings.memory_data_sources
+            })
             for datasource in default_settings.memory_data_sources:
                 datasource.startUpdate()
         except Exception as ex:
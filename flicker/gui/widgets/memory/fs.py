@@ -2,7 +2,7 @@ from PySide6.QtWidgets import (
     QWidget, QLabel, QHBoxLayout, QVBoxLayout, QScrollArea, QPushButton,
     QSizePolicy
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, Signal
 from os import startfile
 from pathlib import Path
 from typing import Optional
@@ -27,14 +27,30 @@ class FileView(QWidget):
 
 
 class FileListView(QScrollArea):
+    """ the files of a search, further pages are appended when "load more" is clicked """
+
+    loadMoreRequested = Signal()
+
     def __init__(self, parent: Optional[QWidget] = None) -> None:
         super().__init__(parent)
         self.content_layout = QVBoxLayout()
         self.content_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
         self.content_layout.setSpacing(5)
+
+        self.widget_count = QLabel()
+        self.widget_more = QPushButton("加载更多")
+        self.widget_more.clicked.connect(self.loadMoreRequested.emit)
+        footer_layout = QHBoxLayout()
+        footer_layout.addWidget(self.widget_count, 1)
+        footer_layout.addWidget(self.widget_more)
+
+        main_layout = QVBoxLayout()
+        main_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
+        main_layout.addLayout(self.content_layout)
+        main_layout.addLayout(footer_layout)
         content_widget = QWidget(self)
         content_widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
-        content_widget.setLayout(self.content_layout)
+        content_widget.setLayout(main_layout)
         content_widget.setStyleSheet("")
         self.setWidget(content_widget)
         self.setWidgetResizable(True)
@@ -52,9 +68,21 @@ class FileListView(QScrollArea):
 
         self.widget_files.clear()
 
-    def setFilePaths(self, paths: list[str]) -> None:
+    def setFilePaths(self, paths: list[str], has_more: bool = False) -> None:
         self.clear()
+        self.setFileCount(None)
+        self.appendFilePaths(paths, has_more)
+
+    def appendFilePaths(self, paths: list[str], has_more: bool = False) -> None:
         for path in paths:
             widget_file = FileView(path)
             self.content_layout.addWidget(widget_file)
             self.widget_files.append(widget_file)
+
+        self.widget_more.setVisible(has_more)
+
+    def setFileCount(self, count: Optional[int], exact: bool = True) -> None:
+        """ the count is hidden when None, an inexact count is a lower bound """
+        self.widget_count.setVisible(count is not None)
+        if count is not None:
+            self.widget_count.setText(f"共 {count} 个文件" if exact else f"超过 {count} 个文件")
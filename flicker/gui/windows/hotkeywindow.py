@@ -1,8 +1,8 @@
 from PySide6.QtWidgets import (
-    QMainWindow, QWidget, QFrame, QVBoxLayout, QTabWidget,
+    QApplication, QMainWindow, QWidget, QFrame, QVBoxLayout, QTabWidget,
     QGraphicsDropShadowEffect
 )
-from PySide6.QtCore import Qt, QTimer, QEvent
+from PySide6.QtCore import Qt, QTimer, QEvent, QObject, QThread, Signal
 from PySide6.QtGui import QKeyEvent, QColor
 
 from flicker.utils.window import WindowUtils
@@ -10,14 +10,62 @@ from flicker.services.proactive.intent_parser import IntentParsingResult
 from flicker.gui.widgets.input import AIChatInput
 from flicker.gui.widgets.proactive.intents import IntentListView
 from flicker.gui.widgets.memory.fs import FileListView
-from flicker.services.memory.fs.storage import FileSystemStorage, FileInfoFilter
+from flicker.services.memory.fs.storage import (
+    StoragePriority, FileInfoFilter, FileSearchCursor, FileSearchPage, FileCountEstimate
+)
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.scanner import FileScanner
 
 from loguru import logger
+from traceback import format_exc
 from typing import Optional
 
 
+class FileSearchWorker(QObject):
+    """ runs the file searches of the hotkey window in its own thread, so a slow query never
+    blocks the typing. Each request carries the generation of its search, the requests of
+    a search replaced while they were queued are skipped """
+
+    pageFetched = Signal(int, FileSearchPage, bool)
+    countEstimated = Signal(int, FileCountEstimate)
+
+    def __init__(self) -> None:
+        super().__init__()
+        # the latest search, set by the main thread
+        self.generation = 0
+
+    def fetchFiles(self, generation: int, filter: FileInfoFilter, append: bool) -> None:
+        if generation != self.generation:
+            return
+
+        try:
+            page = StorageShards.getInstance().searchFiles(filter, StoragePriority.INTERACTIVE)
+        except Exception as ex:
+            logger.error(f'failed to search files: {ex}')
+            logger.info(format_exc())
+            return
+
+        self.pageFetched.emit(generation, page, append)
+
+    def estimateFileCount(self, generation: int, filter: FileInfoFilter) -> None:
+        if generation != self.generation:
+            return
+
+        try:
+            estimate = StorageShards.getInstance().estimateFileCount(filter, StoragePriority.INTERACTIVE)
+        except Exception as ex:
+            logger.error(f'failed to count files: {ex}')
+            logger.info(format_exc())
+            return
+
+        self.countEstimated.emit(generation, estimate)
+
+
 class HotkeyWindow(QMainWindow):
 
+    filesRequested = Signal(int, FileInfoFilter, bool)
+    countRequested = Signal(int, FileInfoFilter)
+
     _instance: Optional['HotkeyWindow'] = None
 
     STYLE = """
@@ -31,6 +79,7 @@ class HotkeyWindow(QMainWindow):
         if cls._instance is None:
             cls._instance = HotkeyWindow()
 
+        FileScanner.notifyActivity()
         window = cls._instance
         window.show()
         WindowUtils.bringWindowToFront(window)
@@ -52,6 +101,27 @@ class HotkeyWindow(QMainWindow):
 
         self.widget_intents = IntentListView(self)
         self.widget_files = FileListView(self)
+        self.widget_files.loadMoreRequested.connect(self.loadMoreFiles)
+        self.search_filter: Optional[FileInfoFilter] = None
+        self.search_cursor: Optional[FileSearchCursor] = None
+        # the pages and counts of an older search arriving late are dropped
+        self.search_generation = 0
+        self.search_thread = QThread()
+        self.search_worker = FileSearchWorker()
+        self.search_worker.moveToThread(self.search_thread)
+        self.filesRequested.connect(self.search_worker.fetchFiles)
+        self.countRequested.connect(self.search_worker.estimateFileCount)
+        self.search_worker.pageFetched.connect(self.showFiles)
+        self.search_worker.countEstimated.connect(self.showFileCount)
+        self.search_thread.start()
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stopSearching)
+        # the count of the matched files is only estimated once the typing pauses
+        self.timer_count = QTimer(self)
+        self.timer_count.setSingleShot(True)
+        self.timer_count.setInterval(300)
+        self.timer_count.timeout.connect(self.estimateFileCount)
         self.widget_input = AIChatInput()
         self.widget_input.textChanged.connect(self.searchFiles)
         self.widget_tabs = QTabWidget()
@@ -115,9 +185,58 @@ class HotkeyWindow(QMainWindow):
         if keyword == "":
             return
 
-        result = FileSystemStorage.getInstance().findFiles(FileInfoFilter(keywords=[keyword]))
-        self.widget_files.setFilePaths(result[:20])
-        self.widget_tabs.setCurrentWidget(self.widget_files)
+        # e.g. "report ext:pdf after:2026-10-01 in:projects"
+        search_filter = FileInfoFilter.parse(keyword, limit=20)
+        if search_filter.isEmpty():
+            return
+
+        FileScanner.notifyActivity()
+        self.search_generation += 1
+        self.search_worker.generation = self.search_generation
+        self.search_filter = search_filter
+        self.search_cursor = None
+        self.filesRequested.emit(self.search_generation, search_filter, False)
+        self.timer_count.start()
+
+    def loadMoreFiles(self) -> None:
+        if self.search_filter is None or self.search_cursor is None:
+            return
+
+        # the next page is requested once, until it arrives
+        filter = self.search_filter.model_copy(update={'cursor': self.search_cursor})
+        self.search_cursor = None
+        self.filesRequested.emit(self.search_generation, filter, True)
+
+    def showFiles(self, generation: int, page: FileSearchPage, append: bool) -> None:
+        if generation != self.search_generation:
+            return
+
+        self.search_cursor = page.cursor
+        if append:
+            self.widget_files.appendFilePaths(page.file_paths, page.cursor is not None)
+        else:
+            self.widget_files.setFilePaths(page.file_paths, page.cursor is not None)
+            self.widget_tabs.setCurrentWidget(self.widget_files)
+
+        # a search stops short of a page when its time runs out, the page is filled by the
+        # next ones
+        if self.search_filter is not None and len(page.file_paths) < self.search_filter.limit:
+            self.loadMoreFiles()
+
+    def estimateFileCount(self) -> None:
+        if self.search_filter is None:
+            return
+
+        self.countRequested.emit(self.search_generation, self.search_filter)
+
+    def showFileCount(self, generation: int, estimate: FileCountEstimate) -> None:
+        # the first page of the search is shown before its count, see `FileSearchWorker`
+        if generation == self.search_generation:
+            self.widget_files.setFileCount(estimate.count, estimate.exact)
+
+    def stopSearching(self) -> None:
+        self.search_thread.quit()
+        self.search_thread.wait()
 
     def setIntentParsingResult(self, result: Optional[IntentParsingResult] = None) -> None:
         self.widget_intents.updateIntentList([] if result is None else result.intents)
@@ -1,43 +1,269 @@
 from flicker.utils.settings import ModelInstance
-from openai import OpenAI
+from flicker.services.llm.embeddingstore import EmbeddingStore, getContentHash
+from openai import OpenAI, APIStatusError, APIConnectionError
 from loguru import logger
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor, Future
 from itertools import batched
-from time import time
-from typing import Optional
+from hashlib import sha1
+from pathlib import Path
+from threading import Condition, Lock
+from time import monotonic, sleep, time
+from typing import Optional, Sequence
+
+import random
+import traceback
 
 
 class EmbeddingOptions(BaseModel):
     batch_size: int
     dimension: Optional[int] = None
+    # look the texts up in the embedding store and keep the new vectors there
+    use_store: bool = True
+    # batches sent at the same time, the limit is lowered while the provider throttles
+    max_in_flight: int = 4
+    # attempts of a batch after the first one, on throttling, server and connection errors
+    max_retries: int = 5
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
 
     @classmethod
     def default(cls) -> 'EmbeddingOptions':
         return EmbeddingOptions(batch_size=128)
 
 
+class EmbeddingResult(BaseModel):
+    """ the row of the vector of each text in the embedding store, in the order of the texts.
+    The row of a text whose batch failed is -1 """
+    model: str
+    rows: list[int]
+    cached_texts: int = 0
+    embedded_texts: int = 0
+    total_tokens: int = 0
+    # batches failed after their retries, and their distinct texts
+    failed_batches: int = 0
+    failed_texts: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cached_texts / len(self.rows) if len(self.rows) > 0 else 0.0
+
+
+class AdaptiveConcurrency:
+    """ AIMD limit of the requests in flight: each success raises the limit by one over
+    the limit, so by about one per round of requests, and a request throttled or failed
+    by the server halves it. The requests sent before the last decrease do not decrease
+    it again, they were sent under the previous limit. A request rejected for itself,
+    e.g. a bad request, leaves the limit as it is """
+
+    def __init__(self, max_limit: int) -> None:
+        self.max_limit = max(1, max_limit)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.condition = Condition()
+
+    def acquire(self) -> float:
+        """ wait for a free slot, returns the time the request is sent """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+
+            self.in_flight += 1
+            return monotonic()
+
+    def release(self, sent_at: float, succeeded: bool, throttled: bool = False) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif throttled and sent_at >= self.decreased_at:
+                self.limit = max(1.0, self.limit / 2)
+                self.decreased_at = monotonic()
+                logger.warning(f'embedding requests throttled, concurrency lowered to {int(self.limit)}')
+
+            self.condition.notify_all()
+
+
+def isRetryable(ex: Exception) -> bool:
+    if isinstance(ex, APIStatusError):
+        return ex.status_code in (408, 409, 429) or ex.status_code >= 500
+
+    # timeouts are connection errors too
+    return isinstance(ex, APIConnectionError)
+
+
+def getRetryDelay(ex: Exception, attempt: int, options: EmbeddingOptions) -> float:
+    """ exponential backoff with full jitter, at least the delay asked by the provider """
+    delay = random.uniform(0, min(options.backoff_max, options.backoff_base * 2 ** attempt))
+    if isinstance(ex, APIStatusError):
+        try:
+            delay = max(delay, min(options.backoff_max, float(ex.response.headers.get('retry-after', 0))))
+        except ValueError:
+            # an HTTP date instead of seconds
+            pass
+
+    return delay
+
+
 class EmbeddingService:
+    _stores: dict[Path, EmbeddingStore] = dict()
+    _stores_lock = Lock()
+
+    @staticmethod
+    def getModelKey(model_ref: ModelInstance, options: EmbeddingOptions) -> str:
+        """ the texts embedded by the same model with the same dimension share their vectors """
+        return f'{model_ref.base_url}|{model_ref.model_name}|{options.dimension or ""}'
+
     @classmethod
-    def startEmbedding(cls, model_ref: ModelInstance, texts: list[str], options: Optional[EmbeddingOptions] = None) -> None:
+    def getStore(cls, model_key: str) -> EmbeddingStore:
+        """ a store per model, the vectors of a store have the same dimension """
+        from flicker.utils.settings import Settings
+        directory = Settings.getSettingsDirectory() / "embeddings"
+        path = directory / f'{sha1(model_key.encode("utf-8")).hexdigest()}.db'
+        with cls._stores_lock:
+            store = cls._stores.get(path)
+            if store is None:
+                if not directory.exists():
+                    directory.mkdir(parents=True)
+
+                store = EmbeddingStore(path)
+                cls._stores[path] = store
+
+            return store
+
+    @classmethod
+    def startEmbedding(
+        cls, model_ref: ModelInstance, texts: list[str], options: Optional[EmbeddingOptions] = None,
+        chunk_ids: Optional[Sequence[str]] = None, store: Optional[EmbeddingStore] = None
+    ) -> EmbeddingResult:
+        """ embed the texts whose hash is not stored for the model yet, up to
+        `options.max_in_flight` batches at a time. Each batch is stored once received. A
+        batch failed after its retries does not stop the others, the result counts it and
+        a later run embeds its texts again. The chunk ids, one per text, are mapped to the
+        rows of their texts """
         logger.info(f'start embedding for {len(texts)} text chunks')
         if options is None:
             options = EmbeddingOptions.default()
 
-        client = OpenAI(api_key=model_ref.api_key, base_url=model_ref.base_url)
-        N = len(texts) // options.batch_size + (1 if len(texts) % options.batch_size != 0 else 0)
+        model_key = cls.getModelKey(model_ref, options)
+        if store is None and options.use_store:
+            store = cls.getStore(model_key)
+
+        hashes = [getContentHash(text) for text in texts]
+        found = store.findRows(model_key, set(hashes)) if store is not None else dict()
+        # the same text is embedded once in a run
+        missing: dict[str, str] = dict()
+        for text, content_hash in zip(texts, hashes):
+            if content_hash not in found:
+                missing.setdefault(content_hash, text)
+
+        cached_texts = sum(1 for content_hash in hashes if content_hash in found)
+        if len(texts) > 0:
+            logger.info(f'{cached_texts} / {len(texts)} texts found in the embedding store, hit ratio {cached_texts / len(texts):.2%}')
+
+        # the retries are ours, so the throttled requests lower the concurrency
+        client = OpenAI(api_key=model_ref.api_key, base_url=model_ref.base_url, max_retries=0)
+        N = len(missing) // options.batch_size + (1 if len(missing) % options.batch_size != 0 else 0)
         start_time = time()
         total_tokens = 0
+        completed = 0
+        progress_lock = Lock()
+        limiter = AdaptiveConcurrency(options.max_in_flight)
+
+        def embed(payload: tuple[tuple[str, str], ...]) -> None:
+            nonlocal total_tokens, completed
+            batch_hashes = [content_hash for content_hash, _ in payload]
+            batch_texts = [text for _, text in payload]
+            for attempt in range(options.max_retries + 1):
+                sent_at = limiter.acquire()
+                try:
+                    # the same payload is sent again on a retry, and a stored hash is not
+                    # stored twice, so a retry after a lost response is harmless
+                    if options.dimension is not None:
+                        resp = client.embeddings.create(
+                            model=model_ref.model_name,
+                            input=batch_texts,
+                            dimensions=options.dimension
+                        )
+                    else:
+                        resp = client.embeddings.create(model=model_ref.model_name, input=batch_texts)
+                except Exception as ex:
+                    limiter.release(sent_at, False, isRetryable(ex))
+                    if not isRetryable(ex) or attempt == options.max_retries:
+                        raise
+
+                    delay = getRetryDelay(ex, attempt, options)
+                    logger.warning(f'embedding batch failed: {ex}, retry {attempt + 1} / {options.max_retries} in {delay:.2f}s')
+                    sleep(delay)
+                    continue
+
+                limiter.release(sent_at, True)
+                break
+
+            vectors = [item.embedding for item in sorted(resp.data, key=lambda item: item.index)]
+            if store is not None:
+                rows = store.addEmbeddings(model_key, batch_hashes, vectors)
+                with progress_lock:
+                    found.update(rows)
+
+            with progress_lock:
+                total_tokens += resp.usage.total_tokens
+                completed += 1
+                total_tps = total_tokens / (time() - start_time)
+                logger.info(f"processed batch {completed} / {N} embeddings, total tokens {total_tokens}, tps {total_tps:.2f}")
+
+        if chunk_ids is not None and len(chunk_ids) != len(texts):
+            raise ValueError(f'{len(chunk_ids)} chunk ids for {len(texts)} texts')
+
+        failed_batches = 0
+        failed_texts = 0
+        with ThreadPoolExecutor(max_workers=max(1, options.max_in_flight), thread_name_prefix='embedding') as executor:
+            batches = list(batched(missing.items(), options.batch_size))
+            futures: list[Future] = [executor.submit(embed, payload) for payload in batches]
+            for payload, future in zip(batches, futures):
+                try:
+                    future.result()
+                except Exception as ex:
+                    logger.error(f'embedding batch of {len(payload)} texts failed: {ex}')
+                    logger.info(traceback.format_exc())
+                    failed_batches += 1
+                    failed_texts += len(payload)
+
+        if failed_batches > 0:
+            logger.warning(f'{failed_batches} / {N} embedding batches failed, {failed_texts} texts left without a vector')
+
+        if store is None:
+            return EmbeddingResult(
+                model=model_key, rows=[], embedded_texts=len(missing) - failed_texts, total_tokens=total_tokens,
+                failed_batches=failed_batches, failed_texts=failed_texts
+            )
+
+        if chunk_ids is not None:
+            store.assignChunks(model_key, [
+                (chunk_id, content_hash) for chunk_id, content_hash in zip(chunk_ids, hashes) if content_hash in found
+            ])
+
+        return EmbeddingResult(
+            model=model_key,
+            rows=[found.get(content_hash, -1) for content_hash in hashes],
+            cached_texts=cached_texts,
+            embedded_texts=len(missing) - failed_texts,
+            total_tokens=total_tokens,
+            failed_batches=failed_batches,
+            failed_texts=failed_texts
+        )
+
+    @classmethod
+    def removeChunks(
+        cls, model_ref: ModelInstance, chunk_ids: Sequence[str], options: Optional[EmbeddingOptions] = None
+    ) -> None:
+        """ the vectors left without a chunk are dropped once they are a quarter of the store """
+        if options is None:
+            options = EmbeddingOptions.default()
 
-        for i, payload in enumerate(batched(texts, options.batch_size)):
-            if options.dimension is not None:
-                resp = client.embeddings.create(
-                    model=model_ref.model_name,
-                    input=payload,
-                    dimensions=options.dimension
-                )
-            else:
-                resp = client.embeddings.create(model=model_ref.model_name, input=payload)
-
-            total_tokens += resp.usage.total_tokens
-            total_tps = total_tokens / (time() - start_time)
-            logger.info(f"processed batch {i + 1} / {N} embeddings, total tokens {total_tokens}, tps {total_tps:.2f}")
+        model_key = cls.getModelKey(model_ref, options)
+        store = cls.getStore(model_key)
+        store.removeChunks(model_key, chunk_ids)
+        if store.needsCompaction():
+            store.compact()
@@ -0,0 +1,392 @@
+""" persistent store of the embeddings, so a text is sent to the embeddings API once per
+model however many times it is embedded.
+
+The vectors are rows of a float32 matrix in a file next to the database, appended as they
+are received and read through a memory mapping. The database maps the hash of each text
+and model to its row, and each chunk to the row of its text, chunks with the same text
+share a row. A row left without a chunk is a tombstone, it is still reused when its text
+comes again, and dropped by `compact` which rewrites the matrix into a new generation:
+
+    header  magic, version, dimension, padded to 16 bytes
+    rows    dimension float32 each, in the native byte order
+
+A crash between the append of the vectors and the commit of their rows leaves rows at
+the end of the matrix which nothing refers to, they are dropped by the next compaction """
+from pathlib import Path
+from pydantic import BaseModel
+from threading import Lock
+from typing import Iterable, Optional, Sequence
+from array import array
+from hashlib import blake2b
+from loguru import logger
+
+import json
+import mmap
+import os
+import sqlite3
+import struct
+
+
+MAGIC = b'FLEV'
+VERSION = 1
+HEADER = struct.Struct('=4sII4x')
+ITEM_SIZE = array('f').itemsize
+
+CREATE_EMBEDDING = """
+CREATE TABLE IF NOT EXISTS embeddingmeta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO embeddingmeta (key, value) VALUES ('generation', 0);
+CREATE TABLE IF NOT EXISTS embedding (
+    row INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    tombstone INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (model, content_hash)
+);
+CREATE INDEX IF NOT EXISTS embedding_tombstone ON embedding (tombstone);
+CREATE TABLE IF NOT EXISTS embeddingchunk (
+    chunk_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    PRIMARY KEY (chunk_id, model)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddingchunk_row ON embeddingchunk (row);
+"""
+
+# each item upgrades the schema by one version, the version is kept in user_version
+SCHEMA_MIGRATIONS = [
+    CREATE_EMBEDDING,
+]
+
+SELECT_GENERATION = """
+SELECT value FROM embeddingmeta WHERE key = 'generation';
+"""
+
+UPDATE_GENERATION = """
+UPDATE embeddingmeta SET value = ? WHERE key = 'generation';
+"""
+
+SELECT_EMBEDDING_ROW = """
+SELECT content_hash, row FROM embedding
+WHERE model = ? AND content_hash IN (SELECT value FROM json_each(?));
+"""
+
+INSERT_EMBEDDING = """
+INSERT INTO embedding (row, model, content_hash) VALUES (?, ?, ?)
+ON CONFLICT (model, content_hash) DO NOTHING;
+"""
+
+# a chunk moved to another text leaves the row of its previous text, which is marked as a
+# tombstone by UPDATE_TOMBSTONE once no chunk refers to it
+INSERT_EMBEDDING_CHUNK = """
+INSERT INTO embeddingchunk (chunk_id, model, row)
+SELECT ?1, ?2, row FROM embedding WHERE model = ?2 AND content_hash = ?3
+ON CONFLICT (chunk_id, model) DO UPDATE SET row = excluded.row
+RETURNING row;
+"""
+
+SELECT_CHUNK_ROW = """
+SELECT chunk_id, row FROM embeddingchunk
+WHERE model = ? AND chunk_id IN (SELECT value FROM json_each(?));
+"""
+
+DELETE_EMBEDDING_CHUNK = """
+DELETE FROM embeddingchunk WHERE model = ? AND chunk_id IN (SELECT value FROM json_each(?))
+RETURNING row;
+"""
+
+UPDATE_TOMBSTONE = """
+UPDATE embedding SET tombstone = NOT EXISTS (SELECT 1 FROM embeddingchunk c WHERE c.row = embedding.row)
+WHERE row IN (SELECT value FROM json_each(?));
+"""
+
+SELECT_EMBEDDING_COUNT = """
+SELECT COUNT(*), coalesce(SUM(tombstone), 0) FROM embedding;
+"""
+
+SELECT_CHUNK_COUNT = """
+SELECT COUNT(*) FROM embeddingchunk;
+"""
+
+SELECT_LIVE_ROW = """
+SELECT row FROM embedding WHERE tombstone = 0 ORDER BY row;
+"""
+
+DELETE_TOMBSTONE = """
+DELETE FROM embedding WHERE tombstone = 1;
+"""
+
+# the rows keep their order, so renumbering them in ascending order never collides
+UPDATE_EMBEDDING_ROW = """
+UPDATE embedding SET row = ? WHERE row = ?;
+"""
+
+UPDATE_CHUNK_ROW = """
+UPDATE embeddingchunk SET row = ? WHERE row = ?;
+"""
+
+# rows beyond the end of the matrix, left when the matrix is lost
+DELETE_MISSING_EMBEDDING = """
+DELETE FROM embedding WHERE row >= ?;
+"""
+
+DELETE_MISSING_CHUNK = """
+DELETE FROM embeddingchunk WHERE row >= ?;
+"""
+
+
+def getContentHash(text: str) -> str:
+    # stable across processes unlike hash()
+    return blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+class EmbeddingStoreStats(BaseModel):
+    dimension: int = 0
+    # rows of the matrix, including the tombstones and the rows left by a crash
+    matrix_rows: int = 0
+    rows: int = 0
+    tombstones: int = 0
+    chunks: int = 0
+    matrix_size: int = 0
+
+
+class EmbeddingStore:
+    """ the vectors of the texts embedded by any model of the same dimension. The methods
+    are serialized by a lock """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL;")
+        version = self.connection.execute("PRAGMA user_version;").fetchone()[0]
+        for i in range(version, len(SCHEMA_MIGRATIONS)):
+            self.connection.executescript(
+                "BEGIN;" + SCHEMA_MIGRATIONS[i] + f"PRAGMA user_version = {i + 1}; COMMIT;"
+            )
+
+        self.generation = self.connection.execute(SELECT_GENERATION).fetchone()[0]
+        self.dimension = 0
+        self.rows = 0
+        self.mapping: Optional[mmap.mmap] = None
+        self.openMatrix()
+
+    def getMatrixPath(self, generation: int) -> Path:
+        return self.db_path.with_name(f'{self.db_path.stem}.{generation}.f32')
+
+    def openMatrix(self) -> None:
+        path = self.getMatrixPath(self.generation)
+        # a compaction which did not commit leaves the matrix of the next generation
+        for stale in self.db_path.parent.glob(f'{self.db_path.stem}.*.f32'):
+            if stale != path:
+                stale.unlink()
+
+        if path.exists():
+            with open(path, 'rb') as f:
+                magic, version, dimension = HEADER.unpack(f.read(HEADER.size))
+
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'unsupported embedding matrix {path}')
+
+            self.dimension = dimension
+            # a partial row is left by a crash during an append
+            self.rows = (path.stat().st_size - HEADER.size) // (dimension * ITEM_SIZE)
+
+        with self.connection:
+            self.connection.execute(DELETE_MISSING_EMBEDDING, (self.rows,))
+            self.connection.execute(DELETE_MISSING_CHUNK, (self.rows,))
+
+        logger.info(f'embedding store {self.db_path} opened with {self.rows} rows of dimension {self.dimension}')
+
+    def close(self) -> None:
+        with self.lock:
+            if self.mapping is not None:
+                self.mapping.close()
+                self.mapping = None
+
+            self.connection.close()
+
+    def findRows(self, model: str, hashes: Iterable[str]) -> dict[str, int]:
+        """ the rows of the texts already embedded by the model, by the hash of the text """
+        with self.lock:
+            return dict(self.connection.execute(SELECT_EMBEDDING_ROW, (model, json.dumps(list(hashes)))).fetchall())
+
+    def addEmbeddings(self, model: str, hashes: Sequence[str], vectors: Sequence[Sequence[float]]) -> dict[str, int]:
+        """ append the vectors of the texts by their hash, returns their rows. The vectors
+        are written to the matrix before their rows are committed """
+        if len(hashes) == 0:
+            return dict()
+
+        with self.lock:
+            dimension = len(vectors[0])
+            if any(len(vector) != dimension for vector in vectors):
+                raise ValueError('the vectors of a batch have different dimensions')
+
+            path = self.getMatrixPath(self.generation)
+            if self.dimension == 0:
+                with open(path, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, VERSION, dimension))
+
+                self.dimension = dimension
+            elif dimension != self.dimension:
+                raise ValueError(f'vectors of dimension {dimension} in a store of dimension {self.dimension}')
+
+            data = array('f')
+            for vector in vectors:
+                data.extend(vector)
+
+            with open(path, 'r+b') as f:
+                # drop the partial row left by a crash
+                f.seek(HEADER.size + self.rows * dimension * ITEM_SIZE)
+                data.tofile(f)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+            start = self.rows
+            self.rows += len(vectors)
+            try:
+                self.connection.execute("BEGIN TRANSACTION")
+                self.connection.executemany(
+                    INSERT_EMBEDDING, [(start + i, model, content_hash) for i, content_hash in enumerate(hashes)]
+                )
+                rows = dict(self.connection.execute(SELECT_EMBEDDING_ROW, (model, json.dumps(list(hashes)))).fetchall())
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+
+            return rows
+
+    def assignChunks(self, model: str, chunks: Sequence[tuple[str, str]]) -> None:
+        """ map each (chunk id, hash of its text) to the row of the text, which must be
+        stored. A tombstone row is revived """
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN TRANSACTION")
+                previous = [
+                    row for _, row in self.connection.execute(
+                        SELECT_CHUNK_ROW, (model, json.dumps([chunk_id for chunk_id, _ in chunks]))
+                    ).fetchall()
+                ]
+                rows: list[int] = []
+                for chunk_id, content_hash in chunks:
+                    rows.extend(row for row, in self.connection.execute(
+                        INSERT_EMBEDDING_CHUNK, (chunk_id, model, content_hash)
+                    ).fetchall())
+
+                self.connection.execute(UPDATE_TOMBSTONE, (json.dumps(previous + rows),))
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+
+    def removeChunks(self, model: str, chunk_ids: Sequence[str]) -> None:
+        """ the rows left without a chunk become tombstones """
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN TRANSACTION")
+                rows = [
+                    row for row, in self.connection.execute(
+                        DELETE_EMBEDDING_CHUNK, (model, json.dumps(list(chunk_ids)))
+                    ).fetchall()
+                ]
+                self.connection.execute(UPDATE_TOMBSTONE, (json.dumps(rows),))
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+
+    def getChunkRows(self, model: str, chunk_ids: Sequence[str]) -> dict[str, int]:
+        with self.lock:
+            return dict(self.connection.execute(SELECT_CHUNK_ROW, (model, json.dumps(list(chunk_ids)))).fetchall())
+
+    def getVectors(self, rows: Iterable[int]) -> list[array]:
+        """ copies of the vectors of the rows """
+        with self.lock:
+            row_size = self.dimension * ITEM_SIZE
+            if self.mapping is None or len(self.mapping) < HEADER.size + self.rows * row_size:
+                # the matrix grew since it was mapped
+                if self.mapping is not None:
+                    self.mapping.close()
+
+                with open(self.getMatrixPath(self.generation), 'rb') as f:
+                    self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            vectors = []
+            for row in rows:
+                if not 0 <= row < self.rows:
+                    raise IndexError(f'row {row} out of the {self.rows} rows of the embedding matrix')
+
+                start = HEADER.size + row * row_size
+                vector = array('f')
+                vector.frombytes(self.mapping[start:start + row_size])
+                vectors.append(vector)
+
+            return vectors
+
+    def needsCompaction(self) -> bool:
+        """ whether the tombstones and the rows left by a crash are a quarter of the matrix """
+        stats = self.getStats()
+        return self.rows > 0 and (stats.tombstones + self.rows - stats.rows) * 4 >= self.rows
+
+    def compact(self) -> bool:
+        """ rewrite the matrix without the tombstones into the next generation, the rows
+        are renumbered in the same transaction which switches the generation """
+        with self.lock:
+            if self.dimension == 0:
+                return False
+
+            live = [row for row, in self.connection.execute(SELECT_LIVE_ROW).fetchall()]
+            row_size = self.dimension * ITEM_SIZE
+            old_path = self.getMatrixPath(self.generation)
+            new_path = self.getMatrixPath(self.generation + 1)
+            with open(old_path, 'rb') as source, open(new_path, 'wb') as target:
+                target.write(HEADER.pack(MAGIC, VERSION, self.dimension))
+                for row in live:
+                    source.seek(HEADER.size + row * row_size)
+                    target.write(source.read(row_size))
+
+                target.flush()
+                os.fsync(target.fileno())
+
+            try:
+                self.connection.execute("BEGIN TRANSACTION")
+                self.connection.execute(DELETE_TOMBSTONE)
+                renumbered = [(i, row) for i, row in enumerate(live) if i != row]
+                self.connection.executemany(UPDATE_CHUNK_ROW, renumbered)
+                self.connection.executemany(UPDATE_EMBEDDING_ROW, renumbered)
+                self.connection.execute(UPDATE_GENERATION, (self.generation + 1,))
+                self.connection.commit()
+            except Exception as ex:
+                logger.error(f'failed to compact embedding store {self.db_path}: {ex}')
+                self.connection.rollback()
+                new_path.unlink()
+                return False
+
+            if self.mapping is not None:
+                # a mapped file cannot be removed on Windows
+                self.mapping.close()
+                self.mapping = None
+
+            old_path.unlink()
+            logger.info(f'embedding store {self.db_path} compacted from {self.rows} to {len(live)} rows')
+            self.generation += 1
+            self.rows = len(live)
+            return True
+
+    def getStats(self) -> EmbeddingStoreStats:
+        with self.lock:
+            rows, tombstones = self.connection.execute(SELECT_EMBEDDING_COUNT).fetchone()
+            chunks = self.connection.execute(SELECT_CHUNK_COUNT).fetchone()[0]
+
+        return EmbeddingStoreStats(
+            dimension=self.dimension,
+            matrix_rows=self.rows,
+            rows=rows,
+            tombstones=tombstones,
+            chunks=chunks,
+            matrix_size=HEADER.size + self.rows * self.dimension * ITEM_SIZE
+        )
@@ -1,6 +1,11 @@
 from flicker.services.memory.base import AbstractDataSource
-from flicker.services.memory.fs.scanner import FileScanner, FileScanningOptions
+from flicker.services.memory.fs.scanner import FileScanner, FileScanningOptions, FileScanningResult, ScanPriority
+from flicker.services.memory.fs.extractor import ContentExtractor, ContentExtractionOptions, ContentExtractionResult
+from flicker.services.memory.fs.fingerprint import FileFingerprinter, FingerprintingOptions, FingerprintingResult
+from flicker.services.memory.fs.watcher import FileSystemWatcherService
+from flicker.services.memory.fs.shards import StorageShards, getShardPath
 from pydantic import BaseModel, Field
+from pathlib import Path
 from typing import Literal, Callable
 
 
@@ -18,14 +23,56 @@ class FileSystemDataSource(BaseModel, AbstractDataSource):
     root_directory: str
     extension_names: list[str] = Field(default_factory=lambda: list(DEFAULT_SUPPORTED_EXTENSIONS))
     excluded_directories: list[str] = Field(default_factory=list)
+    # the database of the source, named after the root directory when empty. A relative
+    # path is placed in the directory of the shards, see StorageShards
     database_file: str = ""
+    incremental: bool = True
+    parallelism: int = Field(default=4, ge=1)
+    streaming: bool = True
+    watch: bool = False
+    priority: ScanPriority = ScanPriority.NORMAL
+    extract_content: bool = True
 
-    def startUpdate(self, on_finished: Callable[[], None] | None = None):
-        FileScanner.startScanning(FileScanningOptions(
+    def getScanningOptions(self) -> FileScanningOptions:
+        return FileScanningOptions(
             root_directory=self.root_directory,
             extension_names=set(self.extension_names),
-            excluded_directories=self.excluded_directories
-        ))
+            excluded_directories=self.excluded_directories,
+            nested_roots=StorageShards.getInstance().getNestedRoots(self.root_directory),
+            incremental=self.incremental,
+            parallelism=self.parallelism,
+            streaming=self.streaming
+        )
+
+    def getDatabasePath(self) -> Path:
+        return getShardPath(StorageShards.getInstance().directory, self.root_directory, self.database_file)
+
+    def getExtractionOptions(self) -> ContentExtractionOptions:
+        return ContentExtractionOptions(
+            root_directory=self.root_directory,
+            extension_names=set(self.extension_names)
+        )
+
+    def startUpdate(self, on_finished: Callable[[], None] | None = None):
+        def onScanningFinished(result: FileScanningResult) -> None:
+            # called in the working thread of the scanner
+            if self.extract_content and not result.cancelled:
+                # fingerprints let the extraction copy the chunks of duplicated files
+                FileFingerprinter.startFingerprinting(FingerprintingOptions(root_directory=self.root_directory), onFingerprintingFinished)
+            elif on_finished is not None:
+                on_finished()
+
+        def onFingerprintingFinished(result: FingerprintingResult) -> None:
+            ContentExtractor.requestExtraction(self.getExtractionOptions(), onExtractionFinished)
+
+        def onExtractionFinished(result: ContentExtractionResult) -> None:
+            if on_finished is not None:
+                on_finished()
+
+        FileScanner.startScanning(self.getScanningOptions(), onScanningFinished, priority=self.priority)
+        if self.watch:
+            # changes during the initial scan are applied as well, upserts are idempotent
+            FileSystemWatcherService.startWatching(self.getScanningOptions())
 
     def save(self) -> None:
         pass
@@ -0,0 +1,274 @@
+from pydantic import BaseModel
+from typing import Iterable, Optional
+from os.path import isabs, isfile, join, dirname, normcase
+from loguru import logger
+
+import os
+import re
+
+
+IGNORE_FILE_NAME = ".flickerignore"
+
+GLOB_CHARACTERS = re.compile(r'[*?\[]')
+
+
+class ExclusionRule(BaseModel):
+    """ a single gitignore-style pattern, `base` is the directory (relative to the scanning
+    root, using `/` as separator) of the ignore file which defines the rule """
+    pattern: str
+    base: str = ""
+    negated: bool = False
+    directory_only: bool = False
+    anchored: bool = False
+
+    @classmethod
+    def parse(cls, line: str, base: str = "") -> Optional['ExclusionRule']:
+        line = line.rstrip('\n').rstrip('\r')
+        if line.strip() == "" or line.startswith('#'):
+            return None
+
+        line = line.strip()
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        elif line.startswith('\\'):
+            line = line[1:]
+
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line == "":
+            return None
+
+        # a pattern with a separator at the beginning or in the middle is relative to its base,
+        # otherwise it matches the name at any depth
+        anchored = '/' in line
+        return ExclusionRule(
+            pattern=line.lstrip('/'),
+            base=base,
+            negated=negated,
+            directory_only=directory_only,
+            anchored=anchored
+        )
+
+    def isLiteralName(self) -> bool:
+        return not self.anchored and GLOB_CHARACTERS.search(self.pattern) is None
+
+    def toRegex(self) -> str:
+        parts = self.pattern.split('/')
+        regex = re.escape(self.base + '/') if self.anchored and self.base != "" else ""
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if part == '**':
+                regex += '.*' if last else '(?:[^/]+/)*'
+            else:
+                regex += translateGlobSegment(part) + ('' if last else '/')
+
+        return regex
+
+
+def translateGlobSegment(segment: str) -> str:
+    regex = ''
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        i += 1
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = segment.find(']', i + 1 if i < len(segment) and segment[i] in '!^' else i)
+            if end == -1:
+                regex += re.escape(c)
+                continue
+
+            content = segment[i:end]
+            i = end + 1
+            if content[:1] in ('!', '^'):
+                content = '^' + content[1:]
+
+            regex += '[' + content.replace('\\', '\\\\') + ']'
+        elif c == '\\' and i < len(segment):
+            regex += re.escape(segment[i])
+            i += 1
+        else:
+            regex += re.escape(c)
+
+    return regex
+
+
+def buildPrefixRegex(prefixes: Iterable[str]) -> Optional[re.Pattern]:
+    """ compile the literal prefixes into a regex shaped like a prefix trie, so matching
+    a path never tries more than one branch per character """
+    trie: dict = dict()
+    for prefix in prefixes:
+        node = trie
+        for c in prefix:
+            node = node.setdefault(c, dict())
+
+        node[''] = dict()
+
+    if len(trie) == 0:
+        return None
+
+    def toRegex(node: dict) -> str:
+        if '' in node:
+            # a shorter prefix matches already, longer ones are redundant
+            return ''
+
+        branches = [re.escape(c) + toRegex(child) for c, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    return re.compile(toRegex(trie))
+
+
+class CompiledRuleSet:
+    """ rules compiled for matching either directories or files. The last matching rule
+    wins like gitignore; alternatives are ordered from the last rule to the first so the
+    first successful alternative is the deciding one """
+
+    def __init__(self, rules: list[ExclusionRule]) -> None:
+        self.rules = rules
+        # literal names are answered by a single dictionary lookup
+        self.literal_names: dict[str, int] = dict()
+        name_patterns: list[tuple[int, str]] = []
+        path_patterns: list[tuple[int, str]] = []
+        for i, rule in enumerate(rules):
+            if rule.isLiteralName():
+                self.literal_names[rule.pattern] = i
+            elif rule.anchored:
+                path_patterns.append((i, rule.toRegex()))
+            else:
+                name_patterns.append((i, rule.toRegex()))
+
+        self.name_regex, self.name_indices = self.compile(name_patterns)
+        self.path_regex, self.path_indices = self.compile(path_patterns)
+
+    @staticmethod
+    def compile(patterns: list[tuple[int, str]]) -> tuple[Optional[re.Pattern], list[int]]:
+        if len(patterns) == 0:
+            return None, []
+
+        patterns = sorted(patterns, reverse=True)
+        regex = '|'.join(f'({pattern})' for _, pattern in patterns)
+        return re.compile(f'(?:{regex})\\Z', re.DOTALL), [i for i, _ in patterns]
+
+    def match(self, relative_path: str, name: str) -> Optional[ExclusionRule]:
+        """ returns the deciding rule of the path, None if no rule matches """
+        index = self.literal_names.get(name, -1)
+        if self.name_regex is not None:
+            m = self.name_regex.match(name)
+            if m is not None and m.lastindex is not None:
+                index = max(index, self.name_indices[m.lastindex - 1])
+
+        if self.path_regex is not None:
+            m = self.path_regex.match(relative_path)
+            if m is not None and m.lastindex is not None:
+                index = max(index, self.path_indices[m.lastindex - 1])
+
+        return None if index < 0 else self.rules[index]
+
+
+class ExclusionRules:
+    """ compiled exclusion rules of a scanning root. Absolute paths without glob characters
+    in `excluded_directories` keep the legacy prefix semantic, the other entries and the
+    content of `.flickerignore` files are gitignore-style patterns. Rules defined by an
+    ignore file apply to the subtree of the directory containing the file. The roots of
+    other data sources nested in the root are skipped, their files are in their own shard """
+
+    def __init__(
+        self, root_directory: str, prefixes: list[str], rules: list[ExclusionRule],
+        nested_roots: frozenset[str] = frozenset()
+    ) -> None:
+        self.root_directory = root_directory
+        # normalized by normcase, the paths are matched case insensitively on Windows
+        self.prefixes = prefixes
+        self.nested_roots = nested_roots
+        self.rules = rules
+        self.prefix_regex = buildPrefixRegex(prefixes)
+        self.directory_rules = CompiledRuleSet(rules)
+        self.file_rules = CompiledRuleSet([rule for rule in rules if not rule.directory_only])
+
+    @classmethod
+    def compile(
+        cls, root_directory: str, excluded_directories: list[str], nested_roots: Iterable[str] = ()
+    ) -> 'ExclusionRules':
+        prefixes: list[str] = []
+        rules: list[ExclusionRule] = []
+        root = normcase(root_directory)
+        for exclude in excluded_directories:
+            # absolute paths under the root are legacy prefixes, while `/build` is a pattern
+            # anchored to the root like in gitignore
+            if isabs(exclude) and normcase(exclude).startswith(root) and GLOB_CHARACTERS.search(exclude) is None:
+                prefixes.append(normcase(exclude))
+                continue
+
+            rule = ExclusionRule.parse(exclude)
+            if rule is not None:
+                rules.append(rule)
+
+        return ExclusionRules(root_directory, prefixes, rules, frozenset(normcase(root) for root in nested_roots))
+
+    def getRelativePath(self, path: str) -> str:
+        relative_path = path[len(self.root_directory):].lstrip('/' + os.sep)
+        return relative_path if os.sep == '/' else relative_path.replace(os.sep, '/')
+
+    def extend(self, directory: str, lines: Iterable[str]) -> 'ExclusionRules':
+        """ returns the rules of the directory after applying its ignore file """
+        base = self.getRelativePath(directory)
+        rules = list(self.rules)
+        for line in lines:
+            rule = ExclusionRule.parse(line, base)
+            if rule is not None:
+                rules.append(rule)
+
+        if len(rules) == len(self.rules):
+            return self
+
+        return ExclusionRules(self.root_directory, self.prefixes, rules, self.nested_roots)
+
+    def loadIgnoreFile(self, directory: str) -> 'ExclusionRules':
+        try:
+            with open(join(directory, IGNORE_FILE_NAME), 'r', encoding='utf-8') as f:
+                return self.extend(directory, f.readlines())
+        except OSError as ex:
+            logger.warning(f'failed to read ignore file in {directory}: {ex}')
+            return self
+
+    def resolve(self, directory: str, resolved: dict[str, 'ExclusionRules']) -> 'ExclusionRules':
+        """ returns the rules of a directory under the root by applying the ignore files
+        of its ancestors, `resolved` caches the rules of the visited ancestors """
+        if directory in resolved:
+            return resolved[directory]
+
+        if len(directory) <= len(self.root_directory) or not normcase(directory).startswith(normcase(self.root_directory)):
+            rules = self
+        else:
+            rules = self.resolve(dirname(directory), resolved)
+
+        if isfile(join(directory, IGNORE_FILE_NAME)):
+            rules = rules.loadIgnoreFile(directory)
+
+        resolved[directory] = rules
+        return rules
+
+    def isExcludedRoot(self) -> bool:
+        """ patterns never apply to the root itself, only the legacy prefixes do """
+        return self.prefix_regex is not None and self.prefix_regex.match(normcase(self.root_directory)) is not None
+
+    def isExcludedDirectory(self, path: str, name: str) -> bool:
+        if self.prefix_regex is not None and self.prefix_regex.match(normcase(path)) is not None:
+            return True
+
+        if normcase(path) in self.nested_roots:
+            return True
+
+        rule = self.directory_rules.match(self.getRelativePath(path), name)
+        return rule is not None and not rule.negated
+
+    def isExcludedFile(self, path: str, name: str) -> bool:
+        if len(self.file_rules.rules) == 0:
+            return False
+
+        rule = self.file_rules.match(self.getRelativePath(path), name)
+        return rule is not None and not rule.negated
@@ -0,0 +1,382 @@
+from flicker.services.memory.fs.storage import StoragePriority, FileContentState
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.parsers import (
+    ExtractionLimits, ExtractedFile, extractFile, initializeWorker, getSupportedExtensions
+)
+
+from PySide6.QtCore import QThread, QObject, Signal
+from pydantic import BaseModel, Field
+from typing import Optional, Callable
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from os.path import splitext
+from time import monotonic, time
+from loguru import logger
+from traceback import format_exc
+from uuid import UUID, uuid4
+
+import multiprocessing
+import os
+
+
+# seconds between the checks of the deadlines of the files being extracted
+DEADLINE_CHECK_INTERVAL = 1.0
+
+
+def terminateWorkers(executor: ProcessPoolExecutor) -> None:
+    """ kill the worker processes, a parser stuck in C code never sees the interrupt of
+    the watchdog and would keep its worker forever """
+    terminate = getattr(executor, 'terminate_workers', None)
+    if terminate is not None:
+        terminate()
+        return
+
+    # before Python 3.14 the processes are only reachable through the executor internals
+    processes = getattr(executor, '_processes', None) or dict()
+    for process in list(processes.values()):
+        process.terminate()
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ContentExtractionOptions(BaseModel):
+    root_directory: str
+    extension_names: set[str] = Field(default_factory=lambda: {'.txt', '.docx', '.pptx', '.pdf'})
+    max_workers: int = Field(default_factory=lambda: max(1, (os.cpu_count() or 2) // 2), ge=1)
+    # limits of a single file, a file exceeding them is recorded and skipped until it changes
+    time_limit: float = 30.0
+    # seconds after the time limit before the pool is recycled, when the worker did not
+    # give up on the file by itself
+    time_limit_grace: float = 10.0
+    memory_limit: int = 1024 * 1024 * 1024
+    max_file_size: int = 64 * 1024 * 1024
+    max_text_length: int = 4 * 1024 * 1024
+    chunk_size: int = Field(default=1000, ge=100)
+    chunk_overlap: int = Field(default=100, ge=0)
+    # number of files committed in a transaction
+    batch_size: int = Field(default=64, ge=1)
+
+    def getLimits(self) -> ExtractionLimits:
+        return ExtractionLimits(
+            time_limit=self.time_limit,
+            max_file_size=self.max_file_size,
+            max_text_length=self.max_text_length,
+            chunk_size=self.chunk_size,
+            chunk_overlap=min(self.chunk_overlap, self.chunk_size // 2)
+        )
+
+
+class ContentExtractionResult(BaseModel):
+    total_files: int = 0
+    unchanged_files: int = 0
+    extracted_files: int = 0
+    # files whose chunks are copied from another file with the same content
+    duplicate_files: int = 0
+    failed_files: int = 0
+    total_chunks: int = 0
+    total_bytes: int = 0
+    elapsed: float = 0.0
+    cancelled: bool = False
+
+    @property
+    def files_per_second(self) -> float:
+        return self.extracted_files / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.total_bytes / 1024 / 1024 / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ContentExtractorInstance(QObject):
+    """ extracts the text of the scanned documents in a process pool and stores it as
+    chunks next to the file info. Files whose size and modified time are unchanged since
+    the last extraction are skipped """
+
+    extractionFinished = Signal()
+
+    def __init__(self, options: ContentExtractionOptions) -> None:
+        super().__init__()
+        self.instance_id = uuid4()
+        self.options = options
+        self.working_thread = QThread()
+        self.result = ContentExtractionResult()
+        self.callbacks: list[Callable[[ContentExtractionResult], None]] = []
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def getPendingFiles(self) -> list[FileContentState]:
+        extensions = getSupportedExtensions().intersection(self.options.extension_names)
+        pending = []
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+        states = service.read(
+            lambda storage: storage.getContentStates(self.options.root_directory), StoragePriority.BACKGROUND
+        )
+        for state in states:
+            if splitext(state.file_path)[1].lower() not in extensions:
+                continue
+
+            self.result.total_files += 1
+            if state.unchanged:
+                self.result.unchanged_files += 1
+            else:
+                pending.append(state)
+
+        return pending
+
+    def createExecutor(self) -> ProcessPoolExecutor:
+        # fork is unsafe in a process running Qt threads
+        return ProcessPoolExecutor(
+            max_workers=self.options.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=initializeWorker,
+            initargs=(self.options.memory_limit,)
+        )
+
+    def collect(self, state: FileContentState, extracted: ExtractedFile, contents: list) -> None:
+        if extracted.status == 'ok':
+            self.result.extracted_files += 1
+            self.result.total_chunks += len(extracted.chunks)
+            self.result.total_bytes += extracted.file_size
+        else:
+            self.result.failed_files += 1
+            logger.warning(f'failed to extract {state.file_path}: {extracted.status} {extracted.error}')
+
+        contents.append((state, extracted.status, extracted.chunks))
+
+    def startExtraction(self, pending: list[FileContentState]) -> None:
+        shards = StorageShards.getInstance()
+        service = shards.getService(self.options.root_directory)
+        background = StoragePriority.BACKGROUND
+        limits = self.options.getLimits()
+        contents: list[tuple[FileContentState, str, list[str]]] = []
+        max_in_flight = self.options.max_workers * 4
+        in_flight: dict[Future, FileContentState] = dict()
+        # when each file was seen running first, the files waiting for a worker have no deadline
+        running: dict[Future, float] = dict()
+        deadline = self.options.time_limit + self.options.time_limit_grace
+        queued = list(reversed(pending))
+        start = time()
+
+        # copies of a file being extracted wait for its result instead of being parsed again
+        fingerprints = service.read(lambda storage: storage.getFingerprints(self.options.root_directory), background)
+        duplicates: dict[str, list[FileContentState]] = dict()
+
+        def submit(state: FileContentState) -> None:
+            fingerprint = fingerprints.get(state.file_path)
+            if fingerprint is not None:
+                if fingerprint in duplicates:
+                    duplicates[fingerprint].append(state)
+                    return
+
+                # the copy may be held by the shard of another data source
+                chunks = shards.findDuplicateChunks(state.file_path, fingerprint, background)
+                if chunks is not None:
+                    self.result.duplicate_files += 1
+                    contents.append((state, 'ok', chunks))
+                    return
+
+                duplicates[fingerprint] = []
+
+            dispatch(state)
+
+        def dispatch(state: FileContentState) -> None:
+            in_flight[executor.submit(extractFile, state.file_path, limits)] = state
+
+        def collect(state: FileContentState, extracted: ExtractedFile) -> None:
+            self.collect(state, extracted, contents)
+            fingerprint = fingerprints.get(state.file_path)
+            if fingerprint is not None:
+                for duplicate in duplicates.pop(fingerprint, []):
+                    self.result.duplicate_files += 1
+                    contents.append((duplicate, extracted.status, extracted.chunks))
+
+        executor = self.createExecutor()
+        try:
+            while (len(queued) > 0 or len(in_flight) > 0) and not self.cancelled:
+                while len(queued) > 0 and len(in_flight) < max_in_flight:
+                    submit(queued.pop())
+
+                if len(in_flight) == 0:
+                    continue
+
+                done, _ = wait(list(in_flight.keys()), timeout=DEADLINE_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+                now = monotonic()
+                for future in in_flight:
+                    if future not in running and future.running():
+                        running[future] = now
+
+                broken = False
+                for future in done:
+                    state = in_flight.pop(future)
+                    running.pop(future, None)
+                    try:
+                        extracted = future.result()
+                    except BrokenProcessPool:
+                        # a worker crashed, e.g. killed by the system, the files in flight are
+                        # recorded as failed so they are not retried until they change
+                        broken = True
+                        extracted = ExtractedFile(state.file_path, 'failed', [], state.file_size, 'worker crashed')
+                    except Exception as ex:
+                        extracted = ExtractedFile(state.file_path, 'failed', [], state.file_size, str(ex))
+
+                    collect(state, extracted)
+
+                if broken:
+                    for future, state in in_flight.items():
+                        extracted = ExtractedFile(state.file_path, 'failed', [], state.file_size, 'worker crashed')
+                        collect(state, extracted)
+
+                    in_flight.clear()
+                    running.clear()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = self.createExecutor()
+
+                expired = [future for future, started in running.items() if now - started > deadline]
+                if not broken and len(expired) > 0:
+                    for future in expired:
+                        state = in_flight.pop(future)
+                        extracted = ExtractedFile(
+                            state.file_path, 'timeout', [], state.file_size, f'worker stuck for more than {deadline} seconds'
+                        )
+                        collect(state, extracted)
+
+                    # the other files in flight are extracted again by the new workers
+                    requeued = list(in_flight.values())
+                    in_flight.clear()
+                    running.clear()
+                    logger.warning(f'{len(expired)} workers stuck, recycle the extraction pool')
+                    terminateWorkers(executor)
+                    executor = self.createExecutor()
+                    for state in requeued:
+                        dispatch(state)
+
+                if len(contents) >= self.options.batch_size:
+                    service.write(lambda storage: storage.saveContents(contents), background)
+                    contents = []
+                    self.reportThroughput(time() - start)
+        finally:
+            executor.shutdown(wait=not self.cancelled, cancel_futures=True)
+
+        if len(contents) > 0:
+            service.write(lambda storage: storage.saveContents(contents), background)
+
+        self.result.elapsed = time() - start
+
+    def reportThroughput(self, elapsed: float) -> None:
+        self.result.elapsed = elapsed
+        logger.info(
+            f'extracted {self.result.extracted_files} files, {self.result.total_chunks} chunks, '
+            f'{self.result.duplicate_files} duplicates copied, '
+            f'{self.result.files_per_second:.2f} files/sec, {self.result.megabytes_per_second:.2f} MB/sec'
+        )
+
+    def start(self) -> None:
+        logger.info(f'start content extraction: {self.options.root_directory}')
+        try:
+            pending = self.getPendingFiles()
+            logger.info(
+                f'{len(pending)} files to extract, {self.result.unchanged_files} unchanged files skipped'
+            )
+            if len(pending) > 0:
+                self.startExtraction(pending)
+                self.reportThroughput(self.result.elapsed)
+        except Exception as ex:
+            logger.error(f'content extraction of {self.options.root_directory} failed: {ex}')
+            logger.info(format_exc())
+
+        self.result.cancelled = self.cancelled
+        self.extractionFinished.emit()
+
+
+class ContentExtractorEvents(QObject):
+    """ lives in the main thread, requests from worker threads are queued to it """
+    extractionRequested = Signal(object, object)
+    extractionFinished = Signal(object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.extractionRequested.connect(self.onExtractionRequested)
+        self.extractionFinished.connect(self.onExtractionFinished)
+
+    def onExtractionRequested(
+        self, options: ContentExtractionOptions,
+        callback: Optional[Callable[[ContentExtractionResult], None]]
+    ) -> None:
+        ContentExtractor.startExtraction(options, callback)
+
+    def onExtractionFinished(self, inst: ContentExtractorInstance) -> None:
+        ContentExtractor.finalizeExtraction(inst)
+
+
+class ContentExtractor:
+    """ runs at most one extraction per root directory, a request for a root which is
+    being extracted is deferred until the running extraction finishes """
+
+    extraction_tasks: dict[UUID, ContentExtractorInstance] = dict()
+    pending_tasks: list[ContentExtractorInstance] = []
+
+    _events: Optional[ContentExtractorEvents] = None
+
+    @classmethod
+    def getEvents(cls) -> ContentExtractorEvents:
+        if cls._events is None:
+            cls._events = ContentExtractorEvents()
+
+        return cls._events
+
+    @classmethod
+    def startExtraction(
+        cls, options: ContentExtractionOptions,
+        callback: Callable[[ContentExtractionResult], None] | None = None
+    ) -> UUID:
+        cls.getEvents()
+        for task in cls.pending_tasks:
+            if task.options == options:
+                if callback is not None:
+                    task.callbacks.append(callback)
+                return task.instance_id
+
+        inst = ContentExtractorInstance(options)
+        if callback is not None:
+            inst.callbacks.append(callback)
+
+        cls.pending_tasks.append(inst)
+        cls.schedule()
+        return inst.instance_id
+
+    @classmethod
+    def requestExtraction(
+        cls, options: ContentExtractionOptions,
+        callback: Callable[[ContentExtractionResult], None] | None = None
+    ) -> None:
+        """ thread safe version of startExtraction, the task is scheduled in the main thread """
+        cls.getEvents().extractionRequested.emit(options, callback)
+
+    @classmethod
+    def schedule(cls) -> None:
+        running = [task.options.root_directory for task in cls.extraction_tasks.values()]
+        for task in list(cls.pending_tasks):
+            if task.options.root_directory not in running:
+                cls.pending_tasks.remove(task)
+                running.append(task.options.root_directory)
+                cls.launch(task)
+
+    @classmethod
+    def launch(cls, inst: ContentExtractorInstance) -> None:
+        cls.extraction_tasks[inst.instance_id] = inst
+        inst.working_thread.started.connect(inst.start)
+        inst.extractionFinished.connect(inst.working_thread.quit)
+        # emitted from the finished working thread, the callbacks run in the main thread
+        inst.working_thread.finished.connect(lambda: cls.getEvents().extractionFinished.emit(inst))
+        inst.moveToThread(inst.working_thread)
+        inst.working_thread.start()
+
+    @classmethod
+    def finalizeExtraction(cls, inst: ContentExtractorInstance) -> None:
+        cls.extraction_tasks.pop(inst.instance_id, None)
+        for callback in inst.callbacks:
+            callback(inst.result)
+
+        cls.schedule()
@@ -0,0 +1,189 @@
+from flicker.services.memory.fs.storage import StoragePriority, FileContentState
+from flicker.services.memory.fs.shards import StorageShards
+
+from pydantic import BaseModel, Field
+from typing import Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from hashlib import blake2b
+from time import time
+from loguru import logger
+from traceback import format_exc
+
+import os
+
+
+# bytes hashed from each end of the file for the sample hash
+SAMPLE_SIZE = 64 * 1024
+
+FULL_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def getSampleHash(path: str, file_size: int) -> str:
+    """ hash of the size, head and tail of the file. A file no larger than two samples is
+    hashed entirely, so its sample hash is its full hash as well """
+    digest = blake2b(digest_size=20)
+    digest.update(file_size.to_bytes(8, 'little'))
+    with open(path, 'rb') as f:
+        if file_size <= 2 * SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(SAMPLE_SIZE))
+            f.seek(file_size - SAMPLE_SIZE)
+            digest.update(f.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def getFullHash(path: str) -> str:
+    digest = blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(FULL_HASH_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class FingerprintingOptions(BaseModel):
+    root_directory: str
+    # hashing is mostly waiting for the disk, hashlib releases the GIL for large buffers
+    max_workers: int = Field(default=4, ge=1)
+    batch_size: int = Field(default=1000, ge=1)
+
+
+class FingerprintingResult(BaseModel):
+    total_files: int = 0
+    unchanged_files: int = 0
+    sampled_files: int = 0
+    fully_hashed_files: int = 0
+    failed_files: int = 0
+    elapsed: float = 0.0
+
+
+class FileFingerprinterInstance:
+    """ computes the content fingerprints of the files under a root. Every changed file
+    gets a cheap sample hash, the full hash is only computed for the files whose sample
+    hash collides with another file """
+
+    def __init__(self, options: FingerprintingOptions) -> None:
+        self.options = options
+        self.result = FingerprintingResult()
+        self.callbacks: list[Callable[[FingerprintingResult], None]] = []
+        self.thread = Thread(target=self.start, daemon=True)
+
+    def hashSample(self, state: FileContentState) -> Optional[tuple[FileContentState, str, Optional[str]]]:
+        try:
+            sample_hash = getSampleHash(state.file_path, state.file_size)
+        except OSError as ex:
+            logger.warning(f'failed to fingerprint {state.file_path}: {ex}')
+            return None
+
+        full_hash = sample_hash if state.file_size <= 2 * SAMPLE_SIZE else None
+        return state, sample_hash, full_hash
+
+    def hashFull(self, state: FileContentState) -> Optional[tuple[str, str]]:
+        try:
+            stat = os.stat(state.file_path)
+            if stat.st_size != state.file_size or int(stat.st_mtime) != state.modified_time:
+                # changed after its sample hash was taken, it is sampled again by the next run
+                return None
+
+            return state.file_path, getFullHash(state.file_path)
+        except OSError as ex:
+            logger.warning(f'failed to fully hash {state.file_path}: {ex}')
+            return None
+
+    def startFingerprinting(self) -> None:
+        shards = StorageShards.getInstance()
+        service = shards.getService(self.options.root_directory)
+        background = StoragePriority.BACKGROUND
+        pending = []
+        states = service.read(lambda storage: storage.getFingerprintStates(self.options.root_directory), background)
+        for state in states:
+            self.result.total_files += 1
+            if state.unchanged:
+                self.result.unchanged_files += 1
+            else:
+                pending.append(state)
+
+        with ThreadPoolExecutor(max_workers=self.options.max_workers) as executor:
+            for i in range(0, len(pending), self.options.batch_size):
+                batch = pending[i:i + self.options.batch_size]
+                fingerprints = [item for item in executor.map(self.hashSample, batch) if item is not None]
+                self.result.sampled_files += len(fingerprints)
+                self.result.failed_files += len(batch) - len(fingerprints)
+                service.write(lambda storage: storage.saveFingerprints(fingerprints), background)
+
+            # collisions are checked against the files of every shard, the full hash of a
+            # file is saved in its own shard
+            for shard, batch in shards.getCollidedFingerprints(background, self.options.batch_size):
+                hashes = [item for item in executor.map(self.hashFull, batch) if item is not None]
+                self.result.fully_hashed_files += len(hashes)
+                self.result.failed_files += len(batch) - len(hashes)
+                shard.write(lambda storage: storage.saveFullHashes(hashes), background)
+
+    def start(self) -> None:
+        logger.info(f'start fingerprinting: {self.options.root_directory}')
+        start = time()
+        try:
+            self.startFingerprinting()
+        except Exception as ex:
+            logger.error(f'fingerprinting of {self.options.root_directory} failed: {ex}')
+            logger.info(format_exc())
+
+        self.result.elapsed = time() - start
+        logger.info(
+            f'fingerprinting takes {self.result.elapsed:.2f} seconds, {self.result.sampled_files} sampled, '
+            f'{self.result.fully_hashed_files} fully hashed, {self.result.unchanged_files} unchanged files skipped'
+        )
+        FileFingerprinter.finalizeFingerprinting(self)
+
+
+class FileFingerprinter:
+    """ runs the fingerprinting in background threads, at most one per root directory.
+    A request for a root being fingerprinted runs again after the current one finishes """
+
+    running_tasks: dict[str, FileFingerprinterInstance] = dict()
+    pending_tasks: dict[str, FileFingerprinterInstance] = dict()
+    lock = Lock()
+
+    @classmethod
+    def startFingerprinting(
+        cls, options: FingerprintingOptions,
+        callback: Callable[[FingerprintingResult], None] | None = None
+    ) -> None:
+        """ thread safe, the callback is called in the background thread """
+        root = options.root_directory
+        with cls.lock:
+            inst = cls.pending_tasks.get(root)
+            if inst is not None:
+                if callback is not None:
+                    inst.callbacks.append(callback)
+                return
+
+            inst = FileFingerprinterInstance(options)
+            if callback is not None:
+                inst.callbacks.append(callback)
+
+            if root in cls.running_tasks:
+                cls.pending_tasks[root] = inst
+            else:
+                cls.running_tasks[root] = inst
+                inst.thread.start()
+
+    @classmethod
+    def finalizeFingerprinting(cls, inst: FileFingerprinterInstance) -> None:
+        root = inst.options.root_directory
+        with cls.lock:
+            cls.running_tasks.pop(root, None)
+            pending = cls.pending_tasks.pop(root, None)
+            if pending is not None:
+                cls.running_tasks[root] = pending
+                pending.thread.start()
+
+        for callback in inst.callbacks:
+            callback(inst.result)
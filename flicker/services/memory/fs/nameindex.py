@@ -0,0 +1,845 @@
+""" in process index of the file names for the search of the hotkey window, answering a
+keystroke without a query to SQLite. Names are indexed with their pinyin forms and the
+lowercased path, so a term matches the same fields as in `FileSystemStorage.searchFiles`.
+They are indexed by their trigrams, and also by their bigrams so unlike the trigram index
+of the database it covers the two character terms like 合同. The stem of each name, its
+start before the first separator or extension, has a key too, so the files named after a
+term are found whatever their age like with the index of the names of the database.
+
+The entries are ordered by rowid and grouped in blocks of 16. A gram maps to the blocks
+holding it rather than to the entries, as a sorted array of block ids when rare and as a
+bitmap of all blocks when common, so the grams of a query are intersected by a few and
+operations on integers. The blocks left are verified by finding the terms in their texts,
+which are contiguous so a block is searched by a single `rfind`.
+
+The base of the index is a file next to the database mapped in memory, its sections are
+arrays read in place so opening it costs nothing however many files are indexed:
+
+    keys          sorted gram keys, uint64
+    key_offsets   start of the block ids of each key, uint64
+    key_bitmaps   index of the bitmap of each key, -1 for the keys with block ids, int64
+    blocks        block ids, uint32
+    bitmaps       bitmaps of the common keys, bit i of byte j is block 8j + i
+    rowids        rowid of each entry in fileinfo, ascending, int64
+    modified      modified time of each entry, float64
+    name_lengths  length of each name, uint16
+    text_offsets  start of the text of each entry, uint64
+    texts         the lowercased name, pinyin, initials and path each ended by a newline, utf-8
+    path_offsets  start of the path of each entry, uint64
+    paths         the paths, utf-8
+
+Writes of the storage are kept in memory in a delta layer and appended to a journal, the
+journal is replayed when the index is opened again. Once the delta grows large the base
+is rebuilt from the database, see `StorageService.compactNameIndex`. A search ranks the
+latest matches in windows of rowids like the trigram index of the database, the lock is
+only held to collect them """
+from flicker.services.memory.fs.storage import (
+    FileInfoFilter, FileSearchCursor, FileSearchPage, FileCountEstimate
+)
+
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import nlargest
+from pathlib import Path
+from threading import Event, Lock
+from time import monotonic, time
+from typing import Iterable, Iterator, NamedTuple, Optional
+from loguru import logger
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+
+MAGIC = b'FLNI'
+VERSION = 3
+# magic, version, byte order mark, entries, keys, block ids, bitmaps, text bytes, path
+# bytes. The arrays are in the native byte order, a file written on another platform is
+# rebuilt
+HEADER = struct.Struct('=4sII6Q')
+BYTE_ORDER_MARK = 0x01020304
+
+BLOCK_SHIFT = 4
+BLOCK_SIZE = 1 << BLOCK_SHIFT
+
+NONZERO_BYTE = re.compile(rb'[^\x00]')
+# the bytes sorted before '/', a name is named after a term when it is the term followed
+# by one of them or by nothing
+STEM_END = re.compile(rb'[\x00-\x2e]')
+# set in the keys of the stems, the grams never use the highest bit
+NAME_KEY = 1 << 63
+
+
+class FileNameEntry(NamedTuple):
+    rowid: int
+    path: str
+    # the lowercased name, pinyin, initials and path each ended by a newline, utf-8
+    text: bytes
+    modified_time: float
+    name_length: int
+
+
+class FileNameMatch(NamedTuple):
+    rowid: int
+    modified_time: float
+    name_length: int
+    # number of terms found in the name or its pinyin forms rather than only in the path
+    name_hits: int
+    # the path of a match in a delta, the position of a match in the base
+    path: Optional[str]
+    position: int
+
+
+def getIndexText(name_lower: str, pinyin: str, initials: str, path_lower: str) -> str:
+    # the newlines keep a term from matching across the forms or the entries
+    return f"{name_lower}\n{pinyin}\n{initials}\n{path_lower}\n"
+
+
+def countNameHits(text: bytes, terms: list[bytes]) -> int:
+    """ the terms found in the name forms of an entry text, before the path """
+    names = text[:text.rindex(b'\n', 0, len(text) - 1)]
+    return sum(1 for term in terms if term in names)
+
+
+def getTermGrams(term: str) -> set[int]:
+    """ the trigrams of the term as integers, or its bigram if it has only two characters.
+    A bigram never has a bit above 41, a trigram always has as no name contains NUL """
+    if len(term) == 2:
+        return {ord(term[0]) << 21 | ord(term[1])}
+
+    return {ord(a) << 42 | ord(b) << 21 | ord(c) for a, b, c in zip(term, term[1:], term[2:])}
+
+
+def getNameStem(name: bytes) -> bytes:
+    """ the start of a name before its first separator, `report` for `report.pdf` and
+    `report (2).docx`. A name starting with a term has the stem of the term """
+    end = STEM_END.search(name)
+    return name if end is None else name[:end.start()]
+
+
+def getNameKey(stem: bytes) -> int:
+    return NAME_KEY | int.from_bytes(hashlib.blake2b(stem, digest_size=8).digest(), 'little') >> 1
+
+
+def isNamedAfter(text: bytes, terms: list[bytes]) -> bool:
+    """ whether the name of an entry text is a term followed by a separator, an extension
+    or nothing, like the names found by the index of the names of the database """
+    name = text[:text.index(b'\n')]
+    return any(name.startswith(term) and (len(name) == len(term) or name[len(term)] < 0x2f) for term in terms)
+
+
+def getGrams(text: str) -> set[int]:
+    """ the bigrams and trigrams of the text, a gram never spans a newline """
+    grams: set[int] = set()
+    for segment in text.split('\n'):
+        grams.update(ord(a) << 21 | ord(b) for a, b in zip(segment, segment[1:]))
+        grams.update(ord(a) << 42 | ord(b) << 21 | ord(c) for a, b, c in zip(segment, segment[1:], segment[2:]))
+
+    return grams
+
+
+def getEntryKeys(text: bytes) -> set[int]:
+    """ the grams of an entry text and the key of the stem of its name """
+    keys = getGrams(text.decode('utf-8'))
+    keys.add(getNameKey(getNameStem(text[:text.index(b'\n')])))
+    return keys
+
+
+def createEntry(rowid: int, path: str, name_lower: str, pinyin: str, initials: str, modified_time: float) -> FileNameEntry:
+    text = getIndexText(name_lower, pinyin, initials, path.lower())
+    return FileNameEntry(rowid, path, text.encode('utf-8'), float(modified_time), min(len(name_lower), 0xffff))
+
+
+def dumpEntry(entry: FileNameEntry) -> list:
+    return [entry.rowid, entry.path, entry.text.decode('utf-8'), entry.modified_time, entry.name_length]
+
+
+def containsBlock(blocks: memoryview, block: int) -> bool:
+    i = bisect_left(blocks, block)
+    return i < len(blocks) and blocks[i] == block
+
+
+def writeSection(f, section) -> None:
+    f.write(b'\0' * (-f.tell() % 8))
+    if isinstance(section, array):
+        section.tofile(f)
+    else:
+        section.seek(0)
+        while chunk := section.read(1 << 20):
+            f.write(chunk)
+
+
+def writeFileNameIndex(path: Path, entries: Iterable[FileNameEntry], stopped: Optional[Event] = None) -> bool:
+    """ write the base of the index from entries in ascending order of rowid. Returns
+    False when stopped before the end """
+    grams: dict[int, array] = dict()
+    rowids = array('q')
+    modified = array('d')
+    name_lengths = array('H')
+    text_offsets = array('Q', [0])
+    path_offsets = array('Q', [0])
+    # the texts and paths are streamed to temporary files rather than kept in memory
+    with tempfile.TemporaryFile() as texts, tempfile.TemporaryFile() as paths:
+        for position, entry in enumerate(entries):
+            if position % 65536 == 0 and stopped is not None and stopped.is_set():
+                return False
+
+            block = position >> BLOCK_SHIFT
+            for key in getEntryKeys(entry.text):
+                blocks = grams.get(key)
+                if blocks is None:
+                    grams[key] = array('I', [block])
+                elif blocks[-1] != block:
+                    blocks.append(block)
+
+            rowids.append(entry.rowid)
+            modified.append(entry.modified_time)
+            name_lengths.append(entry.name_length)
+            texts.write(entry.text)
+            text_offsets.append(text_offsets[-1] + len(entry.text))
+            encoded_path = entry.path.encode('utf-8')
+            paths.write(encoded_path)
+            path_offsets.append(path_offsets[-1] + len(encoded_path))
+
+        block_count = (len(rowids) + BLOCK_SIZE - 1) >> BLOCK_SHIFT
+        bitmap_size = (block_count + 7) >> 3
+        keys = array('Q', sorted(grams))
+        key_offsets = array('Q', [0])
+        key_bitmaps = array('q')
+        blocks = array('I')
+        with tempfile.TemporaryFile() as bitmaps:
+            for key in keys:
+                key_blocks = grams.pop(key)
+                # a bitmap is smaller than the block ids of a key in more than 1/32 of the blocks
+                if len(key_blocks) * 32 > block_count:
+                    bitmap = bytearray(bitmap_size)
+                    for block in key_blocks:
+                        bitmap[block >> 3] |= 1 << (block & 7)
+                    key_bitmaps.append(bitmaps.tell() // bitmap_size)
+                    bitmaps.write(bitmap)
+                else:
+                    key_bitmaps.append(-1)
+                    blocks.extend(key_blocks)
+                key_offsets.append(len(blocks))
+
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(
+                    MAGIC, VERSION, BYTE_ORDER_MARK, len(rowids), len(keys), len(blocks),
+                    bitmaps.tell() // max(bitmap_size, 1), text_offsets[-1], path_offsets[-1]
+                ))
+                for section in (
+                    keys, key_offsets, key_bitmaps, blocks, bitmaps, rowids, modified, name_lengths,
+                    text_offsets, texts, path_offsets, paths
+                ):
+                    writeSection(f, section)
+
+    logger.info(f'file name index written to {path} with {len(rowids)} files and {len(keys)} grams')
+    return True
+
+
+class FileNameBase:
+    """ the memory mapped base of the index, read only """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.views: list[memoryview] = []
+        try:
+            magic, version, byte_order_mark, entries, keys, blocks, bitmaps, text_bytes, path_bytes = \
+                HEADER.unpack_from(self.mapping)
+            if magic != MAGIC or version != VERSION or byte_order_mark != BYTE_ORDER_MARK:
+                raise ValueError(f'unsupported file name index {path}')
+
+            self.size = entries
+            self.bitmap_size = (((entries + BLOCK_SIZE - 1) >> BLOCK_SHIFT) + 7) >> 3
+            self.views.append(memoryview(self.mapping))
+            self.position = HEADER.size
+            self.keys = self.getSection('Q', keys)
+            self.key_offsets = self.getSection('Q', keys + 1)
+            self.key_bitmaps = self.getSection('q', keys)
+            self.blocks = self.getSection('I', blocks)
+            self.bitmaps_start = self.skipSection(bitmaps * self.bitmap_size)
+            self.rowids = self.getSection('q', entries)
+            self.modified = self.getSection('d', entries)
+            self.name_lengths = self.getSection('H', entries)
+            self.text_offsets = self.getSection('Q', entries + 1)
+            self.texts_start = self.skipSection(text_bytes)
+            self.path_offsets = self.getSection('Q', entries + 1)
+            self.paths_start = self.skipSection(path_bytes)
+            if self.position > len(self.mapping):
+                raise ValueError(f'truncated file name index {path}')
+        except Exception:
+            self.close()
+            raise
+
+    def skipSection(self, size: int) -> int:
+        start = self.position + (-self.position % 8)
+        self.position = start + size
+        return start
+
+    def getSection(self, format: str, count: int) -> memoryview:
+        start = self.skipSection(count * struct.calcsize(format))
+        view = self.views[0][start:self.position].cast(format)  # type: ignore[call-overload]
+        self.views.append(view)
+        return view
+
+    def close(self) -> None:
+        # the mapping can only be closed once no view of it is left
+        for view in reversed(self.views):
+            view.release()
+
+        self.mapping.close()
+
+    def getPath(self, position: int) -> str:
+        start = self.paths_start + self.path_offsets[position]
+        return self.mapping[start:self.paths_start + self.path_offsets[position + 1]].decode('utf-8')
+
+    def getText(self, position: int) -> bytes:
+        return self.mapping[self.texts_start + self.text_offsets[position]:self.texts_start + self.text_offsets[position + 1]]
+
+    def isHidden(self, position: int, newer: list['FileNameDelta']) -> bool:
+        """ whether the entry was written again or removed since the base """
+        rowid = self.rowids[position]
+        return any(rowid in layer.rowids for layer in newer) \
+            or any(len(layer.removed_prefixes) > 0 and self.getPath(position).startswith(layer.removed_prefixes) for layer in newer)
+
+    def iterBlocks(self, keys: set[int], last_block: int) -> Iterator[int]:
+        """ the blocks up to `last_block` holding every key, in descending order """
+        sparse: list[memoryview] = []
+        dense: Optional[int] = None
+        for key in keys:
+            i = bisect_left(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return
+
+            if self.key_bitmaps[i] >= 0:
+                start = self.bitmaps_start + self.key_bitmaps[i] * self.bitmap_size
+                bitmap = int.from_bytes(self.mapping[start:start + self.bitmap_size], 'little')
+                dense = bitmap if dense is None else dense & bitmap
+            else:
+                sparse.append(self.blocks[self.key_offsets[i]:self.key_offsets[i + 1]])
+
+        if len(sparse) > 0:
+            sparse.sort(key=len)
+            shortest = sparse[0]
+            others = sparse[1:]
+            dense_bytes = None if dense is None else dense.to_bytes(self.bitmap_size, 'little')
+            for j in range(bisect_right(shortest, last_block) - 1, -1, -1):
+                block = shortest[j]
+                if dense_bytes is not None and not dense_bytes[block >> 3] >> (block & 7) & 1:
+                    continue
+
+                if all(containsBlock(other, block) for other in others):
+                    yield block
+        elif dense is not None:
+            dense &= (1 << (last_block + 1)) - 1
+            # the bytes are reversed so the regex finds the last blocks first
+            reversed_bitmap = dense.to_bytes(self.bitmap_size, 'little')[::-1]
+            for m in NONZERO_BYTE.finditer(reversed_bitmap):
+                value = reversed_bitmap[m.start()]
+                first_block = (self.bitmap_size - 1 - m.start()) << 3
+                for bit in range(7, -1, -1):
+                    if value >> bit & 1:
+                        yield first_block + bit
+
+    def findMatches(
+        self, keys: set[int], terms: list[bytes], count: Optional[int], newer: list['FileNameDelta'],
+        window: Optional[int] = None, window_start: int = 0, unnamed: bool = False, deadline: Optional[float] = None
+    ) -> tuple[list[FileNameMatch], int]:
+        """ the entries containing every term whose rowid is in [window_start, window), the
+        latest first and at most `count` of them, and the lowest rowid searched. The search
+        stops at the block reached at `deadline`. Entries written again or removed since the
+        base are left out, and the entries named after a term when `unnamed` """
+        end = self.size if window is None else bisect_left(self.rowids, window)
+        start = bisect_left(self.rowids, window_start)
+        if end <= start:
+            return [], window_start
+
+        # the longest term is the least frequent, the others are checked on its matches
+        primary = max(terms, key=len)
+        others = [term for term in terms if term is not primary]
+        hidden = [layer.rowids for layer in newer if len(layer.rowids) > 0]
+        prefixes = tuple(prefix for layer in newer for prefix in layer.removed_prefixes)
+        mapping = self.mapping
+        rowids = self.rowids
+        text_offsets = self.text_offsets
+        texts_start = self.texts_start
+        matches: list[FileNameMatch] = []
+        for block in self.iterBlocks(keys, (end - 1) >> BLOCK_SHIFT):
+            first = block << BLOCK_SHIFT
+            if first + BLOCK_SIZE <= start:
+                break
+
+            last = min(first + BLOCK_SIZE, end)
+            low = texts_start + text_offsets[max(first, start)]
+            high = texts_start + text_offsets[last]
+            while (found := mapping.rfind(primary, low, high)) >= 0:
+                position = bisect_right(text_offsets, found - texts_start, first, last) - 1
+                text_start = texts_start + text_offsets[position]
+                text = mapping[text_start:texts_start + text_offsets[position + 1]]
+                high = text_start
+                if others and not all(term in text for term in others):
+                    continue
+
+                if unnamed and isNamedAfter(text, terms):
+                    continue
+
+                rowid = rowids[position]
+                if hidden and any(rowid in removed for removed in hidden):
+                    continue
+
+                if prefixes and self.getPath(position).startswith(prefixes):
+                    continue
+
+                matches.append(FileNameMatch(
+                    rowid, self.modified[position], self.name_lengths[position], countNameHits(text, terms), None, position
+                ))
+                if count is not None and len(matches) >= count:
+                    return matches, window_start
+
+            if deadline is not None and monotonic() >= deadline:
+                # the blocks above are searched, the window ends at this one
+                return matches, rowids[max(first, start)]
+
+        return matches, window_start
+
+    def findNamedMatches(self, terms: list[bytes], count: int, newer: list['FileNameDelta']) -> list[FileNameMatch]:
+        """ the entries named after a term and containing every term, at most `count` of them """
+        matches: dict[int, FileNameMatch] = dict()
+        if self.size == 0:
+            return []
+
+        for term in terms:
+            for block in self.iterBlocks({getNameKey(getNameStem(term))}, (self.size - 1) >> BLOCK_SHIFT):
+                for position in range(min((block + 1) << BLOCK_SHIFT, self.size) - 1, (block << BLOCK_SHIFT) - 1, -1):
+                    text = self.getText(position)
+                    if position in matches or not isNamedAfter(text, [term]) or not all(t in text for t in terms) \
+                            or self.isHidden(position, newer):
+                        continue
+
+                    matches[position] = FileNameMatch(
+                        self.rowids[position], self.modified[position], self.name_lengths[position],
+                        countNameHits(text, terms), None, position
+                    )
+                    if len(matches) >= count:
+                        return list(matches.values())
+
+        return list(matches.values())
+
+
+class FileNameDelta:
+    """ the entries written and the rows removed after the base was built. A delta hides
+    the entries of the older layers by rowid, a file keeps its rowid when written again """
+
+    def __init__(self) -> None:
+        self.entries: dict[str, FileNameEntry] = dict()
+        self.grams: dict[int, set[str]] = dict()
+        # rowid to path of the removed rows
+        self.removed: dict[int, str] = dict()
+        self.removed_prefixes: tuple[str, ...] = tuple()
+        # rowids of the entries and of the removed rows
+        self.rowids: set[int] = set()
+        # path of each rowid of the entries, and the rowids in ascending order including
+        # those of the entries removed since, so the latest matches are found first
+        self.paths: dict[int, str] = dict()
+        self.order: list[int] = []
+
+    @property
+    def size(self) -> int:
+        return len(self.entries) + len(self.removed) + len(self.removed_prefixes)
+
+    def discard(self, path: str) -> None:
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return
+
+        if entry.rowid not in self.removed:
+            self.rowids.discard(entry.rowid)
+
+        if self.paths.get(entry.rowid) == path:
+            del self.paths[entry.rowid]
+
+        for key in getEntryKeys(entry.text):
+            paths = self.grams[key]
+            paths.discard(path)
+            if len(paths) == 0:
+                del self.grams[key]
+
+    def add(self, entry: FileNameEntry) -> None:
+        self.discard(entry.path)
+        self.entries[entry.path] = entry
+        self.rowids.add(entry.rowid)
+        self.paths[entry.rowid] = entry.path
+        # the rowids of new files are appended, a file written again keeps its place
+        i = bisect_left(self.order, entry.rowid)
+        if i == len(self.order) or self.order[i] != entry.rowid:
+            self.order.insert(i, entry.rowid)
+        for key in getEntryKeys(entry.text):
+            self.grams.setdefault(key, set()).add(entry.path)
+
+    def remove(self, rowid: int, path: str) -> None:
+        self.discard(path)
+        self.removed[rowid] = path
+        self.rowids.add(rowid)
+
+    def removePrefix(self, prefix: str) -> None:
+        for path in [path for path in self.entries if path.startswith(prefix)]:
+            self.discard(path)
+
+        self.removed_prefixes = tuple(p for p in self.removed_prefixes if not p.startswith(prefix)) + (prefix,)
+
+    def hides(self, entry: FileNameEntry) -> bool:
+        return entry.rowid in self.rowids or entry.path.startswith(self.removed_prefixes)
+
+    def findMatches(
+        self, keys: set[int], terms: list[bytes], count: Optional[int], newer: list['FileNameDelta'],
+        window: Optional[int] = None, window_start: int = 0, unnamed: bool = False, deadline: Optional[float] = None
+    ) -> tuple[list[FileNameMatch], int]:
+        """ see `FileNameBase.findMatches`, the entries of a delta are few so all their
+        matches are sorted """
+        sets = []
+        for key in keys:
+            paths = self.grams.get(key)
+            if paths is None:
+                return [], window_start
+            sets.append(paths)
+
+        def isMatch(entry: FileNameEntry) -> bool:
+            return all(term in entry.text for term in terms) and not (unnamed and isNamedAfter(entry.text, terms)) \
+                and not any(layer.hides(entry) for layer in newer)
+
+        paths = min(sets, key=len)
+        entries: list[FileNameEntry] = []
+        if count is not None and len(paths) ** 2 > count * len(self.order):
+            # the paths of common grams are many, walking the latest rowids finds enough
+            # matches sooner than checking them all
+            i = len(self.order) if window is None else bisect_left(self.order, window)
+            while i > 0 and len(entries) < count:
+                i -= 1
+                if self.order[i] < window_start:
+                    break
+
+                path = self.paths.get(self.order[i])
+                if path is not None and path in paths and isMatch(self.entries[path]):
+                    entries.append(self.entries[path])
+        else:
+            for path in paths:
+                entry = self.entries[path]
+                if window_start <= entry.rowid and (window is None or entry.rowid < window) and isMatch(entry):
+                    entries.append(entry)
+
+            entries.sort(key=lambda entry: entry.rowid, reverse=True)
+            entries = entries if count is None else entries[:count]
+
+        return [self.getMatch(entry, terms) for entry in entries], window_start
+
+    def findNamedMatches(self, terms: list[bytes], count: int, newer: list['FileNameDelta']) -> list[FileNameMatch]:
+        matches: dict[str, FileNameMatch] = dict()
+        for term in terms:
+            for path in self.grams.get(getNameKey(getNameStem(term)), ()):
+                entry = self.entries[path]
+                if path not in matches and isNamedAfter(entry.text, [term]) and all(t in entry.text for t in terms) \
+                        and not any(layer.hides(entry) for layer in newer):
+                    matches[path] = self.getMatch(entry, terms)
+                    if len(matches) >= count:
+                        return list(matches.values())
+
+        return list(matches.values())
+
+    def getMatch(self, entry: FileNameEntry, terms: list[bytes]) -> FileNameMatch:
+        return FileNameMatch(
+            entry.rowid, entry.modified_time, entry.name_length, countNameHits(entry.text, terms), entry.path, 0
+        )
+
+    def getJournal(self) -> Iterator[dict]:
+        """ the operations replaying this layer """
+        for prefix in self.removed_prefixes:
+            yield {"prefix": prefix}
+
+        if len(self.removed) > 0:
+            yield {"remove": list(self.removed.items())}
+
+        if len(self.entries) > 0:
+            yield {"add": [dumpEntry(entry) for entry in self.entries.values()]}
+
+    def replay(self, operation: dict) -> None:
+        if "prefix" in operation:
+            self.removePrefix(operation["prefix"])
+
+        for rowid, path in operation.get("remove", []):
+            self.remove(rowid, path)
+
+        for rowid, path, text, modified_time, name_length in operation.get("add", []):
+            self.add(FileNameEntry(rowid, path, text.encode('utf-8'), modified_time, name_length))
+
+
+class FileNameIndex:
+    """ the base of the index and the deltas written after it. A lock serializes the
+    writes and the collection of the candidates of a search, which are ranked after it is
+    released """
+
+    def __init__(self, path: Path, compact_size: int = 50000, bulk_compact_size: int = 500000) -> None:
+        self.path = path
+        self.journal_path = path.with_name(path.name + '.log')
+        # the delta is rebuilt into the base once it has more entries than this, or a
+        # quarter of the base
+        self.compact_size = compact_size
+        # during a bulk ingest, once it has more entries than this and than the base. The
+        # base at least doubles at each compaction, so an ingest rebuilds it a few times
+        # while the delta and the journal stay bounded
+        self.bulk_compact_size = bulk_compact_size
+        self.lock = Lock()
+        self.base: Optional[FileNameBase] = None
+        # the delta being built into a new base by a compaction
+        self.frozen: Optional[FileNameDelta] = None
+        self.delta = FileNameDelta()
+        if self.path.exists():
+            try:
+                self.base = FileNameBase(self.path)
+            except Exception as ex:
+                logger.warning(f'failed to open file name index {self.path}: {ex}')
+
+        if self.base is not None and self.journal_path.exists():
+            try:
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self.delta.replay(json.loads(line))
+            except Exception as ex:
+                # a truncated last line is left by a crash, the next compaction fixes it
+                logger.warning(f'failed to replay file name index journal {self.journal_path}: {ex}')
+
+        logger.info(
+            f'file name index {self.path} opened with {0 if self.base is None else self.base.size} files,'
+            f' {self.delta.size} changes in the journal'
+        )
+
+    @staticmethod
+    def remove(path: Path) -> None:
+        """ delete the files of an index, it is stale once the storage is written without it """
+        for file in (path, path.with_name(path.name + '.log')):
+            if file.exists():
+                file.unlink()
+
+    @property
+    def ready(self) -> bool:
+        return self.base is not None
+
+    def needsCompaction(self, bulk: bool = False) -> bool:
+        if self.frozen is not None:
+            return False
+
+        if self.base is None:
+            return True
+
+        if bulk:
+            return self.delta.size > max(self.bulk_compact_size, self.base.size)
+
+        return self.delta.size > max(self.compact_size, self.base.size // 4)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.base is not None:
+                self.base.close()
+                self.base = None
+
+    def appendJournal(self, operation: dict) -> None:
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(operation, ensure_ascii=False) + '\n')
+        except OSError as ex:
+            logger.warning(f'failed to append file name index journal: {ex}')
+
+    def addEntries(self, entries: list[FileNameEntry]) -> None:
+        with self.lock:
+            for entry in entries:
+                self.delta.add(entry)
+
+        self.appendJournal({"add": [dumpEntry(entry) for entry in entries]})
+
+    def removeFiles(self, rows: list[tuple[int, str]]) -> None:
+        """ remove the files by their (rowid, path) """
+        with self.lock:
+            for rowid, path in rows:
+                self.delta.remove(rowid, path)
+
+        self.appendJournal({"remove": rows})
+
+    def removePrefix(self, prefix: str) -> None:
+        """ remove the files whose path starts with the prefix """
+        with self.lock:
+            self.delta.removePrefix(prefix)
+
+        self.appendJournal({"prefix": prefix})
+
+    def freeze(self) -> None:
+        """ start a compaction, run by the writer of the storage so the frozen delta holds
+        exactly the writes committed before the database is read for the new base """
+        with self.lock:
+            self.frozen = self.delta
+            self.delta = FileNameDelta()
+
+    def compact(self, entries: Iterable[FileNameEntry], stopped: Optional[Event] = None) -> bool:
+        """ replace the base and the frozen delta with a base written from the entries
+        of the database read after `freeze` """
+        assert self.frozen is not None
+        temp_path = self.path.with_name(self.path.name + '.new')
+        try:
+            if not writeFileNameIndex(temp_path, entries, stopped):
+                return False
+
+            with self.lock:
+                # the mapped file cannot be replaced on Windows
+                if self.base is not None:
+                    self.base.close()
+                    self.base = None
+
+                os.replace(temp_path, self.path)
+                self.base = FileNameBase(self.path)
+                self.frozen = None
+                journal_path = self.journal_path.with_name(self.journal_path.name + '.tmp')
+                with open(journal_path, 'w', encoding='utf-8') as f:
+                    for operation in self.delta.getJournal():
+                        f.write(json.dumps(operation, ensure_ascii=False) + '\n')
+                os.replace(journal_path, self.journal_path)
+
+            return True
+        finally:
+            with self.lock:
+                if self.frozen is not None:
+                    # the writes of the frozen delta are kept for the next compaction
+                    for operation in self.delta.getJournal():
+                        self.frozen.replay(operation)
+                    self.delta = self.frozen
+                    self.frozen = None
+
+            if temp_path.exists():
+                temp_path.unlink()
+
+    def getLayers(self) -> list:
+        """ the delta, the frozen delta and the base, the newest first """
+        return [self.delta] + ([self.frozen] if self.frozen is not None else []) + [self.base]
+
+    def findMatches(
+        self, terms: list[str], count: Optional[int] = None, window: Optional[int] = None, window_start: int = 0,
+        unnamed: bool = False, deadline: Optional[float] = None
+    ) -> tuple[list[FileNameMatch], int]:
+        """ the files containing every term whose rowid is in [window_start, window), the
+        latest first and at most `count` of them, and the lowest rowid searched, see
+        `FileNameBase.findMatches`. Must be called with the lock held """
+        keys: set[int] = set()
+        for term in terms:
+            if len(term) >= 2:
+                keys |= getTermGrams(term)
+
+        encoded_terms = [term.encode('utf-8') for term in terms]
+        layers = self.getLayers()
+        matches: list[FileNameMatch] = []
+        searched = window_start
+        for i, layer in enumerate(layers):
+            layer_matches, layer_searched = layer.findMatches(
+                keys, encoded_terms, count, layers[:i], window, window_start, unnamed, deadline
+            )
+            matches.extend(layer_matches)
+            searched = max(searched, layer_searched)
+
+        # each layer has its latest matches, the latest of them all above the rowids every
+        # layer searched are kept
+        matches = sorted((match for match in matches if match.rowid >= searched), key=lambda match: match.rowid, reverse=True)
+        return (matches, searched) if count is None else (matches[:count], searched)
+
+    def findNamedMatches(self, terms: list[str], count: int) -> list[FileNameMatch]:
+        """ the files named after a term and containing every term, at most `count` of
+        them. Must be called with the lock held """
+        encoded_terms = [term.encode('utf-8') for term in terms]
+        layers = self.getLayers()
+        matches: list[FileNameMatch] = []
+        for i, layer in enumerate(layers):
+            matches.extend(layer.findNamedMatches(encoded_terms, count - len(matches), layers[:i]))
+            if len(matches) >= count:
+                break
+
+        return matches
+
+    def search(self, filter: FileInfoFilter) -> Optional[FileSearchPage]:
+        """ the page ranked like `FileSystemStorage.searchFiles`, or None when the index is
+        not built yet, every term is a single character or the filter has predicates the
+        index does not store. The candidates are collected like the trigram search of the
+        database: the latest `filter.candidates` matches below the window of the cursor, and
+        in the first window the files named after a term """
+        terms = filter.getTerms()
+        if all(len(term) < 2 for term in terms) or filter.hasPredicates():
+            return None
+
+        cursor = filter.cursor or FileSearchCursor(now=int(time()))
+        # the database scans the files by modified time when no term is a trigram
+        by_time = all(len(term) < 3 for term in terms)
+        count = max(filter.candidates, filter.limit)
+        with self.lock:
+            base = self.base
+            if base is None:
+                return None
+
+            # the named files are candidates of the first window only
+            unnamed = not by_time and cursor.window is not None
+            if cursor.window_start is not None:
+                matches, window_start = self.findMatches(terms, count, cursor.window, cursor.window_start, unnamed)
+            else:
+                matches, window_start = self.findMatches(
+                    terms, count, cursor.window, 0, unnamed, monotonic() + filter.search_seconds
+                )
+                if len(matches) >= count:
+                    window_start = matches[-1].rowid
+
+            if not by_time and cursor.window is None:
+                matches.extend(self.findNamedMatches(terms, count))
+
+            # the paths are read before the lock is released, a compaction unmaps the base
+            paths = {
+                match.rowid: match.path if match.path is not None else base.getPath(match.position)
+                for match in matches
+            }
+
+        ranked = []
+        for match in {match.rowid: match for match in matches}.values():
+            if by_time:
+                score = match.modified_time
+            else:
+                score = match.name_hits * filter.name_weight / (1.0 + match.name_length / 32.0) \
+                    + filter.recency_weight / (1.0 + max(cursor.now - match.modified_time, 0) / 2592000.0)
+            if cursor.score is None or (score, match.rowid) < (cursor.score, cursor.file_id):
+                ranked.append((score, match.rowid))
+
+        # the top of the candidates, without sorting them all
+        ranked = nlargest(filter.limit + 1, ranked)
+        next_cursor = None
+        if len(ranked) > filter.limit:
+            ranked = ranked[:filter.limit]
+            next_cursor = FileSearchCursor(
+                score=ranked[-1][0], file_id=ranked[-1][1], window=cursor.window, window_start=window_start,
+                now=cursor.now
+            )
+        elif window_start > 1:
+            # older matches are left below the window
+            next_cursor = FileSearchCursor(window=window_start, now=cursor.now)
+
+        return FileSearchPage(
+            file_paths=[paths[rowid] for _, rowid in ranked], cursor=next_cursor, ranks=ranked,
+            window=cursor.window, window_start=window_start
+        )
+
+    def estimateFileCount(self, filter: FileInfoFilter, cap: int = 10000) -> Optional[FileCountEstimate]:
+        terms = filter.getTerms()
+        if all(len(term) < 2 for term in terms) or filter.hasPredicates():
+            return None
+
+        with self.lock:
+            if self.base is None:
+                return None
+            count = len(self.findMatches(terms, cap + 1)[0])
+
+        return FileCountEstimate(count=min(count, cap), exact=count <= cap)
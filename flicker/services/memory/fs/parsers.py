@@ -0,0 +1,233 @@
+""" document parsers executed in the worker processes of the content extraction pipeline,
+this module must stay free of Qt imports so the spawned workers start quickly """
+from typing import Callable, NamedTuple, Optional
+from os.path import splitext, getsize
+from threading import Condition, Thread
+from time import monotonic
+from xml.etree import ElementTree
+
+import _thread
+import re
+import zipfile
+
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NAMESPACE = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+SLIDE_NAME = re.compile(r'ppt/slides/slide(\d+)\.xml')
+
+
+class ExtractionLimits(NamedTuple):
+    time_limit: float
+    max_file_size: int
+    max_text_length: int
+    chunk_size: int
+    chunk_overlap: int
+
+
+class ExtractedFile(NamedTuple):
+    file_path: str
+    # one of ok, unsupported, too_large, timeout, out_of_memory, failed
+    status: str
+    chunks: list[str]
+    file_size: int
+    error: str = ""
+
+
+def readText(path: str) -> list[str]:
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return [data.decode(encoding)]
+        except UnicodeDecodeError:
+            continue
+
+    return [data.decode('utf-8', errors='replace')]
+
+
+def readDocx(path: str) -> list[str]:
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+
+    paragraphs = []
+    for paragraph in root.iter(WORD_NAMESPACE + 'p'):
+        text = ''.join(node.text or '' for node in paragraph.iter(WORD_NAMESPACE + 't'))
+        if text.strip() != '':
+            paragraphs.append(text)
+
+    return ['\n'.join(paragraphs)]
+
+
+def readPptx(path: str) -> list[str]:
+    """ returns the text of each slide in the order of the slide numbers """
+    slides: list[tuple[int, str]] = []
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            m = SLIDE_NAME.fullmatch(name)
+            if m is None:
+                continue
+
+            root = ElementTree.fromstring(archive.read(name))
+            lines = []
+            for paragraph in root.iter(DRAWING_NAMESPACE + 'p'):
+                text = ''.join(node.text or '' for node in paragraph.iter(DRAWING_NAMESPACE + 't'))
+                if text.strip() != '':
+                    lines.append(text)
+
+            slides.append((int(m.group(1)), '\n'.join(lines)))
+
+    return [text for _, text in sorted(slides)]
+
+
+def readPdf(path: str) -> list[str]:
+    # pypdf is an optional dependency, pdf files are reported as unsupported without it
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [page.extract_text() or '' for page in reader.pages]
+
+
+def isPdfSupported() -> bool:
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+READERS: dict[str, Callable[[str], list[str]]] = {
+    '.txt': readText,
+    '.docx': readDocx,
+    '.pptx': readPptx,
+    '.pdf': readPdf,
+}
+
+
+def getSupportedExtensions() -> set[str]:
+    extensions = set(READERS.keys())
+    if not isPdfSupported():
+        extensions.discard('.pdf')
+
+    return extensions
+
+
+def splitChunks(sections: list[str], chunk_size: int, chunk_overlap: int) -> list[str]:
+    """ split the sections (pages, slides) into chunks of about `chunk_size` characters,
+    consecutive chunks share `chunk_overlap` characters, lines are kept together when
+    possible and a chunk never spans two sections """
+    chunks = []
+    for section in sections:
+        current = ''
+        for line in section.splitlines(keepends=True):
+            while len(line) > chunk_size:
+                # a single line longer than a chunk is cut with overlap
+                if current.strip() != '':
+                    chunks.append(current.strip())
+                    current = ''
+
+                chunks.append(line[:chunk_size].strip())
+                line = line[chunk_size - chunk_overlap:]
+
+            if len(current) + len(line) > chunk_size:
+                chunks.append(current.strip())
+                current = current[len(current) - chunk_overlap:] if chunk_overlap > 0 else ''
+
+            current += line
+
+        if current.strip() != '':
+            chunks.append(current.strip())
+
+    return [chunk for chunk in chunks if chunk != '']
+
+
+class Watchdog:
+    """ interrupts the main thread of the worker process when a file takes longer than
+    the time limit, the parser gets a KeyboardInterrupt at the next bytecode boundary """
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        self.deadline: Optional[float] = None
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def arm(self, timeout: float) -> None:
+        with self.condition:
+            self.deadline = monotonic() + timeout
+            self.condition.notify()
+
+    def disarm(self) -> None:
+        with self.condition:
+            self.deadline = None
+
+    def run(self) -> None:
+        with self.condition:
+            while True:
+                if self.deadline is None:
+                    self.condition.wait()
+                elif monotonic() >= self.deadline:
+                    self.deadline = None
+                    _thread.interrupt_main()
+                else:
+                    self.condition.wait(self.deadline - monotonic())
+
+
+_watchdog: Optional[Watchdog] = None
+
+
+def initializeWorker(memory_limit: int) -> None:
+    """ runs once in each worker process """
+    global _watchdog
+    _watchdog = Watchdog()
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows, only the file size limit applies there
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = memory_limit if hard == resource.RLIM_INFINITY else min(memory_limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def extractFile(path: str, limits: ExtractionLimits) -> ExtractedFile:
+    reader = READERS.get(splitext(path)[1].lower())
+    try:
+        file_size = getsize(path)
+    except OSError as ex:
+        return ExtractedFile(path, 'failed', [], 0, str(ex))
+
+    if reader is None:
+        return ExtractedFile(path, 'unsupported', [], file_size)
+
+    if file_size > limits.max_file_size:
+        return ExtractedFile(path, 'too_large', [], file_size)
+
+    try:
+        if _watchdog is not None:
+            _watchdog.arm(limits.time_limit)
+
+        try:
+            sections = reader(path)
+            total_length = 0
+            for i, section in enumerate(sections):
+                total_length += len(section)
+                if total_length > limits.max_text_length:
+                    sections = sections[:i + 1]
+                    sections[i] = section[:len(section) - (total_length - limits.max_text_length)]
+                    break
+
+            chunks = splitChunks(sections, limits.chunk_size, limits.chunk_overlap)
+        finally:
+            if _watchdog is not None:
+                _watchdog.disarm()
+
+        return ExtractedFile(path, 'ok', chunks, file_size)
+    except KeyboardInterrupt:
+        return ExtractedFile(path, 'timeout', [], file_size, f'exceeded {limits.time_limit} seconds')
+    except MemoryError:
+        return ExtractedFile(path, 'out_of_memory', [], file_size)
+    except ImportError as ex:
+        return ExtractedFile(path, 'unsupported', [], file_size, str(ex))
+    except Exception as ex:
+        return ExtractedFile(path, 'failed', [], file_size, f'{type(ex).__name__}: {ex}')
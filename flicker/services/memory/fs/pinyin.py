@@ -0,0 +1,68 @@
+""" pinyin forms of Chinese file names, so a name like 会议纪要.docx is found by typing
+`huiyijiyao` or its initials `hyjy` without an input method. pypinyin is an optional
+dependency, without it the forms are empty and only the literal names are matched """
+from functools import lru_cache
+from typing import NamedTuple
+
+import re
+
+
+# CJK unified ideographs, extension A and compatibility ideographs
+HAN_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+# Han characters converted in a name, the rest of a longer name is left out of the forms
+MAX_HAN_LENGTH = 64
+
+
+class NameForms(NamedTuple):
+    pinyin: str
+    initials: str
+
+
+@lru_cache(maxsize=None)
+def isPinyinSupported() -> bool:
+    try:
+        import pypinyin  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@lru_cache(maxsize=65536)
+def convertHanRun(run: str) -> tuple[str, str]:
+    """ the words of the file names repeat a lot, e.g. 报告 or 会议, so the runs of Han
+    characters are cached rather than converting every name from scratch. The whole run is
+    converted at once so pypinyin picks the reading of a character from its phrase """
+    from pypinyin import lazy_pinyin
+    syllables = [syllable for syllable in lazy_pinyin(run, errors='ignore') if syllable != '']
+    return ''.join(syllables), ''.join(syllable[0] for syllable in syllables)
+
+
+def getNameForms(name: str) -> NameForms:
+    """ the full pinyin and the initials of the name, other characters are kept as they are
+    so `hyjy2024` matches 会议纪要2024.docx. Both forms are empty for a name without Han
+    characters, which is matched by the name itself """
+    if HAN_RUN.search(name) is None or not isPinyinSupported():
+        return NameForms('', '')
+
+    name = name.lower()
+    pinyin: list[str] = []
+    initials: list[str] = []
+    position = 0
+    budget = MAX_HAN_LENGTH
+    for m in HAN_RUN.finditer(name):
+        pinyin.append(name[position:m.start()])
+        initials.append(name[position:m.start()])
+        position = m.end()
+        run = m.group()[:budget]
+        run_pinyin, run_initials = convertHanRun(run)
+        pinyin.append(run_pinyin)
+        initials.append(run_initials)
+        budget -= len(run)
+        if budget <= 0:
+            break
+    else:
+        pinyin.append(name[position:])
+        initials.append(name[position:])
+
+    return NameForms(''.join(pinyin), ''.join(initials))
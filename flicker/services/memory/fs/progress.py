@@ -0,0 +1,66 @@
+from pydantic import BaseModel
+from typing import Optional
+from pathlib import Path
+from threading import Lock
+from loguru import logger
+
+import os
+
+
+class ScanProgress(BaseModel):
+    """ live metrics of a scanning task. The busy seconds of each stage tell whether a
+    slow scan is bound by the traversal, stat or SQLite, rates are measured over the last
+    reporting interval """
+    instance_id: str
+    root_directory: str
+    timestamp: float
+    elapsed: float
+    finished: bool = False
+    traversal_finished: bool = False
+
+    scanned_directories: int = 0
+    skipped_directories: int = 0
+    excluded_directories: int = 0
+    pending_directories: int = 0
+    matched_files: int = 0
+    excluded_files: int = 0
+    committed_files: int = 0
+
+    read_seconds: float = 0.0
+    stat_seconds: float = 0.0
+    insert_seconds: float = 0.0
+
+    directory_rate: float = 0.0
+    stat_rate: float = 0.0
+    insert_rate: float = 0.0
+
+    queue_depth: int = 0
+    queue_capacity: int = 0
+    # seconds, unknown before the first complete scan of the root
+    eta: Optional[float] = None
+
+
+class ScanProgressLog:
+    """ appends the progress reports as json lines to a log file in the settings
+    directory, the file is rotated once it exceeds `max_size` bytes """
+
+    lock = Lock()
+    max_size: int = 16 * 1024 * 1024
+
+    @staticmethod
+    def getLogPath() -> Path:
+        """ resolved once per scan, resolving the settings directory writes a log line """
+        from flicker.services.memory.fs.snapshot import ScanSnapshot
+        return ScanSnapshot.getSnapshotDirectory() / "progress.jsonl"
+
+    @classmethod
+    def write(cls, progress: ScanProgress, path: Path) -> None:
+        try:
+            with cls.lock:
+                if path.exists() and path.stat().st_size > cls.max_size:
+                    os.replace(path, path.with_suffix('.jsonl.1'))
+
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(progress.model_dump_json() + '\n')
+        except Exception as ex:
+            logger.warning(f'failed to write scanning progress: {ex}')
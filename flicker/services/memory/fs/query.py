@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import os
+import re
+
+
+# an operator with a quoted value, e.g. in:"My Documents", or any other word
+QUERY_TOKEN = re.compile(r'(\w+):"([^"]*)"|(\S+)')
+
+QUERY_OPERATOR = re.compile(r'^(\w+):(.+)$')
+
+QUERY_OPERATORS = {'ext', 'in', 'after', 'before', 'modified', 'created', 'size'}
+
+RELATIVE_TIME = re.compile(r'^(\d+)([dwmy])$')
+
+RELATIVE_TIME_UNITS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+SIZE = re.compile(r'^(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?$')
+
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parseDateRange(value: str, now: float) -> Optional[tuple[int, Optional[int]]]:
+    """ returns the [start, end) unix times of a local date, month or year like 2026-10-01,
+    2026-10 or 2026, of today or yesterday, or from a relative time like 7d, 2w, 3m or 1y
+    until now, which has no end """
+    value = value.lower()
+    today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    if value in ('today', 'yesterday'):
+        start = today - timedelta(days=1 if value == 'yesterday' else 0)
+        return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+    match = RELATIVE_TIME.match(value)
+    if match is not None:
+        days = int(match.group(1)) * RELATIVE_TIME_UNITS[match.group(2)]
+        return int(now) - days * 86400, None
+
+    parts = re.split(r'[-/.]', value)
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        return None
+
+    numbers = [int(part) for part in parts]
+    year, month, day = (numbers + [1, 1])[:3]
+    try:
+        start = datetime(year, month, day)
+        if len(numbers) == 1:
+            end = datetime(year + 1, 1, 1)
+        elif len(numbers) == 2:
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+        else:
+            end = start + timedelta(days=1)
+    except (ValueError, OverflowError):
+        return None
+
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def parseTimeRange(value: str, now: float) -> Optional[tuple[Optional[int], Optional[int]]]:
+    """ a date, or two dates separated by `..` where either one may be left out """
+    if '..' not in value:
+        return parseDateRange(value, now)
+
+    first, last = value.split('..', 1)
+    start = parseDateRange(first, now) if first != '' else None
+    end = parseDateRange(last, now) if last != '' else None
+    if (first != '' and start is None) or (last != '' and end is None):
+        return None
+
+    return (
+        None if start is None else start[0],
+        # a relative time ends the range at the time itself
+        None if end is None else (end[1] if end[1] is not None else end[0])
+    )
+
+
+def parseSize(value: str) -> Optional[int]:
+    """ bytes of a size like 100, 200k, 1.5mb or 2GiB """
+    match = SIZE.match(value.lower())
+    if match is None:
+        return None
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parseSizeRange(value: str) -> Optional[tuple[Optional[int], Optional[int]]]:
+    """ the inclusive [min, max] of >10mb, <1k, 1m..10m, or of a single size which is the
+    minimum """
+    if value.startswith(('>', '<')):
+        size = parseSize(value[1:])
+        if size is None:
+            return None
+
+        return (size + 1, None) if value[0] == '>' else (None, max(size - 1, 0))
+
+    if '..' in value:
+        first, last = value.split('..', 1)
+        low = parseSize(first) if first != '' else None
+        high = parseSize(last) if last != '' else None
+        if (first != '' and low is None) or (last != '' and high is None):
+            return None
+
+        return low, high
+
+    size = parseSize(value)
+    return None if size is None else (size, None)
+
+
+def parseFileQuery(text: str, now: Optional[float] = None) -> dict:
+    """ the fields of a `FileInfoFilter` from the text typed in the hotkey window, e.g.
+    `report ext:pdf,docx after:2026-10-01 in:projects size:>1mb`. The words which are not
+    an operator, or whose value is not understood, are kept as keywords """
+    now = datetime.now().timestamp() if now is None else now
+    fields: dict = {
+        'extensions': [], 'directories': [],
+        'modified_after': None, 'modified_before': None,
+        'created_after': None, 'created_before': None,
+        'min_size': None, 'max_size': None,
+    }
+    words = []
+    for match in QUERY_TOKEN.finditer(text):
+        if match.group(1) is not None:
+            operator, value = match.group(1).lower(), match.group(2)
+        else:
+            operator_match = QUERY_OPERATOR.match(match.group(3))
+            if operator_match is None or operator_match.group(1).lower() not in QUERY_OPERATORS:
+                words.append(match.group(3))
+                continue
+
+            operator, value = operator_match.group(1).lower(), operator_match.group(2)
+
+        if not applyOperator(fields, operator, value, now):
+            words.append(match.group(0))
+
+    fields['keywords'] = [' '.join(words)] if len(words) > 0 else []
+    return fields
+
+
+def applyOperator(fields: dict, operator: str, value: str, now: float) -> bool:
+    """ returns whether the value of the operator is understood """
+    if operator == 'ext':
+        extensions = [extension.strip().lstrip('.').lower() for extension in value.split(',')]
+        fields['extensions'].extend(extension for extension in extensions if extension != '')
+        return True
+
+    if operator == 'in':
+        directory = os.path.expanduser(value)
+        fields['directories'].append(os.path.normpath(directory) if os.path.isabs(directory) else directory)
+        return True
+
+    if operator == 'size':
+        sizes = parseSizeRange(value)
+        if sizes is None:
+            return False
+
+        fields['min_size'], fields['max_size'] = sizes
+        return True
+
+    if operator in ('after', 'before'):
+        date = parseDateRange(value, now)
+        if date is None:
+            return False
+
+        # both bound at the start, files before 2026-10-01 are modified until the day before
+        fields['modified_after' if operator == 'after' else 'modified_before'] = date[0]
+        return True
+
+    if operator in ('modified', 'created'):
+        times = parseTimeRange(value, now)
+        if times is None:
+            return False
+
+        fields[f'{operator}_after'], fields[f'{operator}_before'] = times
+        return True
+
+    return False
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from pydantic import BaseModel
+from threading import Lock
+from typing import Generic, NamedTuple, Optional, TypeVar
+
+import sys
+
+
+T = TypeVar('T')
+
+# bytes of the dict slot, the entry tuple and the result object besides the strings
+ENTRY_OVERHEAD = 256
+
+
+class QueryCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    # entries dropped because a write committed after they were cached
+    invalidations: int = 0
+    evictions: int = 0
+    entries: int = 0
+    # estimated bytes of the keys and results
+    size: int = 0
+    max_entries: int = 0
+    max_size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0
+
+
+class QueryCacheEntry(NamedTuple):
+    value: object
+    size: int
+
+
+class QueryCache(Generic[T]):
+    """ least recently used results of the queries, bounded by the number of entries and
+    their estimated bytes. Every result is cached with the write generation of the storage
+    read before the query ran, a newer generation drops all the entries at once so a
+    result is never served after a commit changed the files. The results are shared
+    between the callers, they must not be modified """
+
+    def __init__(self, max_entries: int = 256, max_size: int = 4 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.lock = Lock()
+        self.entries: OrderedDict[str, QueryCacheEntry] = OrderedDict()
+        self.generation = 0
+        self.size = 0
+        self.stats = QueryCacheStats(max_entries=max_entries, max_size=max_size)
+
+    def invalidate(self, generation: int) -> None:
+        """ called with the lock held """
+        if generation <= self.generation:
+            return
+
+        self.generation = generation
+        self.stats.invalidations += len(self.entries)
+        self.entries.clear()
+        self.size = 0
+
+    def get(self, key: str, generation: int) -> Optional[T]:
+        with self.lock:
+            self.invalidate(generation)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry.value  # type: ignore[return-value]
+
+    def put(self, key: str, generation: int, value: T, size: int) -> None:
+        """ `size` is the estimated bytes of the value, the key and the overhead of the
+        entry are added to it """
+        size += sys.getsizeof(key) + ENTRY_OVERHEAD
+        with self.lock:
+            self.invalidate(generation)
+            # the result was read before a later commit
+            if generation < self.generation or size > self.max_size:
+                return
+
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+
+            self.entries[key] = QueryCacheEntry(value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def getStats(self) -> QueryCacheStats:
+        with self.lock:
+            return self.stats.model_copy(update={'entries': len(self.entries), 'size': self.size})
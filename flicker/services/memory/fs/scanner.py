@@ -1,30 +1,122 @@
-from flicker.services.memory.fs.storage import FileSystemStorage
+from flicker.services.memory.fs.storage import StoragePriority, FileUpsertCounts, getFileInfo
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.snapshot import ScanSnapshot, ScanCheckpoint, SeenFiles
+from flicker.services.memory.fs.walker import ParallelDirectoryWalker
+from flicker.services.memory.fs.exclusion import ExclusionRules, IGNORE_FILE_NAME
+from flicker.services.memory.fs.progress import ScanProgress, ScanProgressLog
 
-from PySide6.QtCore import QThread, QObject, Signal
+from PySide6.QtCore import QThread, QObject, QTimer, Signal
 from pydantic import BaseModel, Field
-from typing import Optional, Callable
-from os import walk
-from os.path import splitext
-from time import time
+from typing import Optional, Callable, NamedTuple
+from os import DirEntry, scandir, stat
+from os.path import splitext, join, dirname
+from time import time, monotonic
 from loguru import logger
 from pathlib import Path
 from datetime import datetime
+from hashlib import sha1
 from uuid import UUID, uuid4
+from threading import Event, Lock, Thread
+from traceback import format_exc
+from contextlib import nullcontext
+from queue import Queue
+from enum import IntEnum
 
 
 class FileScanningOptions(BaseModel):
     root_directory: str
     extension_names: set[str]
     excluded_directories: list[str]
+    # roots of other data sources under the root, their files are scanned into their own
+    # shards so they are skipped, see StorageShards.getNestedRoots
+    nested_roots: list[str] = Field(default_factory=list)
     after: Optional[datetime] = None
+    incremental: bool = False
+    parallelism: int = Field(default=1, ge=1)
+    streaming: bool = False
+    batch_size: int = Field(default=5000, ge=1)
+    # rows committed in a transaction by a full scan, which runs in the bulk ingest mode of
+    # the storage. Larger transactions write fewer and larger segments of the search index
+    bulk_batch_size: int = Field(default=20000, ge=1)
+    queue_size: int = Field(default=64, ge=1)
+    # seconds between checkpoints of a streaming scan, 0 disables checkpointing
+    checkpoint_interval: float = Field(default=30.0, ge=0)
+    # seconds between progress reports, 0 disables reporting
+    progress_interval: float = Field(default=1.0, ge=0)
+
+    def isMatchedFile(self, filename: str) -> bool:
+        _, extension_name = splitext(filename)
+        return extension_name.lower() in self.extension_names
+
+    def getDigest(self) -> str:
+        """ digest of the options which affect the scanning result """
+        content = "|".join(sorted(self.extension_names)) + "\n" + "|".join(self.excluded_directories)
+        if len(self.nested_roots) > 0:
+            content += "\n" + "|".join(sorted(self.nested_roots))
+        return sha1(content.encode('utf-8')).hexdigest()
 
 
 class FileScanningResult(BaseModel):
+    """ in streaming mode the matched files are written to the storage batch by batch
+    and `paths` is left empty """
     paths: list[Path] = Field(default_factory=list)
+    incremental: bool = False
+    cancelled: bool = False
+    # the scanning stopped on an error, the committed files are kept
+    failed: bool = False
+    total_files: int = 0
+    committed_files: int = 0
+    # the committed files which were new, changed or left untouched as unchanged
+    inserted_files: int = 0
+    updated_files: int = 0
+    unchanged_files: int = 0
+    swept_files: int = 0
+    scanned_directories: int = 0
+    skipped_directories: int = 0
+    excluded_directories: int = 0
+    excluded_files: int = 0
+    # busy seconds of each stage, summed over the traversal workers
+    read_seconds: float = 0.0
+    stat_seconds: float = 0.0
+    insert_seconds: float = 0.0
+
+
+class ScanTarget(NamedTuple):
+    directory: str
+    rules: ExclusionRules
+    # whether the sub directories should be visited
+    expand: bool = True
+
+
+class ScannedDirectory(BaseModel):
+    """ the matched files of a single directory, unit of work of the streaming pipeline """
+    directory: str
+    # rows built from the stat results of the directory listing
+    file_infos: list[dict]
+
+
+# rows deleted in a transaction by the sweep of the files which no longer exist
+SWEEP_BATCH_SIZE = 1000
+
+
+class ScanPriority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+def getDevice(path: str) -> int:
+    """ scans on the same device compete for the same disk head or bandwidth """
+    try:
+        return stat(path).st_dev
+    except OSError:
+        return -1
 
 
 class FileScannerInstance(QObject):
     scanningFinished = Signal()
+    batchCommitted = Signal(int)
+    progressUpdated = Signal(object)
 
     def __init__(self, options: FileScanningOptions) -> None:
         super().__init__()
@@ -32,56 +124,737 @@ class FileScannerInstance(QObject):
         self.options = options
         self.working_thread = QThread()
         self.result = FileScanningResult()
-        self.callback: Callable[[FileScanningResult], None] | None = None
+        self.callbacks: list[Callable[[FileScanningResult], None]] = []
+        self.priority = ScanPriority.NORMAL
+        self.device = getDevice(options.root_directory)
+        self.cancelled = False
+        self.previous_snapshot: Optional[ScanSnapshot] = None
+        self.snapshot = ScanSnapshot(
+            root_directory=options.root_directory,
+            options_digest=options.getDigest()
+        )
+        self.stats_lock = Lock()
+        self.queue: Queue[Optional[ScannedDirectory]] = Queue(maxsize=options.queue_size)
+        self.generation = 0
+        # re-read directories whose direct files must be swept after an incremental scan
+        self.swept_directories: list[str] = []
+        # directories removed since the previous scan, their subtrees must be swept
+        self.removed_directories: list[str] = []
+        # rows of the matched files when not streaming
+        self.file_infos: list[dict] = []
+        # files of the committed directories, the others under the scanned directories are swept
+        self.seen = SeenFiles()
+        self.started = monotonic()
+        self.pending_directories = 0
+        self.traversal_finished = False
+        self.finished = Event()
+        self.last_progress: Optional[ScanProgress] = None
+        self.progress_log_path: Optional[Path] = None
+        self.checkpoint: Optional[ScanCheckpoint] = None
+        # directory -> whether its sub directories are discovered, for directories whose
+        # files are not committed yet. Only tracked when checkpointing is enabled
+        self.frontier: Optional[dict[str, bool]] = None
+
+    def getSubDirectories(self, target: ScanTarget, names: list[str]) -> list[ScanTarget]:
+        sub_directories = []
+        excluded = 0
+        for name in names:
+            path = join(target.directory, name)
+            if target.rules.isExcludedDirectory(path, name):
+                # the whole subtree is pruned
+                excluded += 1
+            else:
+                sub_directories.append(ScanTarget(path, target.rules))
+
+        if excluded > 0:
+            with self.stats_lock:
+                self.result.excluded_directories += excluded
+
+        return sub_directories
+
+    def cancel(self) -> None:
+        logger.info(f'cancelling scanning task {self.instance_id}')
+        self.cancelled = True
+
+    def visitDirectory(self, target: ScanTarget) -> list[ScanTarget]:
+        """ visit a single directory and collect the matched files in it, returns
+        the sub directories which should be visited next """
+        if self.cancelled:
+            return []
+
+        sub_directories, file_infos = self.readDirectory(target)
+        if not target.expand:
+            # resumed from a checkpoint, the sub directories are in the frontier already
+            sub_directories = []
+
+        with self.stats_lock:
+            self.pending_directories += len(sub_directories) - 1
+
+        if self.frontier is not None:
+            # the frontier must be updated before the files are published, otherwise the
+            # writer could commit them before the directory is marked as pending
+            with self.stats_lock:
+                for sub_directory in sub_directories:
+                    self.frontier[sub_directory.directory] = False
+
+                if len(file_infos) > 0:
+                    self.frontier[target.directory] = True
+                else:
+                    self.frontier.pop(target.directory, None)
+
+        if len(file_infos) > 0:
+            if self.options.streaming:
+                # blocks when the writer falls behind, which keeps the memory bounded
+                self.queue.put(ScannedDirectory(directory=target.directory, file_infos=file_infos))
+            else:
+                with self.stats_lock:
+                    self.file_infos.extend(file_infos)
+                    self.result.paths.extend(Path(info["file_path"]) for info in file_infos)
+
+        return sub_directories
+
+    def readDirectory(self, target: ScanTarget) -> tuple[list[ScanTarget], list[dict]]:
+        """ returns the sub directories to visit and the rows of the matched files in the
+        directory. The rows are built from the stat results cached by os.DirEntry, which
+        are filled by the directory listing itself on Windows """
+        directory = target.directory
+        try:
+            directory_stat = stat(directory)
+        except OSError:
+            return [], []
+
+        if self.previous_snapshot is not None:
+            previous = self.previous_snapshot.directories.get(directory)
+            if previous is not None and previous[0] == directory_stat.st_mtime_ns and previous[1] == directory_stat.st_ino:
+                # no entry is added, removed or renamed since the last scan, only the
+                # sub directories need to be checked
+                self.snapshot.directories[directory] = previous
+                with self.stats_lock:
+                    self.result.skipped_directories += 1
+                if previous[3]:
+                    target = ScanTarget(directory, target.rules.loadIgnoreFile(directory))
+                return self.getSubDirectories(target, previous[2]), []
+
+        sub_directories: list[str] = []
+        file_entries: list[DirEntry[str]] = []
+        has_ignore_file = False
+        read_started = monotonic()
+        try:
+            with scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_directory = entry.is_dir()
+                    except OSError:
+                        is_directory = False
+
+                    if is_directory:
+                        # symbolic links to directories are not followed, same as os.walk
+                        if not entry.is_symlink():
+                            sub_directories.append(entry.name)
+                        continue
+
+                    if entry.name == IGNORE_FILE_NAME:
+                        has_ignore_file = True
+                    elif self.options.isMatchedFile(entry.name):
+                        file_entries.append(entry)
+        except OSError:
+            return [], []
+
+        if has_ignore_file:
+            target = ScanTarget(directory, target.rules.loadIgnoreFile(directory))
+
+        stat_started = monotonic()
+        file_infos: list[dict] = []
+        excluded_files = 0
+        for entry in file_entries:
+            if target.rules.isExcludedFile(entry.path, entry.name):
+                excluded_files += 1
+                continue
+
+            try:
+                file_infos.append(getFileInfo(entry.path, entry.name, entry.stat(), entry.inode()))
+            except OSError as ex:
+                # the file could be removed or become inaccessible after being listed
+                logger.warning(f'failed to stat {entry.path}: {ex}')
+
+        stat_finished = monotonic()
+        if self.previous_snapshot is not None:
+            self.swept_directories.append(directory)
+            previous = self.previous_snapshot.directories.get(directory)
+            if previous is not None:
+                removed = set(previous[2]).difference(sub_directories)
+                self.removed_directories.extend(join(directory, name) for name in removed)
+
+        self.snapshot.directories[directory] = (
+            directory_stat.st_mtime_ns, directory_stat.st_ino, sub_directories, has_ignore_file
+        )
+        with self.stats_lock:
+            self.result.scanned_directories += 1
+            self.result.total_files += len(file_infos)
+            self.result.excluded_files += excluded_files
+            self.result.read_seconds += stat_started - read_started
+            self.result.stat_seconds += stat_finished - stat_started
+        return self.getSubDirectories(target, sub_directories), file_infos
+
+    def getRootTargets(self) -> list[ScanTarget]:
+        rules = ExclusionRules.compile(
+            self.options.root_directory, self.options.excluded_directories, self.options.nested_roots
+        )
+        if rules.isExcludedRoot():
+            return []
+
+        if self.checkpoint is None:
+            self.pending_directories = 1
+            return [ScanTarget(self.options.root_directory, rules)]
+
+        # resume from the frontier of the checkpoint, rules of the ignore files on the way
+        # from the root to the parent of each directory are restored, the own ignore file is
+        # loaded when the directory is visited
+        resolved: dict[str, ExclusionRules] = dict()
+        root = self.options.root_directory
+        self.pending_directories = len(self.checkpoint.frontier)
+        return [
+            ScanTarget(directory, rules if directory == root else rules.resolve(dirname(directory), resolved), not expanded)
+            for directory, expanded in self.checkpoint.frontier.items()
+        ]
 
     def startStandardScanning(self) -> None:
-        total_files = 0
+        pending = list(reversed(self.getRootTargets()))
+        while len(pending) > 0:
+            target = pending.pop()
+            pending.extend(reversed(self.visitDirectory(target)))
+
+    def startParallelScanning(self) -> None:
+        walker = ParallelDirectoryWalker(self.visitDirectory, self.options.parallelism)
+        walker.walk(self.getRootTargets())
+
+    def startTraversal(self) -> None:
+        if self.options.parallelism > 1:
+            self.startParallelScanning()
+        else:
+            self.startStandardScanning()
+
+    def startStreamingTraversal(self) -> None:
+        try:
+            self.startTraversal()
+        finally:
+            self.traversal_finished = True
+            self.queue.put(None)
 
-        for current_directory, sub_directories, filenames in walk(self.options.root_directory):
-            excluded = False
-            for exclude in self.options.excluded_directories:
-                if current_directory.startswith(exclude):
-                    excluded = True
+    def startStreamingWriter(self) -> bool:
+        """ consume the scanned directories and commit them in fixed size batches, so
+        results become searchable while the traversal is still running """
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+        batch_size = self.options.batch_size if self.result.incremental else self.options.bulk_batch_size
+        succeeded = True
+        batch: list[dict] = []
+        batch_directories: list[str] = []
+        last_checkpoint = monotonic()
+
+        def commit() -> None:
+            nonlocal succeeded, batch, batch_directories, last_checkpoint
+            insert_started = monotonic()
+            counts = service.write(
+                lambda storage: storage.addFileInfos(batch, self.generation), StoragePriority.BACKGROUND
+            )
+            self.result.insert_seconds += monotonic() - insert_started
+            if counts is not None:
+                self.addCommittedFiles(batch, counts)
+                self.batchCommitted.emit(self.result.committed_files)
+                if self.frontier is not None:
+                    with self.stats_lock:
+                        for directory in batch_directories:
+                            self.frontier.pop(directory, None)
+
+                    if monotonic() - last_checkpoint >= self.options.checkpoint_interval:
+                        self.saveCheckpoint()
+                        last_checkpoint = monotonic()
+            else:
+                succeeded = False
+
+            batch = []
+            batch_directories = []
+
+        item: Optional[ScannedDirectory] = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
                     break
 
-            if excluded:
-                # if the current directory is excluded, all subdirectories are excluded either
-                sub_directories.clear()
-                continue
+                batch.extend(item.file_infos)
+                batch_directories.append(item.directory)
+                if len(batch) >= batch_size:
+                    commit()
 
-            for filename in filenames:
-                _, extension_name = splitext(filename)
-                extension_name = extension_name.lower()
-                if extension_name not in self.options.extension_names:
-                    continue
+            if len(batch) > 0:
+                commit()
+        except Exception:
+            # stop the traversal, which could be blocked on the full queue
+            self.cancelled = True
+            while item is not None:
+                item = self.queue.get()
+
+            raise
+
+        return succeeded
+
+    def addCommittedFiles(self, file_infos: list[dict], counts: FileUpsertCounts) -> None:
+        self.seen.add(info["file_path"] for info in file_infos)
+        self.result.committed_files += len(file_infos)
+        self.result.inserted_files += counts.inserted
+        self.result.updated_files += counts.updated
+        self.result.unchanged_files += counts.unchanged
+
+    def saveCheckpoint(self) -> None:
+        assert self.frontier is not None
+        try:
+            seen_files = self.seen.save(self.options.root_directory)
+        except OSError as ex:
+            logger.error(f'failed to save the seen files of the scanning: {ex}')
+            return
+
+        with self.stats_lock:
+            checkpoint = ScanCheckpoint(
+                root_directory=self.options.root_directory,
+                options_digest=self.snapshot.options_digest,
+                generation=self.generation,
+                incremental=self.previous_snapshot is not None,
+                committed_files=self.result.committed_files,
+                frontier=dict(self.frontier),
+                swept_directories=list(self.swept_directories),
+                removed_directories=list(self.removed_directories),
+                seen_files=seen_files
+            )
+
+        try:
+            checkpoint.save()
+        except Exception as ex:
+            logger.error(f'failed to save scanning checkpoint: {ex}')
+
+    def sweepFiles(self) -> None:
+        """ remove the files which no longer exist in the scanned directories, which are
+        the stored files not seen by the scan """
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+
+        def sweep(directory: str, recursive: bool) -> int:
+            rowids = service.read(
+                lambda storage: storage.getUnseenFiles(directory, self.seen, recursive), StoragePriority.BACKGROUND
+            )
+            total = 0
+            # small writes, so other writes are not held back by a long sweep
+            for i in range(0, len(rowids), SWEEP_BATCH_SIZE):
+                batch = rowids[i:i + SWEEP_BATCH_SIZE]
+                total += service.write(
+                    lambda storage: storage.sweepFiles(batch, self.generation), StoragePriority.BACKGROUND
+                )
+
+            return total
+
+        if self.previous_snapshot is None:
+            total = sweep(self.options.root_directory, True)
+        else:
+            total = 0
+            for directory in self.swept_directories:
+                total += sweep(directory, False)
+            for directory in self.removed_directories:
+                total += sweep(directory, True)
+
+        self.result.swept_files = total
+        logger.info(f'swept {total} files which no longer exist under {self.options.root_directory}')
+        # the index segments written by the small batches of the scan are merged
+        service.write(lambda storage: storage.mergeSearchIndex(), StoragePriority.BACKGROUND)
+
+    def getProgress(self) -> ScanProgress:
+        now = monotonic()
+        with self.stats_lock:
+            progress = ScanProgress(
+                instance_id=str(self.instance_id),
+                root_directory=self.options.root_directory,
+                timestamp=time(),
+                elapsed=now - self.started,
+                finished=self.finished.is_set(),
+                traversal_finished=self.traversal_finished,
+                scanned_directories=self.result.scanned_directories,
+                skipped_directories=self.result.skipped_directories,
+                excluded_directories=self.result.excluded_directories,
+                pending_directories=max(self.pending_directories, 0),
+                matched_files=self.result.total_files,
+                excluded_files=self.result.excluded_files,
+                committed_files=self.result.committed_files,
+                read_seconds=self.result.read_seconds,
+                stat_seconds=self.result.stat_seconds,
+                insert_seconds=self.result.insert_seconds,
+                queue_depth=self.queue.qsize(),
+                queue_capacity=self.options.queue_size
+            )
+
+        last = self.last_progress
+        if last is None:
+            # the first window starts with the scanning
+            last = ScanProgress(instance_id=progress.instance_id, root_directory=progress.root_directory, timestamp=0, elapsed=0)
+
+        if progress.elapsed > last.elapsed:
+            window = progress.elapsed - last.elapsed
+            visited = progress.scanned_directories + progress.skipped_directories
+            progress.directory_rate = (visited - last.scanned_directories - last.skipped_directories) / window
+            progress.stat_rate = (progress.matched_files - last.matched_files) / window
+            progress.insert_rate = (progress.committed_files - last.committed_files) / window
+            progress.eta = self.estimateRemainingTime(progress)
+
+        self.last_progress = progress
+        return progress
+
+    def estimateRemainingTime(self, progress: ScanProgress) -> Optional[float]:
+        """ the directory count of the previous scan is the estimation of the total, the
+        remaining traversal and the commit backlog proceed concurrently """
+        traversal_eta = 0.0
+        if not progress.traversal_finished:
+            if self.previous_snapshot is None or progress.directory_rate <= 0:
+                return None
+
+            visited = progress.scanned_directories + progress.skipped_directories
+            expected = max(len(self.previous_snapshot.directories), visited + progress.pending_directories)
+            traversal_eta = (expected - visited) / progress.directory_rate
 
-                file_path = Path(current_directory) / filename
-                total_files += 1
-                self.result.paths.append(file_path)
+        insert_eta = 0.0
+        backlog = progress.matched_files - progress.committed_files
+        if backlog > 0:
+            if progress.insert_rate <= 0:
+                return None
+
+            insert_eta = backlog / progress.insert_rate
+
+        return max(traversal_eta, insert_eta)
+
+    def reportProgress(self) -> None:
+        progress = self.getProgress()
+        self.progressUpdated.emit(progress)
+        FileScanner.getEvents().progressUpdated.emit(progress)
+        if self.progress_log_path is None:
+            self.progress_log_path = ScanProgressLog.getLogPath()
+
+        ScanProgressLog.write(progress, self.progress_log_path)
+
+    def startReporting(self) -> None:
+        while not self.finished.wait(self.options.progress_interval):
+            self.reportProgress()
+
+    def prepareScanning(self) -> None:
+        # opened before the snapshot is loaded, a new database drops the snapshot of its root
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+        digest = self.snapshot.options_digest
+        if self.options.streaming and self.options.checkpoint_interval > 0:
+            self.checkpoint = ScanCheckpoint.load(self.options.root_directory, digest)
+            self.frontier = dict()
+
+        if self.checkpoint is not None:
+            seen = SeenFiles.load(self.options.root_directory, self.checkpoint.seen_files)
+            if seen is None:
+                # the unchanged files committed before could not be told apart from the removed ones
+                logger.warning('seen files of the interrupted scanning are lost, start over')
+                self.checkpoint = None
+                ScanCheckpoint.remove(self.options.root_directory)
+            else:
+                self.seen = seen
+
+        if self.checkpoint is not None:
+            logger.info(
+                f'resume file scanning from checkpoint: {len(self.checkpoint.frontier)} pending directories, '
+                f'{self.checkpoint.committed_files} files committed'
+            )
+            # the rows committed before the interruption keep their generation
+            self.generation = self.checkpoint.generation
+            self.result.committed_files = self.checkpoint.committed_files
+            self.swept_directories.extend(self.checkpoint.swept_directories)
+            self.removed_directories.extend(self.checkpoint.removed_directories)
+            if self.checkpoint.incremental:
+                self.previous_snapshot = ScanSnapshot.load(self.options.root_directory, digest)
+                if self.previous_snapshot is None:
+                    # the skipped directories cannot be told apart anymore
+                    logger.warning('snapshot of the interrupted incremental scanning is lost, start over')
+                    self.checkpoint = None
+                    ScanCheckpoint.remove(self.options.root_directory)
+
+        if self.checkpoint is None:
+            if self.options.incremental:
+                self.previous_snapshot = ScanSnapshot.load(self.options.root_directory, digest)
+                if self.previous_snapshot is None:
+                    logger.info(f'fall back to full scanning: {self.options.root_directory}')
+
+            self.generation = service.write(lambda storage: storage.beginScanGeneration())
+
+        self.result.incremental = self.previous_snapshot is not None
 
     def start(self) -> None:
         logger.info(f'start file scanning: {self.options.root_directory}')
+        try:
+            self.startFileScanning()
+        except Exception as ex:
+            # the snapshot is not saved, so the next scanning reads the directories again
+            logger.error(f'file scanning of {self.options.root_directory} failed: {ex}')
+            logger.info(format_exc())
+            self.result.failed = True
+        finally:
+            self.finished.set()
+            if self.options.progress_interval > 0:
+                try:
+                    self.reportProgress()
+                except Exception as ex:
+                    logger.error(f'failed to report the scanning progress: {ex}')
+
+            # releases the slot of the scanner and its device
+            self.scanningFinished.emit()
+
+    def startFileScanning(self) -> None:
+        self.prepareScanning()
         start = time()
-        self.startStandardScanning()
+        self.started = monotonic()
+        if self.options.progress_interval > 0:
+            Thread(target=self.startReporting, daemon=True).start()
+
+        # a full scan writes every file of the root, an incremental one only the changes
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+        with nullcontext() if self.result.incremental else service.bulkIngest():
+            if self.options.streaming:
+                traversal = Thread(target=self.startStreamingTraversal, daemon=True)
+                traversal.start()
+                succeeded = self.startStreamingWriter()
+                traversal.join()
+            else:
+                self.startTraversal()
+                self.traversal_finished = True
+                insert_started = monotonic()
+                counts = service.write(
+                    lambda storage: storage.addFileInfos(self.file_infos, self.generation), StoragePriority.BACKGROUND
+                )
+                self.result.insert_seconds += monotonic() - insert_started
+                succeeded = counts is not None
+                if counts is not None:
+                    self.addCommittedFiles(self.file_infos, counts)
 
         cost = time() - start
-        logger.info(f'file scanning task takes {cost:.2f} seconds with {len(self.result.paths)} files')
-        FileSystemStorage.getInstance().addFiles(self.result.paths)
+        logger.info(
+            f'file scanning task takes {cost:.2f} seconds with {self.result.total_files} files, '
+            f'{self.result.inserted_files} inserted, {self.result.updated_files} updated, '
+            f'{self.result.unchanged_files} unchanged, '
+            f'{self.result.scanned_directories} directories read, '
+            f'{self.result.skipped_directories} unchanged directories skipped, '
+            f'{self.result.excluded_directories} excluded subtrees pruned, '
+            f'busy seconds: read {self.result.read_seconds:.2f}, stat {self.result.stat_seconds:.2f}, '
+            f'insert {self.result.insert_seconds:.2f}'
+        )
+        self.result.cancelled = self.cancelled
+        if self.frontier is not None and (self.cancelled or not succeeded):
+            # the next scanning of the root continues from where this one stopped
+            self.saveCheckpoint()
+
+        if self.cancelled:
+            # the traversal is incomplete, neither sweep nor snapshot is valid
+            logger.info(f'scanning task {self.instance_id} cancelled')
+        elif succeeded:
+            self.sweepFiles()
+            try:
+                if self.checkpoint is None:
+                    self.snapshot.save()
+                else:
+                    # the resumed traversal only covers the frontier, the previous snapshot
+                    # still describes the directories whose files are stored
+                    logger.info('keep the previous snapshot after a resumed scanning')
+
+                if self.frontier is not None:
+                    ScanCheckpoint.remove(self.options.root_directory)
+            except Exception as ex:
+                logger.error(f'failed to save scanning snapshot: {ex}')
 
-        self.scanningFinished.emit()
+
+class FileScannerEvents(QObject):
+    """ lives in the main thread, requests from worker threads are queued to it """
+    scheduleRequested = Signal()
+    scanningRequested = Signal(object, int)
+    # progress of all scanning tasks, see ScanProgress
+    progressUpdated = Signal(object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.timeout.connect(self.onScheduleRequested)
+        self.scheduleRequested.connect(self.onScheduleRequested)
+        self.scanningRequested.connect(self.onScanningRequested)
+
+    def onScheduleRequested(self) -> None:
+        FileScanner.schedule()
+
+    def onScanningRequested(self, options: FileScanningOptions, priority: int) -> None:
+        FileScanner.startScanning(options, priority=ScanPriority(priority))
 
 
 class FileScanner:
+    """ schedules the scanning tasks: concurrent scans are capped globally and per device,
+    overlapping roots are merged into a single scan, and low priority scans are deferred
+    until the user has been idle for a while """
+
     scanning_tasks: dict[UUID, FileScannerInstance] = dict()
+    pending_tasks: list[FileScannerInstance] = []
+
+    max_concurrent_scans: int = 2
+    max_scans_per_device: int = 1
+    idle_delay: float = 60.0
+    last_activity: float = monotonic()
+
+    _events: Optional[FileScannerEvents] = None
+
+    @classmethod
+    def getEvents(cls) -> FileScannerEvents:
+        if cls._events is None:
+            cls._events = FileScannerEvents()
+
+        return cls._events
+
+    @classmethod
+    def notifyActivity(cls) -> None:
+        """ user interaction postpones the low priority scans """
+        cls.last_activity = monotonic()
+
+    @staticmethod
+    def contains(outer: FileScanningOptions, inner: FileScanningOptions) -> bool:
+        """ whether the scan of `outer` walks the files of `inner` into the same database """
+        if outer.extension_names != inner.extension_names or outer.excluded_directories != inner.excluded_directories \
+                or outer.nested_roots != inner.nested_roots:
+            return False
+
+        # the files of a scan are written to the database of its root
+        shards = StorageShards.getInstance()
+        if shards.getDatabasePath(outer.root_directory) != shards.getDatabasePath(inner.root_directory):
+            return False
+
+        root = outer.root_directory
+        return inner.root_directory == root or inner.root_directory.startswith(join(root, ''))
+
+    @staticmethod
+    def isAsStrict(outer: FileScanningOptions, inner: FileScanningOptions) -> bool:
+        # an incremental scan skips the unchanged directories a full scan reads again
+        if outer.incremental and not inner.incremental:
+            return False
+
+        # a streaming scan leaves the paths of the result empty
+        if outer.streaming and not inner.streaming:
+            return False
+
+        return outer.after is None or (inner.after is not None and outer.after <= inner.after)
+
+    @staticmethod
+    def getStrictest(outer: FileScanningOptions, inner: FileScanningOptions) -> FileScanningOptions:
+        """ the options of `outer` upgraded to do the work of `inner` as well """
+        after = None if outer.after is None or inner.after is None else min(outer.after, inner.after)
+        return outer.model_copy(update={
+            'incremental': outer.incremental and inner.incremental,
+            'streaming': outer.streaming and inner.streaming,
+            'after': after
+        })
+
+    @classmethod
+    def covers(cls, outer: FileScanningOptions, inner: FileScanningOptions) -> bool:
+        return cls.contains(outer, inner) and cls.isAsStrict(outer, inner)
 
     @classmethod
     def startScanning(
         cls, options: FileScanningOptions,
-        callback: Callable[[FileScanningResult], None] | None = None
-    ) -> None:
+        callback: Callable[[FileScanningResult], None] | None = None,
+        priority: ScanPriority = ScanPriority.NORMAL
+    ) -> UUID:
+        cls.getEvents()
+        for task in list(cls.scanning_tasks.values()) + cls.pending_tasks:
+            if task.cancelled or not cls.contains(task.options, options):
+                continue
+
+            if not cls.isAsStrict(task.options, options):
+                if task not in cls.pending_tasks:
+                    # the running scan cannot do more than it was started for
+                    continue
+
+                logger.info(f'upgrade the options of pending scanning task {task.instance_id}')
+                task.options = cls.getStrictest(task.options, options)
+
+            logger.info(f'{options.root_directory} is covered by scanning task {task.instance_id}')
+            task.priority = min(task.priority, priority)
+            if callback is not None:
+                task.callbacks.append(callback)
+            cls.schedule()
+            return task.instance_id
+
         inst = FileScannerInstance(options)
+        inst.priority = priority
+        if callback is not None:
+            inst.callbacks.append(callback)
+
+        # pending scans inside the new root are merged into it
+        for task in list(cls.pending_tasks):
+            if cls.contains(options, task.options):
+                logger.info(f'merge pending scanning task {task.instance_id} into {inst.instance_id}')
+                cls.pending_tasks.remove(task)
+                inst.options = cls.getStrictest(inst.options, task.options)
+                inst.priority = min(inst.priority, task.priority)
+                inst.callbacks.extend(task.callbacks)
+
+        # running scans inside the new root are cancelled, so the subtree is not walked twice
+        # at the same time. They keep their device until they stop, so the new scan waits
+        for task in list(cls.scanning_tasks.values()):
+            if not task.cancelled and cls.covers(inst.options, task.options):
+                logger.info(f'scanning task {task.instance_id} is taken over by {inst.instance_id}')
+                inst.priority = min(inst.priority, task.priority)
+                inst.callbacks.extend(task.callbacks)
+                task.callbacks = []
+                task.cancel()
+
+        cls.pending_tasks.append(inst)
+        cls.schedule()
+        return inst.instance_id
+
+    @classmethod
+    def requestScanning(cls, options: FileScanningOptions, priority: ScanPriority = ScanPriority.NORMAL) -> None:
+        """ thread safe version of startScanning, the task is scheduled in the main thread """
+        cls.getEvents().scanningRequested.emit(options, int(priority))
+
+    @classmethod
+    def cancelScanning(cls, instance_id: UUID) -> bool:
+        for task in cls.pending_tasks:
+            if task.instance_id == instance_id:
+                cls.pending_tasks.remove(task)
+                logger.info(f'pending scanning task {instance_id} cancelled')
+                return True
+
+        running = cls.scanning_tasks.get(instance_id)
+        if running is None:
+            return False
+
+        running.cancel()
+        return True
+
+    @classmethod
+    def schedule(cls) -> None:
+        idle_time = monotonic() - cls.last_activity
+        running_devices = [task.device for task in cls.scanning_tasks.values()]
+        cls.pending_tasks.sort(key=lambda task: task.priority)
+        for task in list(cls.pending_tasks):
+            if len(cls.scanning_tasks) >= cls.max_concurrent_scans:
+                break
+
+            if task.priority >= ScanPriority.LOW and idle_time < cls.idle_delay:
+                cls.getEvents().idle_timer.start(int((cls.idle_delay - idle_time) * 1000) + 100)
+                continue
+
+            if running_devices.count(task.device) >= cls.max_scans_per_device:
+                continue
+
+            cls.pending_tasks.remove(task)
+            running_devices.append(task.device)
+            cls.launch(task)
+
+    @classmethod
+    def launch(cls, inst: FileScannerInstance) -> None:
         cls.scanning_tasks[inst.instance_id] = inst
-        inst.callback = callback
         inst.working_thread.started.connect(inst.start)
         inst.working_thread.finished.connect(lambda: cls.finalizeScanning(inst))
         inst.scanningFinished.connect(inst.working_thread.quit)
@@ -96,5 +869,8 @@ class FileScanner:
             logger.warning(f'scanning task {inst.instance_id} not found')
             return
 
-        if instance.callback is not None:
-            instance.callback(instance.result)
+        for callback in instance.callbacks:
+            callback(instance.result)
+
+        # called from the finished working thread, let the main thread start the next tasks
+        cls.getEvents().scheduleRequested.emit()
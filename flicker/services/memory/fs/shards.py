@@ -0,0 +1,460 @@
+from flicker.services.memory.fs.storage import (
+    FileSystemStorage, StorageService, StoragePriority, StorageServiceStats,
+    FileInfoFilter, FileSearchCursor, FileSearchPage, FileCountEstimate, FileContentState, FileDuplicateGroup
+)
+from flicker.services.memory.fs.nameindex import FileNameIndex
+from flicker.services.memory.fs.snapshot import ScanSnapshot, ScanCheckpoint
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from itertools import groupby
+from pathlib import Path
+from pydantic import BaseModel, Field
+from threading import Lock
+from time import monotonic, time
+from traceback import format_exc
+from typing import Callable, Iterator, Optional
+from loguru import logger
+
+import heapq
+import os
+
+
+# the database shared by every data source before each of them had its own
+LEGACY_DATABASE_FILE = "fsmemory.db"
+
+
+def getShardPath(directory: Path, root_directory: str, database_file: str = "") -> Path:
+    """ the database of a data source, named after its root by default. A relative
+    `database_file` is placed in the directory of the shards """
+    if database_file == "":
+        return directory / f"{sha1(root_directory.encode('utf-8')).hexdigest()}.db"
+
+    return directory / Path(database_file).expanduser()
+
+
+def isUnder(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(os.path.join(directory, ''))
+
+
+def iterHashCounts(
+    services: list[StorageService], counts: Callable[[FileSystemStorage, str, int], list[tuple[str, int, int]]],
+    priority: StoragePriority, batch_size: int = 5000
+) -> Iterator[tuple[str, list[tuple[StorageService, int, int]]]]:
+    """ the (shard, files, value) counts of each hash in order of the hash. The shards are
+    read in batches, so no connection is held while the caller handles a hash """
+    def iterShard(service: StorageService) -> Iterator[tuple[str, StorageService, int, int]]:
+        after = ""
+        while True:
+            rows = service.read(lambda storage: counts(storage, after, batch_size), priority)
+            for hash, files, value in rows:
+                yield hash, service, files, value
+
+            if len(rows) < batch_size:
+                return
+
+            after = rows[-1][0]
+
+    merged = heapq.merge(*(iterShard(service) for service in services), key=lambda row: row[0])
+    for hash, rows in groupby(merged, key=lambda row: row[0]):
+        yield hash, [(service, files, value) for _, service, files, value in rows]
+
+
+class StorageShardManifest(BaseModel):
+    """ root directory -> database of the shards created so far, a database left without
+    a root once the data sources are configured is dropped """
+    shards: dict[str, str] = Field(default_factory=dict)
+
+
+class StorageShards:
+    """ a storage per data source, so the scans of different roots write to their own
+    databases through their own writer threads, and a huge source does not slow down the
+    queries of the others. A search fans out to every shard and their pages are merged by
+    rank. Removing a data source deletes the files of its database instead of its rows """
+
+    _instance: Optional['StorageShards'] = None
+    _instance_lock = Lock()
+    # answer the searches from a `FileNameIndex` of each shard, set before the instance is
+    # created. Off by default, the trigram search of the database is as fast
+    use_name_index = False
+
+    @classmethod
+    def getInstance(cls) -> 'StorageShards':
+        with cls._instance_lock:
+            if cls._instance is None:
+                from flicker.utils.settings import Settings
+                directory = Settings.getSettingsDirectory()
+                cls._instance = StorageShards(
+                    directory / "shards", name_index=cls.use_name_index,
+                    legacy_path=directory / LEGACY_DATABASE_FILE
+                )
+
+            return cls._instance
+
+    def __init__(
+        self, directory: Path, name_index: bool = False, max_workers: int = 4,
+        legacy_path: Optional[Path] = None
+    ) -> None:
+        self.directory = directory
+        self.name_index = name_index
+        self.legacy_path = legacy_path
+        if not directory.exists():
+            directory.mkdir(parents=True)
+
+        self.lock = Lock()
+        self.manifest_path = directory / "shards.json"
+        self.roots: dict[str, Path] = self.loadManifest()
+        self.services: dict[Path, StorageService] = dict()
+        # the searches of the shards run concurrently, each on a reader of its shard
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage-shards')
+
+    def loadManifest(self) -> dict[str, Path]:
+        if not self.manifest_path.exists():
+            return dict()
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = StorageShardManifest.model_validate_json(f.read())
+        except Exception as ex:
+            logger.warning(f'failed to load the manifest of the storage shards {self.manifest_path}: {ex}')
+            return dict()
+
+        return {root: Path(path) for root, path in manifest.shards.items()}
+
+    def saveManifest(self) -> None:
+        """ called with the lock held """
+        manifest = StorageShardManifest(shards={root: str(path) for root, path in self.roots.items()})
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(manifest.model_dump_json(indent=4))
+
+        os.replace(temp_path, self.manifest_path)
+
+    def configure(self, databases: dict[str, Path]) -> None:
+        """ set the database of each root directory of the data sources, the databases of
+        the removed sources are dropped and the shared database of the previous versions is
+        split into the shards. Called before any scan starts """
+        with self.lock:
+            for root, path in self.roots.items():
+                if databases.get(root) != path:
+                    ScanSnapshot.remove(root)
+                    ScanCheckpoint.remove(root)
+                    if path not in databases.values():
+                        self.dropDatabase(path)
+
+            self.roots = dict(databases)
+            self.saveManifest()
+            if self.legacy_path is not None and self.legacy_path.exists():
+                self.splitLegacyDatabase(self.legacy_path)
+
+    def splitLegacyDatabase(self, legacy_path: Path) -> None:
+        """ copy the files of the database shared by the data sources, with their contents
+        and fingerprints, into the shard of each root, then drop it. The shared database is
+        upgraded to the latest schema first, which moves its rows to the normalized paths.
+        The snapshots of a root stay valid as its shard holds the same files, a root whose
+        copy failed is scanned again in full. Called with the lock held """
+        logger.info(f'split the database shared by the data sources @ {legacy_path}')
+        started = monotonic()
+        try:
+            legacy = FileSystemStorage(legacy_path)
+            try:
+                legacy.db_initialize()
+                while legacy.migrateFilePaths():
+                    pass
+
+                if legacy.legacy_files:
+                    raise RuntimeError('the file paths are not normalized')
+            finally:
+                legacy.close()
+        except Exception as ex:
+            # the files of the shared database are scanned again into the shards
+            logger.error(f'failed to upgrade the shared database {legacy_path}: {ex}')
+            logger.info(format_exc())
+            self.dropDatabase(legacy_path)
+            return
+
+        for root, path in self.roots.items():
+            # the files of the nested roots are copied into their own shards
+            nested_roots = self.findNestedRoots(root)
+            service = self.services.get(path)
+            try:
+                if service is not None:
+                    copied = service.write(lambda storage: storage.importFiles(legacy_path, root, nested_roots))
+                else:
+                    if not path.parent.exists():
+                        path.parent.mkdir(parents=True)
+
+                    storage = FileSystemStorage(path)
+                    try:
+                        storage.db_initialize()
+                        copied = storage.importFiles(legacy_path, root, nested_roots)
+                    finally:
+                        storage.close()
+
+                logger.info(f'{copied} files of {root} copied into the storage shard @ {path}')
+            except Exception as ex:
+                logger.error(f'failed to copy the files of {root} into the storage shard @ {path}: {ex}')
+                logger.info(format_exc())
+                ScanSnapshot.remove(root)
+                ScanCheckpoint.remove(root)
+
+        self.dropDatabase(legacy_path)
+        logger.info(f'shared database split in {monotonic() - started:.1f} s')
+
+    def removeShard(self, root_directory: str) -> None:
+        """ drop the database of a removed data source, unless another source shares it.
+        The scans and the watcher of the root must be stopped """
+        with self.lock:
+            path = self.roots.pop(root_directory, None)
+            if path is None:
+                return
+
+            ScanSnapshot.remove(root_directory)
+            ScanCheckpoint.remove(root_directory)
+            if path not in self.roots.values():
+                self.dropDatabase(path)
+
+            self.saveManifest()
+
+    def dropDatabase(self, path: Path) -> None:
+        """ close the storage of the database and delete its files, whatever the number of
+        files it holds. Called with the lock held """
+        service = self.services.pop(path, None)
+        if service is not None:
+            service.close()
+
+        for file in (path, path.with_name(path.name + '-wal'), path.with_name(path.name + '-shm')):
+            if file.exists():
+                file.unlink()
+
+        FileNameIndex.remove(path.with_suffix('.names'))
+        logger.info(f'storage shard dropped @ {path}')
+
+    def getDatabasePath(self, root_directory: str) -> Path:
+        """ the database of the data source holding the directory, the innermost one when
+        the sources are nested. A directory out of every source has a database of its own """
+        with self.lock:
+            return self.findDatabasePath(root_directory)
+
+    def findDatabasePath(self, root_directory: str) -> Path:
+        """ called with the lock held """
+        roots = [root for root in self.roots if isUnder(root_directory, root)]
+        if len(roots) == 0:
+            return getShardPath(self.directory, root_directory)
+
+        return self.roots[max(roots, key=len)]
+
+    def getNestedRoots(self, root_directory: str) -> list[str]:
+        """ the roots of the other data sources under the directory with a database of their
+        own. A scan of the directory skips them, so no file is held by two shards """
+        with self.lock:
+            return self.findNestedRoots(root_directory)
+
+    def findNestedRoots(self, root_directory: str) -> list[str]:
+        """ called with the lock held """
+        path = self.findDatabasePath(root_directory)
+        return sorted(
+            root for root, root_path in self.roots.items()
+            if root != root_directory and isUnder(root, root_directory) and root_path != path
+        )
+
+    def getService(self, root_directory: str) -> StorageService:
+        """ the storage of the scans, watchers and extractions of the directory """
+        with self.lock:
+            path = self.findDatabasePath(root_directory)
+            if path not in self.roots.values():
+                self.roots[root_directory] = path
+                self.saveManifest()
+
+            return self.openShard(path)
+
+    def openShard(self, path: Path) -> StorageService:
+        """ called with the lock held """
+        service = self.services.get(path)
+        if service is not None:
+            return service
+
+        if not path.exists():
+            # the directories recorded by the snapshots are not in the new database, so
+            # the next scans of its roots are full ones
+            for root, root_path in self.roots.items():
+                if root_path == path:
+                    ScanSnapshot.remove(root)
+                    ScanCheckpoint.remove(root)
+
+            if not path.parent.exists():
+                path.parent.mkdir(parents=True)
+
+        logger.info(f'open storage shard @ {path}')
+        service = StorageService(path, name_index=self.name_index)
+        self.services[path] = service
+        return service
+
+    def getSearchShards(self, filter: FileInfoFilter) -> list[tuple[str, StorageService]]:
+        """ the shards which may hold the files of the filter keyed by their database, the
+        shards out of the absolute directories of the filter are skipped """
+        directories = [directory.lower() for directory in filter.directories]
+        absolute = len(directories) > 0 and all(os.path.isabs(directory) for directory in directories)
+        with self.lock:
+            paths: dict[Path, None] = dict()
+            for root, path in self.roots.items():
+                root = root.lower()
+                if not absolute or any(isUnder(root, d) or isUnder(d, root) for d in directories):
+                    paths[path] = None
+
+            return [(str(path), self.openShard(path)) for path in paths]
+
+    def searchFiles(self, filter: FileInfoFilter, priority: StoragePriority = StoragePriority.INTERACTIVE) -> FileSearchPage:
+        """ the page of the best ranked files of every shard. The cursor of the page holds
+        the position in each shard, a shard continues after the last file taken from it """
+        shards = self.getSearchShards(filter)
+        cursor = filter.cursor
+        if len(shards) == 0:
+            return FileSearchPage(file_paths=[])
+
+        if len(shards) == 1 and (cursor is None or cursor.shards is None):
+            return shards[0][1].searchFiles(filter, priority)
+
+        # the scores of the shards share the time of their recency
+        now = cursor.now if cursor is not None else int(time())
+        if cursor is not None and cursor.shards is not None:
+            positions = dict(cursor.shards)
+        else:
+            positions = {key: FileSearchCursor(now=now) for key, _ in shards}
+
+        active = [(key, service, positions[key]) for key, service in shards if positions.get(key) is not None]
+        pages = list(self.executor.map(
+            lambda shard: shard[1].searchFiles(filter.model_copy(update={'cursor': shard[2]}), priority), active
+        ))
+
+        # each page is ordered by rank, so the best ranks take a prefix of every page
+        merged = sorted(
+            ((rank, i, j) for i, page in enumerate(pages) for j, rank in enumerate(page.ranks)),
+            key=lambda item: item[0], reverse=True
+        )[:filter.limit]
+        # the scans of a data source skip the roots nested in it, so the shards hold
+        # different files and the merged page needs no deduplication
+        taken = [0] * len(pages)
+        file_paths: list[str] = []
+        ranks: list[tuple[float, int]] = []
+        for rank, i, j in merged:
+            taken[i] = j + 1
+            file_paths.append(pages[i].file_paths[j])
+            ranks.append(rank)
+
+        for (key, _, position), page, count in zip(active, pages, taken):
+            if count == len(page.file_paths):
+                positions[key] = page.cursor
+            elif count > 0 and position is not None:
+                # the shard continues in the window of the page, whose candidates are kept
+                score, file_id = page.ranks[count - 1]
+                positions[key] = position.model_copy(update={
+                    'score': score, 'file_id': file_id, 'window': page.window, 'window_start': page.window_start
+                })
+
+        next_cursor = None
+        if any(position is not None for position in positions.values()):
+            next_cursor = FileSearchCursor(now=now, shards=positions)
+
+        return FileSearchPage(file_paths=file_paths, cursor=next_cursor, ranks=ranks)
+
+    def estimateFileCount(self, filter: FileInfoFilter, priority: StoragePriority = StoragePriority.INTERACTIVE) -> FileCountEstimate:
+        """ the sum of the estimates of the shards, a lower bound when any is not exact """
+        services = [service for _, service in self.getSearchShards(filter)]
+        estimates = list(self.executor.map(lambda service: service.estimateFileCount(filter, priority), services))
+        return FileCountEstimate(
+            count=sum(estimate.count for estimate in estimates),
+            exact=all(estimate.exact for estimate in estimates)
+        )
+
+    def getShardServices(self) -> list[StorageService]:
+        """ the storage of every shard """
+        with self.lock:
+            return [self.openShard(path) for path in dict.fromkeys(self.roots.values())]
+
+    def getCollidedFingerprints(
+        self, priority: StoragePriority = StoragePriority.BACKGROUND, batch_size: int = 1000
+    ) -> Iterator[tuple[StorageService, list[FileContentState]]]:
+        """ the files sharing their sample hash with another file of any shard whose full hash
+        is not computed yet, in batches with the storage of their shard """
+        pending: dict[StorageService, list[str]] = dict()
+        services = self.getShardServices()
+        counts = iterHashCounts(services, lambda storage, after, limit: storage.getSampleHashCounts(after, limit), priority)
+        for sample_hash, shards in counts:
+            if sum(files for _, files, _ in shards) < 2:
+                continue
+
+            for service, _, unhashed in shards:
+                if unhashed == 0:
+                    continue
+
+                hashes = pending.setdefault(service, [])
+                hashes.append(sample_hash)
+                if len(hashes) >= batch_size:
+                    del pending[service]
+                    yield service, service.read(lambda storage: storage.getUnhashedFingerprints(hashes), priority)
+
+        for service, hashes in pending.items():
+            yield service, service.read(lambda storage: storage.getUnhashedFingerprints(hashes), priority)
+
+    def findDuplicateChunks(
+        self, file_path: str, fingerprint: str, priority: StoragePriority = StoragePriority.BACKGROUND
+    ) -> Optional[list[str]]:
+        """ the chunks of another file of any shard with the same content, None when no
+        such file is extracted yet """
+        for service in self.getShardServices():
+            with service.reader(priority) as storage:
+                source = storage.findProcessedDuplicate(file_path, fingerprint)
+                if source is not None:
+                    return [chunk.content for chunk in storage.getChunks(source)]
+
+        return None
+
+    def getDuplicateGroups(
+        self, priority: StoragePriority = StoragePriority.NORMAL, batch_size: int = 1000
+    ) -> list[FileDuplicateGroup]:
+        """ groups of files with identical content in any shard, the largest files first """
+        groups: dict[str, FileDuplicateGroup] = dict()
+        pending: dict[StorageService, list[str]] = dict()
+
+        def collect(service: StorageService, full_hashes: list[str]) -> None:
+            for full_hash, file_path in service.read(lambda storage: storage.getFullHashFiles(full_hashes), priority):
+                groups[full_hash].file_paths.append(file_path)
+
+        services = self.getShardServices()
+        counts = iterHashCounts(services, lambda storage, after, limit: storage.getFullHashCounts(after, limit), priority)
+        for full_hash, shards in counts:
+            if sum(files for _, files, _ in shards) < 2:
+                continue
+
+            groups[full_hash] = FileDuplicateGroup(fingerprint=full_hash, file_size=shards[0][2], file_paths=[])
+            for service, _, _ in shards:
+                hashes = pending.setdefault(service, [])
+                hashes.append(full_hash)
+                if len(hashes) >= batch_size:
+                    collect(service, pending.pop(service))
+
+        for service, hashes in pending.items():
+            collect(service, hashes)
+
+        for group in groups.values():
+            group.file_paths.sort()
+
+        return sorted(groups.values(), key=lambda group: (-group.file_size, group.fingerprint))
+
+    def getStats(self) -> dict[str, StorageServiceStats]:
+        """ the stats of the open shards keyed by their database """
+        with self.lock:
+            services = list(self.services.items())
+
+        return {str(path): service.getStats() for path, service in services}
+
+    def close(self) -> None:
+        """ wait for the queued writes of every shard and close them """
+        with self.lock:
+            for service in self.services.values():
+                service.close()
+
+            self.services.clear()
+
+        self.executor.shutdown()
@@ -0,0 +1,213 @@
+from pydantic import BaseModel, Field
+from pathlib import Path
+from typing import Iterable, Optional
+from loguru import logger
+from hashlib import blake2b, sha1
+from array import array
+from bisect import bisect_left
+
+import os
+
+
+# (st_mtime_ns, st_ino, names of the sub directories, whether the directory has an ignore file)
+DirectoryState = tuple[int, int, list[str], bool]
+
+
+class ScanSnapshot(BaseModel):
+    """ directory metadata recorded by the last completed scan of a root directory,
+    used by incremental scanning to skip directories that have not been changed """
+    root_directory: str
+    options_digest: str
+    directories: dict[str, DirectoryState] = Field(default_factory=dict)
+
+    @staticmethod
+    def getSnapshotDirectory() -> Path:
+        from flicker.utils.settings import Settings
+        directory = Settings.getSettingsDirectory() / "scanning"
+        if not directory.exists():
+            directory.mkdir(parents=True)
+
+        return directory
+
+    @staticmethod
+    def getSnapshotPath(root_directory: str) -> Path:
+        digest = sha1(root_directory.encode('utf-8')).hexdigest()
+        return ScanSnapshot.getSnapshotDirectory() / f"{digest}.snapshot.json"
+
+    @classmethod
+    def load(cls, root_directory: str, options_digest: str) -> Optional['ScanSnapshot']:
+        """ load the snapshot of the root directory, returns None if the snapshot is
+        missing, corrupt or recorded with different scanning options """
+        path = cls.getSnapshotPath(root_directory)
+        if not path.exists():
+            logger.info(f'no scanning snapshot found for {root_directory}')
+            return None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = ScanSnapshot.model_validate_json(f.read())
+        except Exception as ex:
+            logger.warning(f'failed to load scanning snapshot {path}: {ex}')
+            return None
+
+        if snapshot.root_directory != root_directory or snapshot.options_digest != options_digest:
+            logger.info(f'scanning options of {root_directory} changed, ignore the snapshot')
+            return None
+
+        return snapshot
+
+    @classmethod
+    def remove(cls, root_directory: str) -> None:
+        path = cls.getSnapshotPath(root_directory)
+        if path.exists():
+            path.unlink()
+
+    def save(self) -> None:
+        path = self.getSnapshotPath(self.root_directory)
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.model_dump_json())
+
+        # replace the previous snapshot atomically so a crash never leaves a truncated file
+        os.replace(temp_path, path)
+        logger.info(f'scanning snapshot saved to {path} with {len(self.directories)} directories')
+
+
+class ScanCheckpoint(BaseModel):
+    """ progress of a streaming scan which has not finished yet. The frontier holds the
+    directories whose files are not committed, mapped to whether their sub directories
+    were discovered already, so an interrupted scan resumes without visiting the
+    committed part of the tree again """
+    root_directory: str
+    options_digest: str
+    generation: int
+    incremental: bool = False
+    committed_files: int = 0
+    frontier: dict[str, bool] = Field(default_factory=dict)
+    swept_directories: list[str] = Field(default_factory=list)
+    removed_directories: list[str] = Field(default_factory=list)
+    # digests of the seen files saved by `SeenFiles.save`, later ones are not committed
+    seen_files: int = 0
+
+    @staticmethod
+    def getCheckpointPath(root_directory: str) -> Path:
+        digest = sha1(root_directory.encode('utf-8')).hexdigest()
+        return ScanSnapshot.getSnapshotDirectory() / f"{digest}.checkpoint.json"
+
+    @classmethod
+    def load(cls, root_directory: str, options_digest: str) -> Optional['ScanCheckpoint']:
+        path = cls.getCheckpointPath(root_directory)
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = ScanCheckpoint.model_validate_json(f.read())
+        except Exception as ex:
+            logger.warning(f'failed to load scanning checkpoint {path}: {ex}')
+            return None
+
+        if checkpoint.root_directory != root_directory or checkpoint.options_digest != options_digest:
+            logger.info(f'scanning options of {root_directory} changed, ignore the checkpoint')
+            return None
+
+        return checkpoint
+
+    @classmethod
+    def remove(cls, root_directory: str) -> None:
+        path = cls.getCheckpointPath(root_directory)
+        if path.exists():
+            path.unlink()
+
+        SeenFiles.remove(root_directory)
+
+    def save(self) -> None:
+        path = self.getCheckpointPath(self.root_directory)
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.model_dump_json())
+
+        os.replace(temp_path, path)
+        logger.info(f'scanning checkpoint saved with {len(self.frontier)} pending directories')
+
+
+class SeenFiles:
+    """ 64 bit digests of the paths of the files listed by a scan. The stored files under
+    the scanned directories which are not seen are swept, the unchanged files are not
+    written again by the scan so their rows tell nothing. The digests are appended to a
+    file next to the checkpoint, so a resumed scan still knows the files seen before """
+
+    def __init__(self) -> None:
+        self.digests = array('q')
+        # digests already appended to the file
+        self.saved = 0
+        # sorted copy of the digests for the lookups, the saved order must be kept
+        self.lookup = array('q')
+        self.lookup_stale = False
+
+    @staticmethod
+    def getSeenPath(root_directory: str) -> Path:
+        digest = sha1(root_directory.encode('utf-8')).hexdigest()
+        return ScanSnapshot.getSnapshotDirectory() / f"{digest}.seen"
+
+    @staticmethod
+    def getDigest(path: str) -> int:
+        # stable across processes unlike hash()
+        digest = blake2b(path.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little', signed=True)
+
+    @classmethod
+    def load(cls, root_directory: str, count: int) -> Optional['SeenFiles']:
+        """ the first `count` digests saved for the checkpoint of the root directory, None
+        when they are lost as the files seen before could not be told apart """
+        seen = SeenFiles()
+        path = cls.getSeenPath(root_directory)
+        try:
+            with open(path, 'rb') as f:
+                seen.digests.fromfile(f, count)
+        except (OSError, EOFError) as ex:
+            logger.warning(f'failed to load the seen files of {root_directory}: {ex}')
+            return None
+
+        seen.saved = len(seen.digests)
+        seen.lookup_stale = True
+        return seen
+
+    @classmethod
+    def remove(cls, root_directory: str) -> None:
+        path = cls.getSeenPath(root_directory)
+        if path.exists():
+            path.unlink()
+
+    def add(self, paths: Iterable[str]) -> None:
+        self.digests.extend(self.getDigest(path) for path in paths)
+        self.lookup_stale = True
+
+    def save(self, root_directory: str) -> int:
+        """ append the digests added since the last save, returns the number saved """
+        path = self.getSeenPath(root_directory)
+        if not path.exists():
+            self.saved = 0
+
+        with open(path, 'r+b' if self.saved > 0 else 'wb') as f:
+            f.seek(self.saved * self.digests.itemsize)
+            self.digests[self.saved:].tofile(f)
+            f.truncate()
+
+        self.saved = len(self.digests)
+        return self.saved
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def __contains__(self, path: object) -> bool:
+        if not isinstance(path, str):
+            return False
+
+        if self.lookup_stale:
+            self.lookup = array('q', sorted(self.digests))
+            self.lookup_stale = False
+
+        digest = self.getDigest(path)
+        i = bisect_left(self.lookup, digest)
+        return i < len(self.lookup) and self.lookup[i] == digest
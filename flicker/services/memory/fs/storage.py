@@ -1,10 +1,30 @@
+from flicker.services.memory.base import AbstractDataChunk
+from flicker.services.memory.fs.pinyin import getNameForms, isPinyinSupported
+from flicker.services.memory.fs.querycache import QueryCache, QueryCacheStats
+
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Container, Iterable, Iterator, NamedTuple, Optional, TypeVar
 from loguru import logger
-from pydantic import BaseModel
-from threading import current_thread
+from pydantic import BaseModel, Field
+from concurrent.futures import Future
+from contextlib import contextmanager
+from enum import IntEnum
+from itertools import count
+from queue import PriorityQueue
+from threading import Condition, Event, Lock, Thread
+from time import monotonic, time
 
+import heapq
+import json
 import sqlite3
+import os
+import sys
+
+if TYPE_CHECKING:
+    from flicker.services.memory.fs.nameindex import FileNameIndex, FileNameEntry
+
+
+T = TypeVar('T')
 
 
 CREATE_FILE_INFO = """
@@ -19,101 +39,2323 @@ CREATE TABLE IF NOT EXISTS fileinfo (
 );
 """
 
+ADD_SCAN_GENERATION = """
+ALTER TABLE fileinfo ADD COLUMN scan_generation INTEGER NOT NULL DEFAULT 0;
+CREATE TABLE IF NOT EXISTS storagemeta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO storagemeta (key, value) VALUES ('scan_generation', 0);
+"""
+
+ADD_FILE_SIZE_AND_INODE = """
+ALTER TABLE fileinfo ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE fileinfo ADD COLUMN inode INTEGER NOT NULL DEFAULT 0;
+"""
+
+CREATE_FILE_CONTENT = """
+CREATE TABLE IF NOT EXISTS filecontent (
+    file_path TEXT PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    modified_time TIMESTAMP NOT NULL,
+    status TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS filechunk (
+    file_path TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (file_path, chunk_index)
+);
+CREATE TRIGGER IF NOT EXISTS fileinfo_delete_content AFTER DELETE ON fileinfo BEGIN
+    DELETE FROM filechunk WHERE file_path = old.file_path;
+    DELETE FROM filecontent WHERE file_path = old.file_path;
+END;
+"""
+
+CREATE_FILE_FINGERPRINT = """
+CREATE TABLE IF NOT EXISTS filefingerprint (
+    file_path TEXT PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    modified_time TIMESTAMP NOT NULL,
+    sample_hash TEXT NOT NULL,
+    full_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS filefingerprint_sample_hash ON filefingerprint (sample_hash);
+CREATE INDEX IF NOT EXISTS filefingerprint_full_hash ON filefingerprint (full_hash);
+CREATE TRIGGER IF NOT EXISTS fileinfo_delete_fingerprint AFTER DELETE ON fileinfo BEGIN
+    DELETE FROM filefingerprint WHERE file_path = old.file_path;
+END;
+"""
+
+# the directory of a row is the path without the file name, both columns are indexed by
+# a trigram tokenizer so any substring of at least 3 characters is answered by the index.
+# The view serves as the external content, the index stores no copy of the text. VACUUM
+# may renumber the rowids of fileinfo, the index must be rebuilt after it
+CREATE_FILE_SEARCH = """
+CREATE VIEW IF NOT EXISTS filesearch_content AS
+SELECT rowid AS file_id, file_name, substr(file_path, 1, length(file_path) - length(file_name)) AS directory
+FROM fileinfo;
+CREATE VIRTUAL TABLE IF NOT EXISTS filesearch USING fts5(
+    file_name, directory,
+    content='filesearch_content', content_rowid='file_id',
+    tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS fileinfo_search_insert AFTER INSERT ON fileinfo BEGIN
+    INSERT INTO filesearch (rowid, file_name, directory)
+    VALUES (new.rowid, new.file_name, substr(new.file_path, 1, length(new.file_path) - length(new.file_name)));
+END;
+CREATE TRIGGER IF NOT EXISTS fileinfo_search_delete AFTER DELETE ON fileinfo BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory)
+    VALUES ('delete', old.rowid, old.file_name, substr(old.file_path, 1, length(old.file_path) - length(old.file_name)));
+END;
+CREATE TRIGGER IF NOT EXISTS fileinfo_search_update AFTER UPDATE OF file_path, file_name ON fileinfo
+WHEN old.file_path IS NOT new.file_path OR old.file_name IS NOT new.file_name BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory)
+    VALUES ('delete', old.rowid, old.file_name, substr(old.file_path, 1, length(old.file_path) - length(old.file_name)));
+    INSERT INTO filesearch (rowid, file_name, directory)
+    VALUES (new.rowid, new.file_name, substr(new.file_path, 1, length(new.file_path) - length(new.file_name)));
+END;
+INSERT INTO filesearch (filesearch) VALUES ('rebuild');
+CREATE INDEX IF NOT EXISTS fileinfo_modified_time ON fileinfo (modified_time);
+"""
+
+# the full pinyin and the initials of Chinese file names are indexed as two more columns,
+# they are empty for other names. The forms are computed in Python at ingest time, rows
+# stored before are filled by `fillNameForms`
+ADD_FILE_NAME_FORMS = """
+ALTER TABLE fileinfo ADD COLUMN file_name_pinyin TEXT NOT NULL DEFAULT '';
+ALTER TABLE fileinfo ADD COLUMN file_name_initials TEXT NOT NULL DEFAULT '';
+INSERT OR IGNORE INTO storagemeta (key, value) VALUES ('name_forms', 0);
+DROP TRIGGER fileinfo_search_insert;
+DROP TRIGGER fileinfo_search_delete;
+DROP TRIGGER fileinfo_search_update;
+DROP TABLE filesearch;
+DROP VIEW filesearch_content;
+CREATE VIEW filesearch_content AS
+SELECT rowid AS file_id, file_name, substr(file_path, 1, length(file_path) - length(file_name)) AS directory,
+    file_name_pinyin, file_name_initials
+FROM fileinfo;
+CREATE VIRTUAL TABLE filesearch USING fts5(
+    file_name, directory, file_name_pinyin, file_name_initials,
+    content='filesearch_content', content_rowid='file_id',
+    tokenize='trigram'
+);
+CREATE TRIGGER fileinfo_search_insert AFTER INSERT ON fileinfo BEGIN
+    INSERT INTO filesearch (rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        new.rowid, new.file_name, substr(new.file_path, 1, length(new.file_path) - length(new.file_name)),
+        new.file_name_pinyin, new.file_name_initials
+    );
+END;
+CREATE TRIGGER fileinfo_search_delete AFTER DELETE ON fileinfo BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        'delete', old.rowid, old.file_name, substr(old.file_path, 1, length(old.file_path) - length(old.file_name)),
+        old.file_name_pinyin, old.file_name_initials
+    );
+END;
+CREATE TRIGGER fileinfo_search_update AFTER UPDATE OF file_path, file_name, file_name_pinyin, file_name_initials ON fileinfo
+WHEN old.file_path IS NOT new.file_path OR old.file_name IS NOT new.file_name
+    OR old.file_name_pinyin IS NOT new.file_name_pinyin OR old.file_name_initials IS NOT new.file_name_initials BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        'delete', old.rowid, old.file_name, substr(old.file_path, 1, length(old.file_path) - length(old.file_name)),
+        old.file_name_pinyin, old.file_name_initials
+    );
+    INSERT INTO filesearch (rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        new.rowid, new.file_name, substr(new.file_path, 1, length(new.file_path) - length(new.file_name)),
+        new.file_name_pinyin, new.file_name_initials
+    );
+END;
+INSERT INTO filesearch (filesearch) VALUES ('rebuild');
+"""
+
+# the extension is the lowercased name after its last dot like os.path.splitext, empty for
+# names without one or only starting with dots. It is a virtual column computed by SQLite,
+# so no writer has to provide it, and an index on it stores the computed value. The number
+# of files of each extension is kept by triggers so the facets never scan the files
+ADD_FILE_FACETS = """
+ALTER TABLE fileinfo ADD COLUMN file_extension TEXT GENERATED ALWAYS AS (
+    CASE WHEN ltrim(rtrim(file_name_lower, replace(file_name_lower, '.', '')), '.') = '' THEN ''
+    ELSE substr(file_name_lower, length(rtrim(file_name_lower, replace(file_name_lower, '.', ''))) + 1) END
+) VIRTUAL;
+CREATE INDEX fileinfo_extension ON fileinfo (file_extension, modified_time);
+CREATE INDEX fileinfo_created_time ON fileinfo (created_time);
+CREATE INDEX fileinfo_file_size ON fileinfo (file_size);
+CREATE TABLE fileextension (
+    extension TEXT PRIMARY KEY,
+    file_count INTEGER NOT NULL
+);
+INSERT INTO fileextension (extension, file_count)
+SELECT coalesce(file_extension, ''), COUNT(*) FROM fileinfo GROUP BY 1;
+CREATE TRIGGER fileinfo_extension_insert AFTER INSERT ON fileinfo BEGIN
+    INSERT INTO fileextension (extension, file_count) VALUES (coalesce(new.file_extension, ''), 1)
+    ON CONFLICT (extension) DO UPDATE SET file_count = file_count + 1;
+END;
+CREATE TRIGGER fileinfo_extension_delete AFTER DELETE ON fileinfo BEGIN
+    UPDATE fileextension SET file_count = file_count - 1 WHERE extension = coalesce(old.file_extension, '');
+END;
+CREATE TRIGGER fileinfo_extension_update AFTER UPDATE OF file_name_lower ON fileinfo
+WHEN old.file_extension IS NOT new.file_extension BEGIN
+    UPDATE fileextension SET file_count = file_count - 1 WHERE extension = coalesce(old.file_extension, '');
+    INSERT INTO fileextension (extension, file_count) VALUES (coalesce(new.file_extension, ''), 1)
+    ON CONFLICT (extension) DO UPDATE SET file_count = file_count + 1;
+END;
+"""
+
+# the triggers of the normalized fileinfo, the directory of a file is looked up for the
+# directory column of the trigram index and for the path of its content and fingerprint
+FILE_INFO_TRIGGERS = """
+CREATE TRIGGER fileinfo_search_delete AFTER DELETE ON fileinfo BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        'delete', old.file_id, old.file_name,
+        (SELECT directory_path FROM filedirectory WHERE directory_id = old.directory_id),
+        old.file_name_pinyin, old.file_name_initials
+    );
+END;
+CREATE TRIGGER fileinfo_search_update AFTER UPDATE OF directory_id, file_name, file_name_pinyin, file_name_initials ON fileinfo
+WHEN old.directory_id IS NOT new.directory_id OR old.file_name IS NOT new.file_name
+    OR old.file_name_pinyin IS NOT new.file_name_pinyin OR old.file_name_initials IS NOT new.file_name_initials BEGIN
+    INSERT INTO filesearch (filesearch, rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        'delete', old.file_id, old.file_name,
+        (SELECT directory_path FROM filedirectory WHERE directory_id = old.directory_id),
+        old.file_name_pinyin, old.file_name_initials
+    );
+    INSERT INTO filesearch (rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        new.file_id, new.file_name,
+        (SELECT directory_path FROM filedirectory WHERE directory_id = new.directory_id),
+        new.file_name_pinyin, new.file_name_initials
+    );
+END;
+CREATE TRIGGER fileinfo_extension_delete AFTER DELETE ON fileinfo BEGIN
+    UPDATE fileextension SET file_count = file_count - 1 WHERE extension = old.file_extension;
+END;
+CREATE TRIGGER fileinfo_extension_update AFTER UPDATE OF file_name ON fileinfo
+WHEN old.file_extension IS NOT new.file_extension BEGIN
+    UPDATE fileextension SET file_count = file_count - 1 WHERE extension = old.file_extension;
+    INSERT INTO fileextension (extension, file_count) VALUES (new.file_extension, 1)
+    ON CONFLICT (extension) DO UPDATE SET file_count = file_count + 1;
+END;
+CREATE TRIGGER fileinfo_delete_content AFTER DELETE ON fileinfo BEGIN
+    DELETE FROM filechunk
+    WHERE file_path = (SELECT directory_path FROM filedirectory WHERE directory_id = old.directory_id) || old.file_name;
+    DELETE FROM filecontent
+    WHERE file_path = (SELECT directory_path FROM filedirectory WHERE directory_id = old.directory_id) || old.file_name;
+END;
+CREATE TRIGGER fileinfo_delete_fingerprint AFTER DELETE ON fileinfo BEGIN
+    DELETE FROM filefingerprint
+    WHERE file_path = (SELECT directory_path FROM filedirectory WHERE directory_id = old.directory_id) || old.file_name;
+END;
+"""
+
+# the rows moved from legacyfileinfo are indexed and counted already, they are skipped
+# while the migration runs, see NORMALIZE_FILE_PATHS
+FILE_INFO_INSERT_TRIGGERS = """
+CREATE TRIGGER fileinfo_search_insert AFTER INSERT ON fileinfo {unindexed} BEGIN
+    INSERT INTO filesearch (rowid, file_name, directory, file_name_pinyin, file_name_initials)
+    VALUES (
+        new.file_id, new.file_name,
+        (SELECT directory_path FROM filedirectory WHERE directory_id = new.directory_id),
+        new.file_name_pinyin, new.file_name_initials
+    );
+END;
+CREATE TRIGGER fileinfo_extension_insert AFTER INSERT ON fileinfo {unindexed} BEGIN
+    INSERT INTO fileextension (extension, file_count) VALUES (new.file_extension, 1)
+    ON CONFLICT (extension) DO UPDATE SET file_count = file_count + 1;
+END;
+"""
+
+# the path of a file is split into its directory, whose path is stored once in
+# filedirectory however many files it holds, and its name. The path of a directory ends
+# with a separator, so the path of a file is the path of its directory followed by its
+# name and the directories under a directory are a range of the paths. The lowercased
+# copies of the path and the name are dropped, the searches lowercase what they match and
+# the case insensitive lookups of the directories have an index with NOCASE collation.
+# Only the database shared by the data sources predates the migration, its rows are moved
+# out of legacyfileinfo by `migrateFilePaths` before it is split into the storage shards,
+# see `StorageShards.splitLegacyDatabase`. The rows keep their rowid, so their entries in
+# the trigram index and the counts of the extensions stay valid. The rowids of fileinfo
+# are never reused, the new rows are numbered after the legacy rows. The rowids are its
+# primary key, VACUUM keeps them
+NORMALIZE_FILE_PATHS = """
+DROP TRIGGER fileinfo_search_insert;
+DROP TRIGGER fileinfo_search_delete;
+DROP TRIGGER fileinfo_search_update;
+DROP TRIGGER fileinfo_extension_insert;
+DROP TRIGGER fileinfo_extension_delete;
+DROP TRIGGER fileinfo_extension_update;
+DROP TRIGGER fileinfo_delete_content;
+DROP TRIGGER fileinfo_delete_fingerprint;
+DROP INDEX fileinfo_modified_time;
+DROP INDEX fileinfo_extension;
+DROP INDEX fileinfo_created_time;
+DROP INDEX fileinfo_file_size;
+DROP VIEW filesearch_content;
+ALTER TABLE fileinfo RENAME TO legacyfileinfo;
+CREATE TABLE filedirectory (
+    directory_id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    directory_path TEXT NOT NULL UNIQUE
+);
+CREATE INDEX filedirectory_parent ON filedirectory (parent_id);
+CREATE INDEX filedirectory_path_nocase ON filedirectory (directory_path COLLATE NOCASE);
+CREATE TABLE fileinfo (
+    file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    directory_id INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    created_time TIMESTAMP,
+    modified_time TIMESTAMP,
+    accessed_time TIMESTAMP,
+    scan_generation INTEGER NOT NULL DEFAULT 0,
+    file_size INTEGER NOT NULL DEFAULT 0,
+    inode INTEGER NOT NULL DEFAULT 0,
+    file_name_pinyin TEXT NOT NULL DEFAULT '',
+    file_name_initials TEXT NOT NULL DEFAULT '',
+    file_extension TEXT GENERATED ALWAYS AS (
+        CASE WHEN ltrim(rtrim(file_name, replace(file_name, '.', '')), '.') = '' THEN ''
+        ELSE lower(substr(file_name, length(rtrim(file_name, replace(file_name, '.', ''))) + 1)) END
+    ) VIRTUAL,
+    UNIQUE (directory_id, file_name)
+);
+INSERT INTO sqlite_sequence (name, seq) SELECT 'fileinfo', coalesce(MAX(rowid), 0) FROM legacyfileinfo;
+CREATE INDEX fileinfo_modified_time ON fileinfo (modified_time);
+CREATE INDEX fileinfo_extension ON fileinfo (file_extension, modified_time);
+CREATE INDEX fileinfo_created_time ON fileinfo (created_time);
+CREATE INDEX fileinfo_file_size ON fileinfo (file_size);
+CREATE VIEW filesearch_content AS
+SELECT f.file_id, f.file_name, d.directory_path AS directory, f.file_name_pinyin, f.file_name_initials
+FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id;
+""" + FILE_INFO_TRIGGERS + FILE_INFO_INSERT_TRIGGERS.format(
+    unindexed="WHEN NOT EXISTS (SELECT 1 FROM legacyfileinfo WHERE rowid = new.file_id)"
+)
+
+# once every row is moved
+FINISH_FILE_PATH_MIGRATION = """
+DROP TRIGGER fileinfo_search_insert;
+DROP TRIGGER fileinfo_extension_insert;
+DROP TABLE legacyfileinfo;
+""" + FILE_INFO_INSERT_TRIGGERS.format(unindexed="")
+
+# the files named after a term are candidates of the trigram search whatever the age of
+# their row, see SEARCH_FILE_INFO
+ADD_FILE_NAME_INDEX = """
+CREATE INDEX fileinfo_file_name_nocase ON fileinfo (file_name COLLATE NOCASE);
+"""
+
+# each item upgrades the schema by one version, the version is kept in user_version
+SCHEMA_MIGRATIONS = [
+    CREATE_FILE_INFO,
+    ADD_SCAN_GENERATION,
+    ADD_FILE_SIZE_AND_INODE,
+    CREATE_FILE_CONTENT,
+    CREATE_FILE_FINGERPRINT,
+    CREATE_FILE_SEARCH,
+    ADD_FILE_NAME_FORMS,
+    ADD_FILE_FACETS,
+    NORMALIZE_FILE_PATHS,
+    ADD_FILE_NAME_INDEX,
+]
+
 INSERT_FILE_INFO = """
 INSERT INTO fileinfo (
-    file_path, file_path_lower,
-    file_name, file_name_lower,
-    created_time, modified_time, accessed_time
+    directory_id, file_name,
+    created_time, modified_time, accessed_time,
+    file_size, inode, scan_generation,
+    file_name_pinyin, file_name_initials
 ) VALUES (
-    :file_path, :file_path_lower,
-    :file_name, :file_name_lower,
-    :created_time, :modified_time, :accessed_time
-) ON CONFLICT(file_path) DO UPDATE SET
-    file_name = :file_name,
+    :directory_id, :file_name,
+    :created_time, :modified_time, :accessed_time,
+    :file_size, :inode, :scan_generation,
+    :file_name_pinyin, :file_name_initials
+) ON CONFLICT(directory_id, file_name) DO UPDATE SET
+    file_name_pinyin = :file_name_pinyin,
+    file_name_initials = :file_name_initials,
     created_time = :created_time,
     modified_time = :modified_time,
-    accessed_time = :accessed_time
+    accessed_time = :accessed_time,
+    file_size = :file_size,
+    inode = :inode,
+    scan_generation = :scan_generation
 ;
 """
 
+SELECT_SCAN_GENERATION = """
+SELECT value FROM storagemeta WHERE key = 'scan_generation';
+"""
 
-class FileInfoFilter(BaseModel):
-    keywords: list[str]
+UPDATE_SCAN_GENERATION = """
+UPDATE storagemeta SET value = value + 1 WHERE key = 'scan_generation';
+"""
 
+SELECT_DIRECTORY_ID = """
+SELECT directory_path, directory_id FROM filedirectory WHERE directory_path IN (SELECT value FROM json_each(?));
+"""
 
-class FileSystemStorage:
+INSERT_DIRECTORY = """
+INSERT INTO filedirectory (parent_id, directory_path) VALUES (?, ?);
+"""
+
+SELECT_DIRECTORY_PARENT = """
+SELECT parent_id FROM filedirectory WHERE directory_path = ?;
+"""
+
+# a directory is kept as long as it holds a file or a directory
+DELETE_EMPTY_DIRECTORY = """
+DELETE FROM filedirectory WHERE directory_id = ?1
+    AND NOT EXISTS (SELECT 1 FROM fileinfo WHERE directory_id = ?1)
+    AND NOT EXISTS (SELECT 1 FROM filedirectory WHERE parent_id = ?1)
+RETURNING parent_id;
+"""
+
+DELETE_DIRECTORY = """
+DELETE FROM filedirectory WHERE directory_path >= ? AND directory_path < ?;
+"""
+
+# the size and modified time of the stored files of a batch, given as pairs of their
+# directory id and name. A file whose both are the same is left untouched by the upsert
+# so a rescan of a static tree writes nothing
+SELECT_FILE_STATE = """
+SELECT f.directory_id, f.file_name, f.file_size, f.modified_time
+FROM json_each(?) j JOIN fileinfo f
+    ON f.directory_id = json_extract(j.value, '$[0]') AND f.file_name = json_extract(j.value, '$[1]');
+"""
+
+SELECT_DIRECTORY_FILE = """
+SELECT f.rowid, d.directory_path || f.file_name
+FROM filedirectory d JOIN fileinfo f ON f.directory_id = d.directory_id
+WHERE d.directory_path >= :lower AND d.directory_path < :upper;
+"""
+
+SELECT_DIRECTORY_DIRECT_FILE = """
+SELECT f.rowid, d.directory_path || f.file_name
+FROM filedirectory d JOIN fileinfo f ON f.directory_id = d.directory_id
+WHERE d.directory_path = :lower;
+"""
+
+# rows written by the scan, or by a later one or the watcher meanwhile, are kept
+DELETE_UNSEEN_FILE_INFO = """
+DELETE FROM fileinfo WHERE rowid IN (SELECT value FROM json_each(:rowids)) AND scan_generation < :scan_generation
+RETURNING rowid, (SELECT directory_path FROM filedirectory WHERE directory_id = fileinfo.directory_id) || file_name,
+    directory_id;
+"""
+
+DELETE_FILE_INFO = """
+DELETE FROM fileinfo
+WHERE directory_id = (SELECT directory_id FROM filedirectory WHERE directory_path = ?) AND file_name = ?
+RETURNING rowid, directory_id;
+"""
+
+SELECT_FILE_ROWID = """
+SELECT rowid FROM fileinfo WHERE directory_id = ? AND file_name = ?;
+"""
+
+SELECT_NAME_INDEX_ENTRY = """
+SELECT f.rowid, d.directory_path || f.file_name, f.file_name, f.file_name_pinyin, f.file_name_initials, f.modified_time
+FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id
+ORDER BY f.rowid;
+"""
+
+DELETE_DIRECTORY_FILE_INFO = """
+DELETE FROM fileinfo WHERE directory_id IN (
+    SELECT directory_id FROM filedirectory WHERE directory_path >= ? AND directory_path < ?
+);
+"""
+
+SELECT_LEGACY_FILE_TABLE = """
+SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'legacyfileinfo';
+"""
+
+# the legacy rows are moved in the transaction of a write before it touches them, the
+# latest rows first when the migration moves a batch
+SELECT_LEGACY_FILE_INFO = """
+SELECT rowid, file_path, coalesce(file_name, ''), created_time, modified_time, accessed_time,
+    scan_generation, file_size, inode, file_name_pinyin, file_name_initials
+FROM legacyfileinfo WHERE {condition}
+ORDER BY rowid DESC
+LIMIT :limit;
+"""
+
+# a row which cannot be moved is dropped, the next scan finds its file again
+MOVE_FILE_INFO = """
+INSERT OR IGNORE INTO fileinfo (
+    file_id, directory_id, file_name,
+    created_time, modified_time, accessed_time,
+    scan_generation, file_size, inode,
+    file_name_pinyin, file_name_initials
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+DELETE_LEGACY_FILE_INFO = """
+DELETE FROM legacyfileinfo WHERE rowid IN (SELECT value FROM json_each(?));
+"""
+
+SELECT_LEGACY_DIRECTORY_FILE = """
+SELECT rowid, file_path FROM legacyfileinfo WHERE file_path >= :lower AND file_path < :upper;
+"""
+
+SELECT_LEGACY_DIRECTORY_DIRECT_FILE = """
+SELECT rowid, file_path FROM legacyfileinfo
+WHERE file_path >= :lower AND file_path < :upper AND INSTR(SUBSTR(file_path, :name_offset), :separator) = 0;
+"""
+
+SELECT_LEGACY_NAME_INDEX_ENTRY = """
+SELECT rowid, file_path, coalesce(file_name, ''), file_name_pinyin, file_name_initials, modified_time
+FROM legacyfileinfo ORDER BY rowid;
+"""
+
+# the files of an attached database are copied into another by `importFiles` a few
+# directories at a time, with the pinyin forms computed already
+SELECT_IMPORT_DIRECTORY = """
+SELECT directory_id FROM source.filedirectory d
+WHERE directory_path >= :lower AND directory_path < :upper AND NOT EXISTS (
+    SELECT 1 FROM json_each(:skipped) r
+    WHERE d.directory_path >= json_extract(r.value, '$[0]') AND d.directory_path < json_extract(r.value, '$[1]')
+);
+"""
+
+SELECT_IMPORT_FILE_INFO = """
+SELECT d.directory_path || f.file_name AS file_path, f.file_name, f.created_time, f.modified_time, f.accessed_time,
+    f.file_size, f.inode, f.file_name_pinyin, f.file_name_initials
+FROM source.filedirectory d JOIN source.fileinfo f ON f.directory_id = d.directory_id
+WHERE d.directory_id IN (SELECT value FROM json_each(?));
+"""
+
+# the contents and fingerprints are keyed by the path, so they stay valid for the copies
+# of the files which have the same size and modified time
+IMPORT_FILE_CONTENT = """
+INSERT OR IGNORE INTO filecontent (file_path, file_size, modified_time, status, chunk_count)
+SELECT file_path, file_size, modified_time, status, chunk_count FROM source.filecontent s
+WHERE file_path >= :lower AND file_path < :upper AND NOT EXISTS (
+    SELECT 1 FROM json_each(:skipped) r
+    WHERE s.file_path >= json_extract(r.value, '$[0]') AND s.file_path < json_extract(r.value, '$[1]')
+);
+"""
+
+IMPORT_FILE_CHUNK = """
+INSERT OR IGNORE INTO filechunk (file_path, chunk_index, content)
+SELECT file_path, chunk_index, content FROM source.filechunk s
+WHERE file_path >= :lower AND file_path < :upper AND NOT EXISTS (
+    SELECT 1 FROM json_each(:skipped) r
+    WHERE s.file_path >= json_extract(r.value, '$[0]') AND s.file_path < json_extract(r.value, '$[1]')
+);
+"""
+
+IMPORT_FILE_FINGERPRINT = """
+INSERT OR IGNORE INTO filefingerprint (file_path, file_size, modified_time, sample_hash, full_hash)
+SELECT file_path, file_size, modified_time, sample_hash, full_hash FROM source.filefingerprint s
+WHERE file_path >= :lower AND file_path < :upper AND NOT EXISTS (
+    SELECT 1 FROM json_each(:skipped) r
+    WHERE s.file_path >= json_extract(r.value, '$[0]') AND s.file_path < json_extract(r.value, '$[1]')
+);
+"""
+
+SELECT_CONTENT_STATE = """
+SELECT d.directory_path || f.file_name, f.file_size, f.modified_time,
+    c.file_size IS f.file_size AND c.modified_time IS f.modified_time
+FROM filedirectory d JOIN fileinfo f ON f.directory_id = d.directory_id
+LEFT JOIN filecontent c ON c.file_path = d.directory_path || f.file_name
+WHERE d.directory_path >= ? AND d.directory_path < ?;
+"""
+
+DELETE_FILE_CHUNK = """
+DELETE FROM filechunk WHERE file_path = ?;
+"""
+
+INSERT_FILE_CHUNK = """
+INSERT INTO filechunk (file_path, chunk_index, content) VALUES (?, ?, ?);
+"""
+
+INSERT_FILE_CONTENT = """
+INSERT OR REPLACE INTO filecontent (file_path, file_size, modified_time, status, chunk_count)
+VALUES (:file_path, :file_size, :modified_time, :status, :chunk_count);
+"""
+
+SELECT_FILE_CHUNK = """
+SELECT chunk_index, content FROM filechunk WHERE file_path = ? ORDER BY chunk_index;
+"""
+
+SELECT_FINGERPRINT_STATE = """
+SELECT d.directory_path || f.file_name, f.file_size, f.modified_time,
+    p.file_size IS f.file_size AND p.modified_time IS f.modified_time
+FROM filedirectory d JOIN fileinfo f ON f.directory_id = d.directory_id
+LEFT JOIN filefingerprint p ON p.file_path = d.directory_path || f.file_name
+WHERE d.directory_path >= ? AND d.directory_path < ?;
+"""
+
+INSERT_FILE_FINGERPRINT = """
+INSERT OR REPLACE INTO filefingerprint (file_path, file_size, modified_time, sample_hash, full_hash)
+VALUES (:file_path, :file_size, :modified_time, :sample_hash, :full_hash);
+"""
+
+# the counts of the shards are merged in order of the hash, a batch continues after the
+# last hash of the previous one
+SELECT_SAMPLE_HASH_COUNT = """
+SELECT sample_hash, COUNT(*), COUNT(*) - COUNT(full_hash) FROM filefingerprint
+WHERE sample_hash > ? GROUP BY sample_hash ORDER BY sample_hash LIMIT ?;
+"""
+
+SELECT_UNHASHED_FINGERPRINT = """
+SELECT file_path, file_size, modified_time FROM filefingerprint
+WHERE full_hash IS NULL AND sample_hash IN (SELECT value FROM json_each(?));
+"""
 
-    _instances: dict[int, 'FileSystemStorage'] = dict()
+UPDATE_FULL_HASH = """
+UPDATE filefingerprint SET full_hash = ? WHERE file_path = ?;
+"""
+
+SELECT_DUPLICATE_FINGERPRINT = """
+SELECT full_hash, file_size, file_path FROM filefingerprint
+WHERE full_hash IN (
+    SELECT full_hash FROM filefingerprint WHERE full_hash IS NOT NULL
+    GROUP BY full_hash HAVING COUNT(*) > 1
+)
+ORDER BY file_size DESC, full_hash, file_path;
+"""
+
+SELECT_FULL_HASH_COUNT = """
+SELECT full_hash, COUNT(*), MAX(file_size) FROM filefingerprint
+WHERE full_hash > ? GROUP BY full_hash ORDER BY full_hash LIMIT ?;
+"""
+
+SELECT_FULL_HASH_FILE = """
+SELECT full_hash, file_path FROM filefingerprint
+WHERE full_hash IN (SELECT value FROM json_each(?));
+"""
+
+SELECT_FULL_HASH = """
+SELECT p.file_path, p.full_hash FROM filedirectory d
+JOIN fileinfo f ON f.directory_id = d.directory_id
+JOIN filefingerprint p ON p.file_path = d.directory_path || f.file_name
+WHERE d.directory_path >= ? AND d.directory_path < ? AND p.full_hash IS NOT NULL
+    AND p.file_size = f.file_size AND p.modified_time = f.modified_time;
+"""
+
+SELECT_PROCESSED_DUPLICATE = """
+SELECT p.file_path FROM filefingerprint p
+JOIN filecontent c ON c.file_path = p.file_path
+WHERE p.full_hash = ? AND p.file_path != ? AND c.status = 'ok'
+    AND c.file_size = p.file_size AND c.modified_time = p.modified_time
+LIMIT 1;
+"""
+
+# trigram index lookup. The candidates are the latest indexed matches: fts5 walks the
+# index by descending rowid and seeks to a range of rowids, so a window is collected range
+# by range, each twice as large as the previous one, until it holds enough candidates or
+# the time of the filter is spent. The cost of a window is bounded even for the terms made
+# of common trigrams which match few files. The files whose name starts with a term, like
+# `report.pdf` or `Report (2).docx`, are added to the first window by the index of the
+# names whatever their age. Candidates are ranked by the terms found in the name,
+# normalized by the length of the name like bm25, plus a recency bonus decaying with the
+# age in months. bm25 itself is not used as it needs the number of rows matching each
+# phrase, which evaluates every match of a common term. Once the candidates of a window are
+# paged through, the next window continues below it
+SELECT_SEARCH_CANDIDATE = """
+SELECT s.rowid FROM filesearch s {files}
+WHERE filesearch MATCH :match AND s.rowid >= :window_start AND s.rowid < :window {conditions}
+ORDER BY s.rowid DESC
+LIMIT :candidates;
+"""
+
+# the paths are only built for the files of the page
+SEARCH_FILE_INFO = """
+SELECT d.directory_path || f.file_name, r.score, r.file_id FROM (
+    SELECT file_id, score FROM (
+        SELECT f.rowid AS file_id,
+            ({name_hits}) * :name_weight / (1.0 + length(f.file_name) / 32.0)
+                + :recency_weight / (1.0 + max(:now - f.modified_time, 0) / 2592000.0) AS score
+        FROM (SELECT value AS file_id FROM json_each(:candidate_ids) {named}) c
+        JOIN fileinfo f ON f.rowid = c.file_id
+    ) {keyset}
+    ORDER BY score DESC, file_id DESC
+    LIMIT :limit
+) r JOIN fileinfo f ON f.rowid = r.file_id JOIN filedirectory d ON d.directory_id = f.directory_id
+ORDER BY r.score DESC, r.file_id DESC;
+"""
+
+# the named files are few, every term and directory is matched against them by INSTR. The
+# index of the names is forced as the planner prefers the index of the extensions, which
+# holds far more files
+SEARCH_NAMED_FILE_INFO = """
+UNION
+SELECT * FROM (
+    SELECT f.rowid FROM fileinfo f INDEXED BY fileinfo_file_name_nocase
+    JOIN filedirectory d ON d.directory_id = f.directory_id
+    WHERE ({prefixes}) AND {conditions}
+    LIMIT :candidates
+)
+"""
+
+# rowids of the first range of a window, see SELECT_SEARCH_CANDIDATE
+SEARCH_RANGE_ROWS = 8192
+
+SELECT_MAX_FILE_ID = """
+SELECT coalesce(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'fileinfo';
+"""
+
+SEARCH_KEYSET = "WHERE (score, file_id) < (:score, :file_id)"
+
+# terms shorter than a trigram are matched by a scan. The most recent files are scanned
+# first in the order of the modified time index, which stops as soon as enough files match.
+# Walking the whole index is much slower than scanning the table, so the table is scanned
+# when the recent files are not enough. The window holds the recent files which satisfy
+# the predicates, so a time range starts the window at its end. Without predicates the
+# window is read from the index alone, only the files of the window are looked up. The
+# first window holds a few pages of files and grows with the density of the matches
+SCAN_RECENT_FILE_INFO = """
+SELECT d.directory_path || f.file_name, f.modified_time, f.rowid FROM (
+    SELECT f.rowid AS file_id FROM fileinfo f
+    WHERE {predicates}
+    ORDER BY f.modified_time DESC, f.rowid DESC
+    LIMIT :window
+) w JOIN fileinfo f ON f.rowid = w.file_id JOIN filedirectory d ON d.directory_id = f.directory_id
+WHERE {conditions}
+ORDER BY f.modified_time DESC, f.rowid DESC
+LIMIT :limit;
+"""
+
+SCAN_RECENT_KEYSET = "(f.modified_time, f.rowid) < (:score, :file_id)"
+
+# pages of files in the first window of SCAN_RECENT_FILE_INFO
+SCAN_FIRST_WINDOW_PAGES = 16
+
+SCAN_FILE_INFO = """
+SELECT d.directory_path || f.file_name, f.modified_time, f.rowid
+FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id
+WHERE {conditions} {keyset}
+ORDER BY +f.modified_time DESC, f.rowid DESC
+LIMIT :limit;
+"""
+
+SCAN_KEYSET = "AND (f.modified_time, f.rowid) < (:score, :file_id)"
+
+# the files found by the indexes of the predicates are few enough to be ranked at once
+# like the matches of the trigram index, every term is matched against them by INSTR
+FILTER_FILE_INFO = """
+SELECT file_path, score, file_id FROM (
+    SELECT d.directory_path || f.file_name AS file_path, f.rowid AS file_id,
+        ({name_hits}) * :name_weight / (1.0 + length(f.file_name) / 32.0)
+            + :recency_weight / (1.0 + max(:now - f.modified_time, 0) / 2592000.0) AS score
+    FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id WHERE {conditions}
+) {keyset}
+ORDER BY score DESC, file_id DESC
+LIMIT :limit;
+"""
+
+# the matches are counted up to a cap, so a count never costs more than the cap
+COUNT_SEARCH_FILE_INFO = """
+SELECT COUNT(*) FROM (
+    SELECT 1 FROM filesearch s JOIN fileinfo f ON f.rowid = s.rowid JOIN filedirectory d ON d.directory_id = f.directory_id
+    WHERE filesearch MATCH :match {conditions}
+    LIMIT :cap
+);
+"""
+
+COUNT_SCAN_FILE_INFO = """
+SELECT COUNT(*) FROM (
+    SELECT 1 FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id WHERE {conditions} LIMIT :cap
+);
+"""
+
+# the predicates read no directory, their files are counted from the indexes of fileinfo
+COUNT_FILE_INFO = """
+SELECT COUNT(*) FROM (SELECT 1 FROM fileinfo f WHERE {predicates} LIMIT :cap);
+"""
+
+SELECT_EXTENSION_COUNT = """
+SELECT extension, file_count FROM fileextension WHERE file_count > 0
+ORDER BY file_count DESC, extension
+LIMIT ?;
+"""
+
+SUM_EXTENSION_COUNT = """
+SELECT coalesce(SUM(file_count), 0) FROM fileextension WHERE extension IN ({extensions});
+"""
+
+# WAL lets the readers see the last committed state while a transaction is being written.
+# With synchronous NORMAL a commit does not wait for fsync, a power loss may lose the last
+# transactions but never corrupts the database
+WRITER_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA journal_size_limit = 67108864;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+PRAGMA temp_store = MEMORY;
+"""
+
+# the page cache is per connection, the readers share the pages mapped by mmap
+READER_PRAGMAS = """
+PRAGMA cache_size = -16384;
+PRAGMA mmap_size = 268435456;
+PRAGMA temp_store = MEMORY;
+"""
+
+# pages written to the WAL before a commit checkpoints it, the default of SQLite
+DEFAULT_AUTOCHECKPOINT = 1000
+
+# frames in the WAL after which the background checkpoint waits for the readers and the
+# writer to restart the WAL from the beginning, otherwise it grows as long as readers
+# keep reading while the writer keeps writing
+RESTART_CHECKPOINT_FRAMES = 16384
+
+SELECT_NAME_FORMS_STATE = """
+SELECT value FROM storagemeta WHERE key = 'name_forms';
+"""
+
+UPDATE_NAME_FORMS_STATE = """
+UPDATE storagemeta SET value = ? WHERE key = 'name_forms';
+"""
+
+# the names with a character out of the printable ascii range may contain Han characters
+SELECT_UNCONVERTED_FILE_NAME = """
+SELECT f.rowid, f.file_name, d.directory_path || f.file_name, f.modified_time
+FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id
+WHERE f.rowid > ? AND f.file_name_pinyin = '' AND f.file_name GLOB '*[^ -~]*'
+ORDER BY f.rowid
+LIMIT ?;
+"""
+
+UPDATE_FILE_NAME_FORMS = """
+UPDATE fileinfo SET file_name_pinyin = ?, file_name_initials = ? WHERE rowid = ?;
+"""
+
+MERGE_FILE_SEARCH = """
+INSERT INTO filesearch (filesearch, rank) VALUES ('merge', ?);
+"""
+
+REBUILD_FILE_SEARCH = """
+INSERT INTO filesearch (filesearch) VALUES ('rebuild');
+"""
+
+
+def getPrefixRange(directory: str) -> tuple[str, str]:
+    """ returns the [lower, upper) bound of the paths under the directory, the range
+    can be answered by the index of the directory paths """
+    if not directory.endswith(('/', os.sep)):
+        directory += os.sep
+
+    return directory, directory[:-1] + chr(ord(directory[-1]) + 1)
+
+
+def getLowerFunction(text: str) -> str:
+    """ the SQL function lowercasing what is matched against the lowercased text, lower()
+    of SQLite only folds the ascii letters which is enough for an ascii text """
+    return 'lower' if text.isascii() else 'unicode_lower'
+
+
+def getFileDirectory(path: str, name: str) -> str:
+    """ the path of the directory of a file, ending with a separator """
+    return path[:len(path) - len(name)]
+
+
+def splitFilePath(path: str) -> tuple[str, str]:
+    """ the directory and the name of a file """
+    name = os.path.basename(path)
+    return getFileDirectory(path, name), name
+
+
+def getParentDirectory(directory: str) -> Optional[str]:
+    """ the parent of a directory ending with a separator, None for a root """
+    head = directory.rstrip('/' + os.sep)
+    parent = os.path.dirname(head)
+    if head == '' or parent == '' or parent == head:
+        return None
+
+    return parent if parent.endswith(('/', os.sep)) else parent + os.sep
+
+
+def getCreatedTime(stat: os.stat_result) -> float:
+    """ st_birthtime is only reported on Windows (since python 3.12), macOS and BSD. The
+    stdlib does not expose statx, so Linux falls back to st_ctime which is the time of
+    the last metadata change, and is also the creation time on Windows before 3.12 """
+    birthtime = getattr(stat, 'st_birthtime', None)
+    return stat.st_ctime if birthtime is None else birthtime
+
+
+def getFileInfo(path: str, name: str, stat: os.stat_result, inode: Optional[int] = None) -> dict:
+    """ build the row of a file from a stat result, `inode` overrides st_ino which is
+    always 0 in the stat result cached by os.DirEntry on Windows """
+    forms = getNameForms(name)
+    return {
+        "file_path": path,
+        "file_name": name,
+        "file_name_pinyin": forms.pinyin,
+        "file_name_initials": forms.initials,
+        "created_time": int(getCreatedTime(stat)),
+        "modified_time": int(stat.st_mtime),
+        "accessed_time": int(stat.st_atime),
+        "file_size": stat.st_size,
+        "inode": stat.st_ino if inode is None else inode
+    }
+
+
+class FileSearchCursor(BaseModel):
+    """ position after the last file of a page. Files are ordered by score then rowid, both
+    descending, the score of a scan without the index is the modified time. The next page
+    continues from the position without rescanning the previous pages """
+    score: Optional[float] = None
+    file_id: Optional[int] = None
+    # upper bound, exclusive, of the rowids of the candidate window of an indexed search,
+    # None for the first window. The position is the start of the window when score and
+    # file_id are None
+    window: Optional[int] = None
+    # lower bound, inclusive, of the window once its candidates are collected, the next
+    # pages of the window rank the same candidates
+    window_start: Optional[int] = None
+    # time of the recency in the scores, kept so the scores of every page agree
+    now: int = 0
+    # position in each shard of a search over several shards keyed by their database, a
+    # shard is done when its position is None, see StorageShards
+    shards: Optional[dict[str, Optional['FileSearchCursor']]] = None
+
+
+class FileSearchPage(BaseModel):
+    """ a page of an indexed search may hold fewer files than the limit when the time of
+    the filter runs out, the next pages go on below its window """
+    file_paths: list[str]
+    # None after the last page
+    cursor: Optional[FileSearchCursor] = None
+    # (score, rowid) of each file, the pages of the shards are merged by them
+    ranks: list[tuple[float, int]] = Field(default_factory=list)
+    # the candidate window of the files of an indexed search, see FileSearchCursor
+    window: Optional[int] = None
+    window_start: Optional[int] = None
+
+
+class FileCountEstimate(BaseModel):
+    count: int
+    # the count is a lower bound when the counting stopped at the cap
+    exact: bool
+
+
+class FileSearchQuery(NamedTuple):
+    """ the parts of the queries of a search built from a filter """
+    args: dict
+    # conditions answered by the indexes of fileinfo and filedirectory, they narrow the
+    # files before the terms
+    predicates: list[str]
+    # conditions of the terms and directories which are not matched by the trigram index
+    conditions: list[str]
+    # conditions of every term and directory
+    text_conditions: list[str]
+    # expressions of the terms found in the name
+    name_hits: list[str]
+    # conditions of the names starting with a term, answered by the index of the names
+    name_prefixes: list[str]
+    # the query of the trigram index, empty when it matches nothing of the filter
+    match: str
+
+
+class FileInfoFilter(BaseModel):
+    """ each keyword is split into terms by white spaces, a file matches when every term
+    is a substring of its name, directory, or the pinyin or initials of a Chinese name,
+    and every predicate holds. `parse` builds a filter from the query syntax """
+    keywords: list[str] = Field(default_factory=list)
+    # lowercased extensions without the dot, a file has any of them
+    extensions: list[str] = Field(default_factory=list)
+    # a file is under any of the directories, a directory which is not absolute matches
+    # any directory whose path contains it
+    directories: list[str] = Field(default_factory=list)
+    # unix times, the lower bounds are inclusive and the upper bounds exclusive
+    modified_after: Optional[int] = None
+    modified_before: Optional[int] = None
+    created_after: Optional[int] = None
+    created_before: Optional[int] = None
+    # bytes, inclusive
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    limit: int = Field(default=1000, ge=1)
+    # the page after this position, the first page by default
+    cursor: Optional[FileSearchCursor] = None
+    # number of the latest indexed matches which are ranked in a window
+    candidates: int = Field(default=300, ge=1)
+    # seconds spent collecting the candidates of a window, the window holds the matches
+    # found so far when they run out
+    search_seconds: float = Field(default=0.004, ge=0)
+    # number of recent files scanned for the terms shorter than a trigram, the windows grow
+    # up to 16 times as large before the whole table is scanned
+    scan_window: int = Field(default=5000, ge=1)
+    # weight of a term found in the file name rather than only in the directory
+    name_weight: float = 10.0
+    recency_weight: float = 1.0
 
     @classmethod
-    def getInstance(cls) -> 'FileSystemStorage':
-        thread_id = current_thread().ident
-        if thread_id is None:
-            raise RuntimeError("the thread is not started yet")
+    def parse(cls, text: str, now: Optional[float] = None, **options) -> 'FileInfoFilter':
+        """ e.g. `report ext:pdf after:2026-10-01 in:projects size:>1mb`, see
+        `parseFileQuery`. The options are the other fields like the limit """
+        from flicker.services.memory.fs.query import parseFileQuery
+        return cls(**parseFileQuery(text, now), **options)
 
-        if thread_id in cls._instances:
-            return cls._instances[thread_id]
+    def getTerms(self) -> list[str]:
+        terms: list[str] = []
+        for keyword in self.keywords:
+            terms.extend(term.lower() for term in keyword.split() if term.lower() not in terms)
 
-        from flicker.utils.settings import Settings
-        db_path = Settings.getSettingsDirectory() / "fsmemory.db"
-        instance = FileSystemStorage(db_path)
-        if instance.db_list_tables() == []:
-            instance.db_initialize()
+        return terms
 
-        cls._instances[thread_id] = instance
-        return instance
+    def hasPredicates(self) -> bool:
+        """ whether the filter has more than the terms """
+        return len(self.extensions) > 0 or len(self.directories) > 0 or any(
+            bound is not None for bound in (
+                self.modified_after, self.modified_before, self.created_after, self.created_before,
+                self.min_size, self.max_size
+            )
+        )
 
-    def __init__(self, db_path: Path) -> None:
+    def isEmpty(self) -> bool:
+        return len(self.getTerms()) == 0 and not self.hasPredicates()
+
+    def getCacheKey(self) -> str:
+        """ filters with the same terms in any order and case find the same files """
+        key = self.model_dump(exclude={'keywords'})
+        key['terms'] = sorted(self.getTerms())
+        return json.dumps(key, sort_keys=True)
+
+
+class FileContentChunk(BaseModel, AbstractDataChunk):
+    """ a piece of the text extracted from a file """
+    file_path: str
+    chunk_index: int
+    content: str
+
+    def getChunkId(self) -> str:
+        return f'{self.file_path}#{self.chunk_index}'
+
+    def getContent(self) -> str:
+        return self.content
+
+
+class FileDuplicateGroup(BaseModel):
+    """ files with identical content """
+    fingerprint: str
+    file_size: int
+    file_paths: list[str]
+
+
+class StorageStats(BaseModel):
+    """ cumulative counters of a storage connection """
+    stat_files: int = 0
+    stat_seconds: float = 0.0
+    inserted_rows: int = 0
+    updated_rows: int = 0
+    unchanged_rows: int = 0
+    insert_batches: int = 0
+    insert_seconds: float = 0.0
+
+    @property
+    def insert_rate(self) -> float:
+        rows = self.inserted_rows + self.updated_rows + self.unchanged_rows
+        return rows / self.insert_seconds if self.insert_seconds > 0 else 0.0
+
+
+class FileUpsertCounts(NamedTuple):
+    """ rows of a batch which were new, changed in size or modified time, or unchanged """
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+
+class FileContentState(NamedTuple):
+    file_path: str
+    file_size: int
+    modified_time: int
+    # the stored content is extracted from the same version of the file
+    unchanged: bool
+
+
+class FileSystemStorage:
+    """ the queries of the file system memory over a single connection. A storage is used
+    by one thread at a time, threads share the connections through `StorageService` """
+
+    def __init__(self, db_path: Path, read_only: bool = False) -> None:
         self.db_path = db_path
-        self.__connection = sqlite3.connect(self.db_path)
+        self.read_only = read_only
+        if read_only:
+            # the connection is handed over between the threads of the reader pool
+            self.__connection = sqlite3.connect(
+                db_path.resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            self.__connection = sqlite3.connect(self.db_path, check_same_thread=False)
+
+        self.__connection.executescript(READER_PRAGMAS if read_only else WRITER_PRAGMAS)
+        # the lowercased terms which are not ascii are matched against the text lowercased
+        # by Python, see getLowerFunction
+        self.__connection.create_function('unicode_lower', 1, str.lower, deterministic=True)
+        self.stats = StorageStats()
+        # names before this row have their pinyin forms filled, see fillNameForms
+        self.name_forms_rowid = 0
+        # whether rows stored before the paths were normalized are left to be moved, only
+        # kept up to date by the writer, see migrateFilePaths
+        self.legacy_files = self.hasLegacyFiles()
+        # the file name index kept up to date by the writes, see StorageService
+        self.name_index: Optional['FileNameIndex'] = None
+        # bumped once the files changed by a commit are visible to the searches, unlike
+        # the scan generation it only lives as long as the connection
+        self.write_generation = 0
+
+    def close(self) -> None:
+        self.__connection.close()
 
     def getFileInfo(self, path: Path) -> dict:
-        stat = path.stat()
-        return {
-            "file_path": str(path),
-            "file_path_lower": str(path).lower(),
-            "file_name": path.name,
-            "file_name_lower": path.name.lower(),
-            "created_time": int(stat.st_birthtime),
-            "modified_time": int(stat.st_mtime),
-            "accessed_time": int(stat.st_atime)
-        }
+        return getFileInfo(str(path), path.name, path.stat())
 
-    def addFiles(self, paths: list[Path]) -> None:
+    def getScanGeneration(self) -> int:
+        return self.__connection.execute(SELECT_SCAN_GENERATION).fetchone()[0]
+
+    def beginScanGeneration(self) -> int:
+        """ allocate a new generation, rows written by a scan are stamped with it so rows
+        not touched by the scan can be swept afterwards """
+        try:
+            self.__connection.execute(UPDATE_SCAN_GENERATION)
+            generation = self.getScanGeneration()
+            self.__connection.commit()
+            return generation
+        except Exception:
+            self.__connection.rollback()
+            raise
+
+    def addFiles(self, paths: list[Path], generation: Optional[int] = None) -> Optional[FileUpsertCounts]:
         logger.info(f'generating stat for {len(paths)} files')
-        infos = [self.getFileInfo(path) for path in paths]
+        started = monotonic()
+        infos = []
+        for path in paths:
+            try:
+                infos.append(self.getFileInfo(path))
+            except OSError as ex:
+                # the file could be removed or become inaccessible after being listed
+                logger.warning(f'failed to stat {path}: {ex}')
+
+        self.stats.stat_files += len(paths)
+        self.stats.stat_seconds += monotonic() - started
+        return self.addFileInfos(infos, generation)
+
+    def addFileInfos(self, infos: list[dict], generation: Optional[int] = None) -> Optional[FileUpsertCounts]:
+        """ insert rows built by `getFileInfo`, the scanner collects them from the stat
+        results of the directory listing so no file is stat twice. Only the new files and
+        the files whose size or modified time changed are written, the unchanged rows keep
+        their scan generation. Returns None when the batch failed """
+        if generation is None:
+            generation = self.getScanGeneration()
 
         try:
             logger.info('start batch inserting')
+            started = monotonic()
             self.__connection.execute("BEGIN TRANSACTION")
-            cursor = self.__connection.cursor()
-            cursor.executemany(INSERT_FILE_INFO, infos)
-            self.__connection.commit()
-            logger.info(f'finish batch insert {len(paths)} file info rows')
+            moved = 0
+            if self.legacy_files:
+                moved = self.moveLegacyFiles(
+                    "file_path IN (SELECT value FROM json_each(:paths))",
+                    {"paths": json.dumps([info["file_path"] for info in infos])}
+                )
+
+            directories = [getFileDirectory(info["file_path"], info["file_name"]) for info in infos]
+            directory_ids = self.getDirectoryIds(directories)
+            keys = [
+                [directory_ids[directory], info["file_name"]]
+                for directory, info in zip(directories, infos) if directory in directory_ids
+            ]
+            states = {
+                (row[0], row[1]): (row[2], row[3])
+                for row in self.__connection.execute(SELECT_FILE_STATE, (json.dumps(keys),))
+            }
+            changed = []
+            inserted = 0
+            for directory, info in zip(directories, infos):
+                directory_id = directory_ids.get(directory)
+                state = None if directory_id is None else states.get((directory_id, info["file_name"]))
+                if state is None:
+                    inserted += 1
+                elif state == (info["file_size"], info["modified_time"]):
+                    continue
+
+                info["scan_generation"] = generation
+                changed.append((directory, info))
+
+            counts = FileUpsertCounts(inserted, len(changed) - inserted, len(infos) - len(changed))
+            entries = []
+            if len(changed) > 0:
+                # the directories of the new files are created along with their parents
+                directory_ids.update(self.getDirectoryIds(
+                    {directory for directory, _ in changed if directory not in directory_ids}, create=True
+                ))
+                for directory, info in changed:
+                    info["directory_id"] = directory_ids[directory]
+
+                self.__connection.executemany(INSERT_FILE_INFO, [info for _, info in changed])
+                if self.name_index is not None:
+                    entries = self.getNameIndexEntries([info for _, info in changed])
+
+            if len(changed) == 0 and moved == 0:
+                self.__connection.rollback()
+            else:
+                self.__connection.commit()
+                if self.name_index is not None:
+                    self.name_index.addEntries(entries)
+                self.write_generation += 1
+            cost = monotonic() - started
+            self.stats.inserted_rows += counts.inserted
+            self.stats.updated_rows += counts.updated
+            self.stats.unchanged_rows += counts.unchanged
+            self.stats.insert_batches += 1
+            self.stats.insert_seconds += cost
+            logger.info(
+                f'finish batch insert {len(infos)} file info rows, {counts.inserted} inserted, '
+                f'{counts.updated} updated, {len(infos) / max(cost, 1e-6):.0f} rows/sec'
+            )
+            return counts
         except Exception as ex:
             logger.error(f'failed to batch insert: {ex}')
             self.__connection.rollback()
+            return None
+
+    def getDirectoryIds(self, directories: Iterable[str], create: bool = False) -> dict[str, int]:
+        """ ids of the stored directories by their path ending with a separator. The
+        missing ones are created with their missing parents when `create`, in the
+        transaction of the caller """
+        paths = set(directories)
+        ids = dict(self.__connection.execute(SELECT_DIRECTORY_ID, (json.dumps(list(paths)),)).fetchall())
+        if not create or len(ids) == len(paths):
+            return ids
+
+        missing = paths - ids.keys()
+        parents = set()
+        for directory in missing:
+            parent = getParentDirectory(directory)
+            while parent is not None and parent not in ids and parent not in missing and parent not in parents:
+                parents.add(parent)
+                parent = getParentDirectory(parent)
+
+        if len(parents) > 0:
+            ids.update(self.__connection.execute(SELECT_DIRECTORY_ID, (json.dumps(list(parents)),)).fetchall())
+
+        # a parent is shorter than its directories, so it is created before them
+        for directory in sorted(missing | (parents - ids.keys()), key=len):
+            parent = getParentDirectory(directory)
+            ids[directory] = self.__connection.execute(
+                INSERT_DIRECTORY, (None if parent is None else ids[parent], directory)
+            ).lastrowid
+
+        return ids
+
+    def removeEmptyDirectories(self, directory_ids: set[int]) -> None:
+        """ remove the directories left without a file or a directory, then their parents
+        left empty in turn, in the transaction of the caller """
+        while len(directory_ids) > 0:
+            parents = set()
+            for directory_id in directory_ids:
+                for parent_id, in self.__connection.execute(DELETE_EMPTY_DIRECTORY, (directory_id,)).fetchall():
+                    if parent_id is not None:
+                        parents.add(parent_id)
+
+            directory_ids = parents
+
+    def removeFiles(self, paths: list[str]) -> bool:
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            if self.legacy_files:
+                self.moveLegacyFiles("file_path IN (SELECT value FROM json_each(:paths))", {"paths": json.dumps(paths)})
+
+            rows = []
+            directory_ids = set()
+            for path in paths:
+                for rowid, directory_id in self.__connection.execute(DELETE_FILE_INFO, splitFilePath(path)).fetchall():
+                    rows.append((rowid, path))
+                    directory_ids.add(directory_id)
+
+            self.removeEmptyDirectories(directory_ids)
+            self.__connection.commit()
+            if self.name_index is not None:
+                self.name_index.removeFiles(rows)
+            self.write_generation += 1
+            return True
+        except Exception as ex:
+            logger.error(f'failed to remove files: {ex}')
+            self.__connection.rollback()
+            return False
+
+    def removeDirectory(self, directory: str) -> bool:
+        """ remove all files under the directory recursively """
+        try:
+            lower, upper = getPrefixRange(directory)
+            self.__connection.execute("BEGIN TRANSACTION")
+            if self.legacy_files:
+                self.moveLegacyFiles("file_path >= :lower AND file_path < :upper", {"lower": lower, "upper": upper})
+
+            parent = self.__connection.execute(SELECT_DIRECTORY_PARENT, (lower,)).fetchone()
+            # the triggers of the files look up their directory, it is removed after them
+            self.__connection.execute(DELETE_DIRECTORY_FILE_INFO, (lower, upper))
+            self.__connection.execute(DELETE_DIRECTORY, (lower, upper))
+            if parent is not None and parent[0] is not None:
+                self.removeEmptyDirectories({parent[0]})
+            self.__connection.commit()
+            if self.name_index is not None:
+                self.name_index.removePrefix(lower)
+            self.write_generation += 1
+            return True
+        except Exception as ex:
+            logger.error(f'failed to remove directory {directory}: {ex}')
+            self.__connection.rollback()
+            return False
+
+    def getUnseenFiles(self, directory: str, seen: Container[str], recursive: bool = True) -> list[int]:
+        """ rowids of the files under the directory whose path is not in `seen`, only the
+        files directly inside the directory when not recursive. The rows stored before the
+        paths were normalized are included, `sweepFiles` moves them before removing them """
+        lower, upper = getPrefixRange(directory)
+        args = {"lower": lower, "upper": upper, "name_offset": len(lower) + 1, "separator": os.sep}
+        queries = [SELECT_DIRECTORY_FILE if recursive else SELECT_DIRECTORY_DIRECT_FILE]
+        # a single read transaction, the writer may finish the migration meanwhile
+        self.__connection.execute("BEGIN TRANSACTION")
+        try:
+            if self.hasLegacyFiles():
+                queries.append(SELECT_LEGACY_DIRECTORY_FILE if recursive else SELECT_LEGACY_DIRECTORY_DIRECT_FILE)
+
+            return [
+                rowid for query in queries
+                for rowid, path in self.__connection.execute(query, args) if path not in seen
+            ]
+        finally:
+            self.__connection.rollback()
+
+    def sweepFiles(self, rowids: list[int], generation: int) -> int:
+        """ remove the files found by `getUnseenFiles` in a short transaction, unless they
+        were written by the given scan generation or a later one since """
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            moved = 0
+            if self.legacy_files:
+                moved = self.moveLegacyFiles(
+                    "rowid IN (SELECT value FROM json_each(:rowids))", {"rowids": json.dumps(rowids)}
+                )
+
+            rows = self.__connection.execute(
+                DELETE_UNSEEN_FILE_INFO, {"rowids": json.dumps(rowids), "scan_generation": generation}
+            ).fetchall()
+            self.removeEmptyDirectories({row[2] for row in rows})
+            self.__connection.commit()
+            if len(rows) > 0 and self.name_index is not None:
+                self.name_index.removeFiles([(rowid, path) for rowid, path, _ in rows])
+            if len(rows) > 0 or moved > 0:
+                self.write_generation += 1
+            return len(rows)
+        except Exception as ex:
+            logger.error(f'failed to sweep files: {ex}')
+            self.__connection.rollback()
+            return 0
+
+    def hasLegacyFiles(self) -> bool:
+        return self.__connection.execute(SELECT_LEGACY_FILE_TABLE).fetchone()[0] > 0
+
+    def moveLegacyFiles(self, condition: str, args: dict, limit: int = -1) -> int:
+        """ move the rows stored before the paths were normalized which match the condition
+        into fileinfo, in the transaction of the caller. Every write moves the rows it
+        touches first. Returns the number of moved rows """
+        rows = self.__connection.execute(
+            SELECT_LEGACY_FILE_INFO.format(condition=condition), {**args, "limit": limit}
+        ).fetchall()
+        if len(rows) == 0:
+            return 0
+
+        # the rows are inserted in the order of their rowids, which keeps the pages full
+        rows.reverse()
+        directories = [getFileDirectory(row[1], row[2]) for row in rows]
+        directory_ids = self.getDirectoryIds(directories, create=True)
+        self.__connection.executemany(MOVE_FILE_INFO, [
+            (row[0], directory_ids[directory], *row[2:]) for directory, row in zip(directories, rows)
+        ])
+        self.__connection.execute(DELETE_LEGACY_FILE_INFO, (json.dumps([row[0] for row in rows]),))
+        return len(rows)
+
+    def migrateFilePaths(self, batch_size: int = 5000) -> bool:
+        """ move a batch of the rows stored before the paths were normalized, the latest
+        rows first so the recent files are searchable first. The legacy table is dropped
+        once it is empty. Returns whether more rows are left """
+        if not self.legacy_files:
+            return False
+
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            moved = self.moveLegacyFiles("1", {}, batch_size)
+            self.__connection.commit()
+            if moved > 0:
+                self.write_generation += 1
+            if moved == batch_size:
+                return True
+
+            self.__connection.executescript("BEGIN;" + FINISH_FILE_PATH_MIGRATION + "COMMIT;")
+        except Exception as ex:
+            logger.error(f'failed to normalize the file paths: {ex}')
+            self.__connection.rollback()
+            return False
+
+        self.legacy_files = False
+        logger.info(f'finish normalizing the file paths @ {self.db_path}')
+        return False
+
+    def importFiles(
+        self, source_path: Path, root_directory: str, skipped_directories: Iterable[str] = (), batch_size: int = 5000
+    ) -> int:
+        """ copy the files under the root from another database at the latest schema, with
+        their contents and fingerprints, except the files under the skipped directories.
+        The copied rows are written before any scan so the next scan sweeps them when their
+        file is gone. Returns the number of copied files """
+        lower, upper = getPrefixRange(root_directory)
+        args = {
+            "lower": lower, "upper": upper,
+            "skipped": json.dumps([getPrefixRange(directory) for directory in skipped_directories])
+        }
+        self.__connection.execute("ATTACH DATABASE ? AS source", (str(source_path),))
+        try:
+            directory_ids = [row[0] for row in self.__connection.execute(SELECT_IMPORT_DIRECTORY, args)]
+            batches = [directory_ids[i:i + 100] for i in range(0, len(directory_ids), 100)]
+            copied = 0
+            infos: list[dict] = []
+            for i, batch in enumerate(batches):
+                cursor = self.__connection.execute(SELECT_IMPORT_FILE_INFO, (json.dumps(batch),))
+                columns = [column[0] for column in cursor.description]
+                infos.extend(dict(zip(columns, row)) for row in cursor)
+                if len(infos) >= batch_size or i == len(batches) - 1:
+                    if len(infos) > 0 and self.addFileInfos(infos, 0) is None:
+                        raise RuntimeError(f'failed to copy the files under {root_directory}')
+                    copied += len(infos)
+                    infos = []
+
+            self.__connection.execute("BEGIN TRANSACTION")
+            try:
+                for query in (IMPORT_FILE_CONTENT, IMPORT_FILE_CHUNK, IMPORT_FILE_FINGERPRINT):
+                    self.__connection.execute(query, args)
+                self.__connection.commit()
+            except Exception:
+                self.__connection.rollback()
+                raise
+
+            return copied
+        finally:
+            self.__connection.execute("DETACH DATABASE source")
+
+    def getContentStates(self, root_directory: str) -> list[FileContentState]:
+        """ returns the files under the root with whether their content is up to date """
+        cursor = self.__connection.execute(SELECT_CONTENT_STATE, getPrefixRange(root_directory))
+        return [FileContentState(row[0], row[1], row[2], bool(row[3])) for row in cursor]
+
+    def saveContents(self, contents: list[tuple[FileContentState, str, list[str]]]) -> bool:
+        """ replace the chunks of the files, each item is (state of the file when the
+        extraction started, extraction status, chunks) """
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            for state, status, chunks in contents:
+                self.__connection.execute(DELETE_FILE_CHUNK, (state.file_path,))
+                self.__connection.executemany(
+                    INSERT_FILE_CHUNK, [(state.file_path, i, chunk) for i, chunk in enumerate(chunks)]
+                )
+                self.__connection.execute(INSERT_FILE_CONTENT, {
+                    "file_path": state.file_path,
+                    "file_size": state.file_size,
+                    "modified_time": state.modified_time,
+                    "status": status,
+                    "chunk_count": len(chunks)
+                })
+
+            self.__connection.commit()
+            return True
+        except Exception as ex:
+            logger.error(f'failed to save file contents: {ex}')
+            self.__connection.rollback()
+            return False
+
+    def getChunks(self, file_path: str) -> list[FileContentChunk]:
+        cursor = self.__connection.execute(SELECT_FILE_CHUNK, (file_path,))
+        return [FileContentChunk(file_path=file_path, chunk_index=row[0], content=row[1]) for row in cursor]
+
+    def getFingerprintStates(self, root_directory: str) -> list[FileContentState]:
+        """ returns the files under the root with whether their fingerprint is up to date """
+        cursor = self.__connection.execute(SELECT_FINGERPRINT_STATE, getPrefixRange(root_directory))
+        return [FileContentState(row[0], row[1], row[2], bool(row[3])) for row in cursor]
+
+    def saveFingerprints(self, fingerprints: list[tuple[FileContentState, str, Optional[str]]]) -> bool:
+        """ each item is (state of the file when hashing started, sample hash, full hash) """
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            self.__connection.executemany(INSERT_FILE_FINGERPRINT, [
+                {
+                    "file_path": state.file_path,
+                    "file_size": state.file_size,
+                    "modified_time": state.modified_time,
+                    "sample_hash": sample_hash,
+                    "full_hash": full_hash
+                }
+                for state, sample_hash, full_hash in fingerprints
+            ])
+            self.__connection.commit()
+            return True
+        except Exception as ex:
+            logger.error(f'failed to save fingerprints: {ex}')
+            self.__connection.rollback()
+            return False
+
+    def getSampleHashCounts(self, after: str, limit: int) -> list[tuple[str, int, int]]:
+        """ (sample hash, files, files without a full hash) of the sample hashes after the
+        given one, in order """
+        return self.__connection.execute(SELECT_SAMPLE_HASH_COUNT, (after, limit)).fetchall()
+
+    def getUnhashedFingerprints(self, sample_hashes: list[str]) -> list[FileContentState]:
+        """ the files of the sample hashes whose full hash is not computed yet """
+        cursor = self.__connection.execute(SELECT_UNHASHED_FINGERPRINT, (json.dumps(sample_hashes),))
+        return [FileContentState(row[0], row[1], row[2], False) for row in cursor]
+
+    def saveFullHashes(self, hashes: list[tuple[str, str]]) -> bool:
+        """ each item is (file path, full hash) """
+        try:
+            self.__connection.execute("BEGIN TRANSACTION")
+            self.__connection.executemany(UPDATE_FULL_HASH, [(full_hash, path) for path, full_hash in hashes])
+            self.__connection.commit()
+            return True
+        except Exception as ex:
+            logger.error(f'failed to save full hashes: {ex}')
+            self.__connection.rollback()
+            return False
+
+    def getDuplicateGroups(self) -> list[FileDuplicateGroup]:
+        """ groups of files with identical content, the largest files first """
+        groups: list[FileDuplicateGroup] = []
+        for full_hash, file_size, file_path in self.__connection.execute(SELECT_DUPLICATE_FINGERPRINT):
+            if len(groups) == 0 or groups[-1].fingerprint != full_hash:
+                groups.append(FileDuplicateGroup(fingerprint=full_hash, file_size=file_size, file_paths=[]))
+
+            groups[-1].file_paths.append(file_path)
+
+        return groups
+
+    def getFullHashCounts(self, after: str, limit: int) -> list[tuple[str, int, int]]:
+        """ (full hash, files, file size) of the full hashes after the given one, in order """
+        return self.__connection.execute(SELECT_FULL_HASH_COUNT, (after, limit)).fetchall()
+
+    def getFullHashFiles(self, full_hashes: list[str]) -> list[tuple[str, str]]:
+        """ (full hash, file path) of the files with the full hashes """
+        return self.__connection.execute(SELECT_FULL_HASH_FILE, (json.dumps(full_hashes),)).fetchall()
+
+    def getFingerprints(self, root_directory: str) -> dict[str, str]:
+        """ returns the full hash of the files under the root, only the files which may
+        have a duplicate have one """
+        cursor = self.__connection.execute(SELECT_FULL_HASH, getPrefixRange(root_directory))
+        return {row[0]: row[1] for row in cursor}
+
+    def findProcessedDuplicate(self, file_path: str, fingerprint: str) -> Optional[str]:
+        """ returns another file with the same content whose chunks are extracted already """
+        row = self.__connection.execute(SELECT_PROCESSED_DUPLICATE, (fingerprint, file_path)).fetchone()
+        return None if row is None else row[0]
 
     def findFiles(self, filter: FileInfoFilter) -> list[str]:
-        args: list = []
-        query = "SELECT file_path FROM fileinfo WHERE "
-        query += " OR ".join(["INSTR(file_name, ?)"] * len(filter.keywords))
-        args.extend(filter.keywords)
-        query += " ORDER BY modified_time DESC"
-        query += ";"
-        cursor = self.__connection.cursor()
+        return self.searchFiles(filter).file_paths
 
-        rows = cursor.execute(query, args).fetchall()
-        return [row[0] for row in rows]
+    def getSearchQuery(self, filter: FileInfoFilter) -> FileSearchQuery:
+        terms = filter.getTerms()
+        args: dict = {"limit": filter.limit + 1}
+        predicates = []
+        conditions = []
+        text_conditions = []
+        name_hits = []
+        name_prefixes = []
+        match = []
+        for i, term in enumerate(terms):
+            args[f"term{i}"] = term
+            # the name is the term followed by a separator, an extension or nothing
+            name_prefixes.append(f"(f.file_name COLLATE NOCASE >= :term{i} AND f.file_name COLLATE NOCASE < :term{i} || '/')")
+            lower = getLowerFunction(term)
+            condition = (
+                f"(INSTR({lower}(d.directory_path || f.file_name), :term{i}) > 0"
+                f" OR INSTR(f.file_name_pinyin, :term{i}) > 0 OR INSTR(f.file_name_initials, :term{i}) > 0)"
+            )
+            text_conditions.append(condition)
+            if len(term) < 3:
+                conditions.append(condition)
+            else:
+                # each term is quoted as a string so no character is parsed as fts5 syntax
+                match.append('"' + term.replace('"', '""') + '"')
 
-    def db_initialize(self) -> None:
-        logger.info(f'initialize database @ {self.db_path}')
-        cursor = self.__connection.cursor()
-        cursor.execute(CREATE_FILE_INFO)
+            name_hits.append(
+                f"(INSTR({lower}(f.file_name), :term{i}) > 0 OR INSTR(f.file_name_pinyin, :term{i}) > 0"
+                f" OR INSTR(f.file_name_initials, :term{i}) > 0)"
+            )
+
+        if len(filter.directories) > 0:
+            relative = [directory.lower() for directory in filter.directories if not os.path.isabs(directory)]
+            # the absolute directories are ranges of the case insensitive index of the
+            # directory paths, the others are matched in the directory of each file
+            directories = []
+            for i, directory in enumerate(filter.directories):
+                if os.path.isabs(directory):
+                    args[f"directory_lower{i}"], args[f"directory_upper{i}"] = getPrefixRange(directory)
+                    directories.append(
+                        f"(d.directory_path COLLATE NOCASE >= :directory_lower{i}"
+                        f" AND d.directory_path COLLATE NOCASE < :directory_upper{i})"
+                    )
+                else:
+                    args[f"directory{i}"] = directory.lower()
+                    directories.append(f"INSTR({getLowerFunction(directory)}(d.directory_path), :directory{i}) > 0")
+
+            condition = " OR ".join(directories)
+            if len(relative) == 0:
+                # the directories are looked up in filedirectory, which has far fewer rows
+                # than fileinfo, and their files are found by the unique index
+                predicates.append(
+                    "f.directory_id IN (SELECT directory_id FROM filedirectory d WHERE " + condition + ")"
+                )
+            else:
+                text_conditions.append("(" + condition + ")")
+                if len(relative) == len(filter.directories) and all(len(directory) >= 3 for directory in relative):
+                    match.append(
+                        "directory : (" + " OR ".join('"' + d.replace('"', '""') + '"' for d in relative) + ")"
+                    )
+                else:
+                    conditions.append("(" + condition + ")")
+
+        if len(filter.extensions) > 0:
+            for i, extension in enumerate(filter.extensions):
+                args[f"extension{i}"] = extension.lstrip('.').lower()
+
+            names = ", ".join(f":extension{i}" for i in range(len(filter.extensions)))
+            predicates.append(f"f.file_extension IN ({names})")
+
+        bounds = [
+            ("modified_time", ">=", "modified_after", filter.modified_after),
+            ("modified_time", "<", "modified_before", filter.modified_before),
+            ("created_time", ">=", "created_after", filter.created_after),
+            ("created_time", "<", "created_before", filter.created_before),
+            ("file_size", ">=", "min_size", filter.min_size),
+            ("file_size", "<=", "max_size", filter.max_size),
+        ]
+        for column, operator, name, bound in bounds:
+            if bound is not None:
+                args[name] = bound
+                predicates.append(f"f.{column} {operator} :{name}")
+
+        return FileSearchQuery(args, predicates, conditions, text_conditions, name_hits, name_prefixes, " AND ".join(match))
+
+    def countFiles(self, predicates: list[str], args: dict, cap: int) -> int:
+        """ files matching the predicates, counted up to `cap` + 1 """
+        query = COUNT_FILE_INFO.format(predicates=" AND ".join(predicates))
+        return self.__connection.execute(query, {**args, "cap": cap + 1}).fetchone()[0]
+
+    def searchFiles(self, filter: FileInfoFilter) -> FileSearchPage:
+        """ returns a page of at most `filter.limit` files, the cursor of the page fetches
+        the next one """
+        if filter.isEmpty():
+            return FileSearchPage(file_paths=[])
+
+        query = self.getSearchQuery(filter)
+        args = query.args
+        cursor = filter.cursor or FileSearchCursor(now=int(time()))
+        if cursor.score is not None:
+            args["score"] = cursor.score
+            args["file_id"] = cursor.file_id
+
+        args["name_weight"] = filter.name_weight
+        args["recency_weight"] = filter.recency_weight
+        args["now"] = cursor.now
+        name_hits = " + ".join(query.name_hits) if len(query.name_hits) > 0 else "0"
+        # the predicates narrow the files before the trigram index when their indexes find
+        # few enough files, otherwise they only filter the matches of the terms
+        if query.match != "" and len(query.predicates) > 0 \
+                and self.countFiles(query.predicates, args, filter.scan_window) <= filter.scan_window:
+            sql = FILTER_FILE_INFO.format(
+                conditions=" AND ".join(query.predicates + query.text_conditions),
+                name_hits=name_hits,
+                keyset=SEARCH_KEYSET if cursor.score is not None else ""
+            )
+            rows = self.__connection.execute(sql, args).fetchall()
+            next_cursor = None
+            if len(rows) > filter.limit:
+                rows = rows[:filter.limit]
+                next_cursor = FileSearchCursor(score=rows[-1][1], file_id=rows[-1][2], now=cursor.now)
+
+            return FileSearchPage(
+                file_paths=[row[0] for row in rows], cursor=next_cursor, ranks=[(row[1], row[2]) for row in rows]
+            )
+
+        if query.match == "":
+            keyset = [SCAN_RECENT_KEYSET] if cursor.score is not None else []
+            sql = SCAN_RECENT_FILE_INFO.format(
+                predicates=" AND ".join(query.predicates + keyset) or "1",
+                conditions=" AND ".join(query.text_conditions) or "1"
+            )
+            window = min(SCAN_FIRST_WINDOW_PAGES * args["limit"], filter.scan_window)
+            rows = []
+            while window <= 16 * filter.scan_window:
+                args["window"] = window
+                rows = self.__connection.execute(sql, args).fetchall()
+                if len(rows) >= args["limit"]:
+                    break
+
+                # the density of the matches in the window tells how far the page reaches
+                window = max(2 * args["limit"] * window // len(rows), 2 * window) if len(rows) > 0 else 8 * window
+
+            if len(rows) < args["limit"]:
+                sql = SCAN_FILE_INFO.format(
+                    conditions=" AND ".join(query.predicates + query.text_conditions),
+                    keyset=SCAN_KEYSET if cursor.score is not None else ""
+                )
+                rows = self.__connection.execute(sql, args).fetchall()
+
+            next_cursor = None
+            if len(rows) > filter.limit:
+                rows = rows[:filter.limit]
+                next_cursor = FileSearchCursor(score=rows[-1][1], file_id=rows[-1][2])
+
+            return FileSearchPage(
+                file_paths=[row[0] for row in rows], cursor=next_cursor, ranks=[(row[1], row[2]) for row in rows]
+            )
+
+        args["match"] = query.match
+        args["candidates"] = max(filter.candidates, filter.limit)
+        prefixes = " OR ".join(query.name_prefixes)
+        conditions = query.predicates + query.conditions
+        named = ""
+        if prefixes != "" and cursor.window is None:
+            named = SEARCH_NAMED_FILE_INFO.format(
+                prefixes=prefixes, conditions=" AND ".join(query.predicates + query.text_conditions)
+            )
+        elif prefixes != "":
+            # the named files are candidates of the first window only
+            conditions = conditions + [f"NOT ({prefixes})"]
+
+        files = ""
+        if len(conditions) > 0:
+            files = "JOIN fileinfo f ON f.rowid = s.rowid"
+            if len(query.conditions) > 0:
+                files += " JOIN filedirectory d ON d.directory_id = f.directory_id"
+
+        sql = SELECT_SEARCH_CANDIDATE.format(
+            files=files, conditions="".join(" AND " + condition for condition in conditions)
+        )
+        candidate_ids, window_start = self.getSearchCandidates(sql, args, cursor, filter.search_seconds)
+        args["candidate_ids"] = json.dumps(candidate_ids)
+        sql = SEARCH_FILE_INFO.format(
+            named=named, name_hits=name_hits, keyset=SEARCH_KEYSET if cursor.score is not None else ""
+        )
+        rows = self.__connection.execute(sql, args).fetchall()
+        next_cursor = None
+        if len(rows) > filter.limit:
+            rows = rows[:filter.limit]
+            next_cursor = FileSearchCursor(
+                score=rows[-1][1], file_id=rows[-1][2], window=cursor.window, window_start=window_start, now=cursor.now
+            )
+        elif window_start > 1:
+            # older matches are left below the window
+            next_cursor = FileSearchCursor(window=window_start, now=cursor.now)
+
+        return FileSearchPage(
+            file_paths=[row[0] for row in rows], cursor=next_cursor, ranks=[(row[1], row[2]) for row in rows],
+            window=cursor.window, window_start=window_start
+        )
+
+    def getSearchCandidates(self, sql: str, args: dict, cursor: FileSearchCursor, seconds: float) -> tuple[list[int], int]:
+        """ the rowids of the candidates of the window of the cursor, the latest first, and
+        the start of the window """
+        window = cursor.window
+        if window is None:
+            window = self.__connection.execute(SELECT_MAX_FILE_ID).fetchone()[0] + 1
+
+        if cursor.window_start is not None:
+            rows = self.__connection.execute(sql, {**args, "window_start": cursor.window_start, "window": window})
+            return [row[0] for row in rows], cursor.window_start
+
+        deadline = monotonic() + seconds
+        candidate_ids: list[int] = []
+        size = SEARCH_RANGE_ROWS
+        while window > 1 and len(candidate_ids) < args["candidates"]:
+            start = max(window - size, 1)
+            rows = self.__connection.execute(sql, {
+                **args, "window_start": start, "window": window, "candidates": args["candidates"] - len(candidate_ids)
+            })
+            candidate_ids.extend(row[0] for row in rows)
+            window = start
+            size *= 2
+            if monotonic() >= deadline:
+                break
+
+        if len(candidate_ids) >= args["candidates"]:
+            # the window ends at its last candidate, the older matches of the range are left
+            window = candidate_ids[-1]
+
+        return candidate_ids, window
+
+    def estimateFileCount(self, filter: FileInfoFilter, cap: int = 10000) -> FileCountEstimate:
+        """ number of files matching the filter, counted up to `cap` """
+        if filter.isEmpty():
+            return FileCountEstimate(count=0, exact=True)
+
+        if filter.extensions and filter.model_copy(update={'extensions': []}).isEmpty():
+            # only the extensions, the facets count them exactly
+            extensions = list({extension.lstrip('.').lower() for extension in filter.extensions})
+            count = self.__connection.execute(
+                SUM_EXTENSION_COUNT.format(extensions=", ".join("?" for _ in extensions)), extensions
+            ).fetchone()[0]
+            return FileCountEstimate(count=count, exact=True)
+
+        query = self.getSearchQuery(filter)
+        args = {**query.args, "cap": cap + 1}
+        if query.match != "":
+            args["match"] = query.match
+            sql = COUNT_SEARCH_FILE_INFO.format(
+                conditions="".join(" AND " + condition for condition in query.predicates + query.conditions)
+            )
+        elif len(query.text_conditions) == 0:
+            sql = COUNT_FILE_INFO.format(predicates=" AND ".join(query.predicates))
+        else:
+            sql = COUNT_SCAN_FILE_INFO.format(conditions=" AND ".join(query.predicates + query.text_conditions))
+
+        count = self.__connection.execute(sql, args).fetchone()[0]
+        return FileCountEstimate(count=min(count, cap), exact=count <= cap)
+
+    def getExtensionCounts(self, limit: int = 100) -> list[tuple[str, int]]:
+        """ the most common extensions and their number of files, kept up to date by the
+        triggers of fileinfo. Names without an extension are counted under '' """
+        return self.__connection.execute(SELECT_EXTENSION_COUNT, (limit,)).fetchall()
+
+    def fillNameForms(self, batch_size: int = 5000) -> bool:
+        """ compute the pinyin forms of a batch of the names stored before they were indexed
+        or while pypinyin was not installed. Returns whether more names are left. The names
+        are filled once the paths are normalized, the rows moved later would be skipped """
+        if self.legacy_files or not isPinyinSupported() \
+                or self.__connection.execute(SELECT_NAME_FORMS_STATE).fetchone()[0] == 1:
+            return False
+
+        from flicker.services.memory.fs.nameindex import createEntry
+        rows = self.__connection.execute(
+            SELECT_UNCONVERTED_FILE_NAME, (self.name_forms_rowid, batch_size)
+        ).fetchall()
+        try:
+            updates = []
+            entries = []
+            for rowid, file_name, file_path, modified_time in rows:
+                forms = getNameForms(file_name)
+                if forms.pinyin != '':
+                    updates.append((forms.pinyin, forms.initials, rowid))
+                    if self.name_index is not None:
+                        entries.append(createEntry(
+                            rowid, file_path, file_name.lower(), forms.pinyin, forms.initials, modified_time
+                        ))
+
+            self.__connection.execute("BEGIN TRANSACTION")
+            self.__connection.executemany(UPDATE_FILE_NAME_FORMS, updates)
+            if len(rows) < batch_size:
+                self.__connection.execute(UPDATE_NAME_FORMS_STATE, (1,))
+            self.__connection.commit()
+            if self.name_index is not None and len(entries) > 0:
+                self.name_index.addEntries(entries)
+            if len(updates) > 0:
+                self.write_generation += 1
+        except Exception as ex:
+            logger.error(f'failed to fill the pinyin forms of file names: {ex}')
+            self.__connection.rollback()
+            return False
+
+        if len(rows) > 0:
+            self.name_forms_rowid = rows[-1][0]
+
+        return len(rows) == batch_size
+
+    def getNameIndexEntries(self, infos: list[dict]) -> list['FileNameEntry']:
+        """ entries of the file name index for the rows just written, which are still in
+        the page cache so finding their rowids costs little """
+        from flicker.services.memory.fs.nameindex import createEntry
+        entries = []
+        for info in infos:
+            rowid = self.__connection.execute(SELECT_FILE_ROWID, (info["directory_id"], info["file_name"])).fetchone()[0]
+            entries.append(createEntry(
+                rowid, info["file_path"], info["file_name"].lower(), info["file_name_pinyin"],
+                info["file_name_initials"], info["modified_time"]
+            ))
+
+        return entries
+
+    def iterNameIndexEntries(self) -> Iterator['FileNameEntry']:
+        """ every file in order of rowid, read in a single transaction. The rows stored
+        before the paths were normalized are merged in until they are moved """
+        from flicker.services.memory.fs.nameindex import createEntry
+        self.__connection.execute("BEGIN TRANSACTION")
+        try:
+            rows: Iterable[tuple] = self.__connection.execute(SELECT_NAME_INDEX_ENTRY)
+            if self.hasLegacyFiles():
+                rows = heapq.merge(
+                    rows, self.__connection.execute(SELECT_LEGACY_NAME_INDEX_ENTRY), key=lambda row: row[0]
+                )
+
+            for rowid, path, name, pinyin, initials, modified_time in rows:
+                yield createEntry(rowid, path, name.lower(), pinyin, initials, modified_time)
+        finally:
+            self.__connection.rollback()
+
+    def mergeSearchIndex(self, pages: int = 500) -> None:
+        """ merge the segments of the trigram index written by small batches, each step
+        is a short transaction. A fragmented index makes every lookup read more segments """
+        try:
+            while True:
+                changes = self.__connection.total_changes
+                # a negative page count merges every level holding more than one segment,
+                # a positive one only the levels which reached the automerge threshold
+                self.__connection.execute(MERGE_FILE_SEARCH, (-pages,))
+                self.__connection.commit()
+                # the merge command itself counts as one change when it does no work
+                if self.__connection.total_changes - changes < 2:
+                    break
+        except Exception as ex:
+            logger.error(f'failed to merge search index: {ex}')
+            self.__connection.rollback()
+
+    def setAutoCheckpoint(self, pages: int) -> None:
+        """ 0 disables the checkpoints run by the commits of this connection """
+        self.__connection.execute(f"PRAGMA wal_autocheckpoint = {int(pages)};")
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> tuple[int, int]:
+        """ copy the committed pages of the WAL into the database, a PASSIVE checkpoint
+        never waits for readers or the writer. Returns the number of frames in the WAL and
+        the number of frames checkpointed """
+        assert mode in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+        _, frames, checkpointed = self.__connection.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+        return frames, checkpointed
+
+    def rebuildSearchIndex(self) -> None:
+        """ rebuild the trigram index from fileinfo """
+        self.__connection.execute(REBUILD_FILE_SEARCH)
         self.__connection.commit()
 
+    def db_initialize(self) -> None:
+        version = self.__connection.execute("PRAGMA user_version;").fetchone()[0]
+        if version < len(SCHEMA_MIGRATIONS):
+            logger.info(f'initialize database @ {self.db_path} from schema version {version}')
+            for i in range(version, len(SCHEMA_MIGRATIONS)):
+                self.__connection.executescript(
+                    "BEGIN;" + SCHEMA_MIGRATIONS[i] + f"PRAGMA user_version = {i + 1}; COMMIT;"
+                )
+
+        # the latest files are moved at once, a new database has no file to move
+        self.legacy_files = self.hasLegacyFiles()
+        self.migrateFilePaths()
+
     def db_list_tables(self) -> list[str]:
         cursor = self.__connection.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = cursor.fetchall()
         return [table[0] for table in tables]
+
+
+class StoragePriority(IntEnum):
+    # queries of the user waiting on the screen, e.g. the hotkey window
+    INTERACTIVE = 0
+    NORMAL = 1
+    # bulk work of the scanner, fingerprinter and extractor
+    BACKGROUND = 2
+
+
+class QueueWaitStats(BaseModel):
+    """ time spent waiting for a connection or the writer thread """
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count > 0 else 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class StorageServiceStats(BaseModel):
+    reader_connections: int = 0
+    idle_readers: int = 0
+    max_readers: int = 0
+    writer_connections: int = 0
+    waiting_reads: int = 0
+    queued_writes: int = 0
+    # keyed by the name of the priority
+    read_waits: dict[str, QueueWaitStats] = Field(default_factory=dict)
+    write_waits: dict[str, QueueWaitStats] = Field(default_factory=dict)
+    # scans currently writing in bulk ingest mode
+    bulk_ingests: int = 0
+    checkpoints: int = 0
+    wal_restarts: int = 0
+    # frames in the WAL at the last checkpoint
+    wal_frames: int = 0
+    search_cache: QueryCacheStats = Field(default_factory=QueryCacheStats)
+
+
+class StorageWrite(NamedTuple):
+    priority: int
+    sequence: int
+    enqueued: float
+    function: Optional[Callable[[FileSystemStorage], object]]
+    future: Optional[Future]
+
+
+class StorageReader:
+    """ context manager lending a read only storage of the pool """
+
+    def __init__(self, service: 'StorageService', priority: StoragePriority) -> None:
+        self.service = service
+        self.priority = priority
+        self.storage: Optional[FileSystemStorage] = None
+
+    def __enter__(self) -> FileSystemStorage:
+        self.storage = self.service.acquireReader(self.priority)
+        return self.storage
+
+    def __exit__(self, *args) -> None:
+        assert self.storage is not None
+        self.service.releaseReader(self.storage)
+        self.storage = None
+
+
+class WalCheckpointer:
+    """ checkpoints the WAL periodically on its own connection while the writer runs with
+    the automatic checkpoints disabled, so no commit of the writer pays for one """
+
+    def __init__(self, db_path: Path, interval: float) -> None:
+        self.db_path = db_path
+        self.interval = interval
+        self.stopped = Event()
+        self.lock = Lock()
+        self.checkpoints = 0
+        self.restarts = 0
+        self.wal_frames = 0
+        self.thread = Thread(target=self.start, daemon=True)
+        self.thread.start()
+
+    def checkpoint(self, storage: FileSystemStorage) -> None:
+        try:
+            frames, _ = storage.checkpoint('PASSIVE')
+            restarted = frames >= RESTART_CHECKPOINT_FRAMES
+            if restarted:
+                # most frames are copied by the passive checkpoint, so the writer only
+                # waits for the frames of the last transaction
+                frames, _ = storage.checkpoint('RESTART')
+        except sqlite3.Error as ex:
+            logger.warning(f'failed to checkpoint {self.db_path}: {ex}')
+            return
+
+        with self.lock:
+            self.checkpoints += 1
+            self.restarts += int(restarted)
+            self.wal_frames = max(frames, 0)
+
+    def start(self) -> None:
+        storage = FileSystemStorage(self.db_path)
+        try:
+            while not self.stopped.wait(self.interval):
+                self.checkpoint(storage)
+
+            self.checkpoint(storage)
+        finally:
+            storage.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+class StorageService:
+    """ owns the connections to a database. All writes are executed in order of priority
+    by a single writer thread, so a long ingest transaction never competes with another
+    writer. Reads run in the calling thread on a small pool of read only connections, a
+    waiting interactive read gets the next free connection before background reads. Each
+    data source has its own database, see `StorageShards` """
+
+    def __init__(
+        self, db_path: Path, max_readers: int = 4, checkpoint_interval: float = 1.0,
+        name_index: bool = False, cache_entries: int = 256, cache_size: int = 4 * 1024 * 1024
+    ) -> None:
+        from flicker.services.memory.fs.nameindex import FileNameIndex
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.checkpoint_interval = checkpoint_interval
+        # the writer creates the schema before any read only connection is opened
+        self.writer = FileSystemStorage(db_path)
+        self.writer.db_initialize()
+
+        self.name_index: Optional[FileNameIndex] = None
+        self.compaction: Optional[Thread] = None
+        self.compaction_lock = Lock()
+        self.compaction_stopped = Event()
+        name_index_path = db_path.with_suffix('.names')
+        if name_index:
+            self.name_index = FileNameIndex(name_index_path)
+            self.writer.name_index = self.name_index
+        else:
+            # the index misses the writes made without it
+            FileNameIndex.remove(name_index_path)
+
+        # searches repeated while typing and erasing are answered from the cache
+        self.search_cache: QueryCache[object] = QueryCache(cache_entries, cache_size)
+
+        self.bulk_lock = Lock()
+        self.bulk_ingests = 0
+        self.checkpointer: Optional[WalCheckpointer] = None
+        self.checkpoints = 0
+        self.wal_restarts = 0
+
+        self.condition = Condition()
+        self.sequence = count()
+        self.idle_readers: list[FileSystemStorage] = []
+        self.reader_connections = 0
+        self.waiting_reads: list[tuple[int, int]] = []
+        self.read_waits: dict[str, QueueWaitStats] = dict()
+
+        self.queue: PriorityQueue[StorageWrite] = PriorityQueue()
+        self.closed = False
+        self.write_waits: dict[str, QueueWaitStats] = dict()
+        self.stats_lock = Lock()
+        self.thread = Thread(target=self.startWriting, daemon=True)
+        self.thread.start()
+
+        # the rows stored before the paths were normalized are moved, then the names
+        # stored without their pinyin forms are filled, in the background
+        self.submit(self.migrateFilePaths, StoragePriority.BACKGROUND)
+        if self.name_index is not None and not self.name_index.ready:
+            self.compactNameIndex()
+
+    def reader(self, priority: StoragePriority = StoragePriority.NORMAL) -> StorageReader:
+        """ usage: `with service.reader() as storage: storage.findFiles(...)` """
+        return StorageReader(self, priority)
+
+    def read(self, function: Callable[[FileSystemStorage], T], priority: StoragePriority = StoragePriority.NORMAL) -> T:
+        with self.reader(priority) as storage:
+            return function(storage)
+
+    def acquireReader(self, priority: StoragePriority) -> FileSystemStorage:
+        started = monotonic()
+        with self.condition:
+            ticket = (int(priority), next(self.sequence))
+            heapq.heappush(self.waiting_reads, ticket)
+            while self.waiting_reads[0] != ticket or (
+                len(self.idle_readers) == 0 and self.reader_connections >= self.max_readers
+            ):
+                self.condition.wait()
+
+            heapq.heappop(self.waiting_reads)
+            if len(self.idle_readers) > 0:
+                storage = self.idle_readers.pop()
+            else:
+                storage = FileSystemStorage(self.db_path, read_only=True)
+                self.reader_connections += 1
+
+            # the next waiting read may get another connection
+            self.condition.notify_all()
+            self.read_waits.setdefault(priority.name, QueueWaitStats()).record(monotonic() - started)
+
+        return storage
+
+    def releaseReader(self, storage: FileSystemStorage) -> None:
+        with self.condition:
+            self.idle_readers.append(storage)
+            self.condition.notify_all()
+
+    def submit(
+        self, function: Callable[[FileSystemStorage], T],
+        priority: StoragePriority = StoragePriority.NORMAL
+    ) -> 'Future[T]':
+        """ queue a write to the writer thread, writes of the same priority are executed
+        in the order of submission """
+        if self.closed:
+            raise RuntimeError(f'storage {self.db_path} is closed')
+
+        future: Future = Future()
+        self.queue.put(StorageWrite(int(priority), next(self.sequence), monotonic(), function, future))
+        return future
+
+    def write(self, function: Callable[[FileSystemStorage], T], priority: StoragePriority = StoragePriority.NORMAL) -> T:
+        """ execute a write in the writer thread and wait for its result """
+        return self.submit(function, priority).result()
+
+    def startWriting(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item.function is None:
+                break
+
+            with self.stats_lock:
+                name = StoragePriority(item.priority).name
+                self.write_waits.setdefault(name, QueueWaitStats()).record(monotonic() - item.enqueued)
+
+            assert item.future is not None
+            if not item.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                item.future.set_result(item.function(self.writer))
+            except BaseException as ex:
+                item.future.set_exception(ex)
+
+            # a bulk ingest writes most of the files again, its changes are compacted when the
+            # delta grows past the base, so the delta and the journal stay bounded
+            if self.name_index is not None and self.name_index.needsCompaction(self.bulk_ingests > 0):
+                self.compactNameIndex()
+
+        self.writer.close()
+
+    def searchFiles(self, filter: FileInfoFilter, priority: StoragePriority = StoragePriority.INTERACTIVE) -> FileSearchPage:
+        """ the file name index answers the search when enabled, otherwise a reader. The
+        pages are cached until the next write, they must not be modified """
+        key = 'search:' + filter.getCacheKey()
+        # read before the search, so a commit during the search makes its page stale
+        generation = self.writer.write_generation
+        page = self.search_cache.get(key, generation)
+        if isinstance(page, FileSearchPage):
+            return page
+
+        page = self.name_index.search(filter) if self.name_index is not None else None
+        if page is None:
+            page = self.read(lambda storage: storage.searchFiles(filter), priority)
+
+        size = sum(sys.getsizeof(path) for path in page.file_paths)
+        self.search_cache.put(key, generation, page, size)
+        return page
+
+    def estimateFileCount(self, filter: FileInfoFilter, priority: StoragePriority = StoragePriority.INTERACTIVE) -> FileCountEstimate:
+        key = 'count:' + filter.model_copy(update={'cursor': None}).getCacheKey()
+        generation = self.writer.write_generation
+        estimate = self.search_cache.get(key, generation)
+        if isinstance(estimate, FileCountEstimate):
+            return estimate
+
+        estimate = self.name_index.estimateFileCount(filter) if self.name_index is not None else None
+        if estimate is None:
+            estimate = self.read(lambda storage: storage.estimateFileCount(filter), priority)
+
+        self.search_cache.put(key, generation, estimate, 0)
+        return estimate
+
+    def getDuplicateGroups(self, priority: StoragePriority = StoragePriority.NORMAL) -> list[FileDuplicateGroup]:
+        """ the files of this database with identical content, see `StorageShards` for the
+        copies held by different data sources """
+        return self.read(lambda storage: storage.getDuplicateGroups(), priority)
+
+    def compactNameIndex(self) -> None:
+        """ rebuild the base of the file name index in a background thread """
+        with self.compaction_lock:
+            if self.compaction is not None and self.compaction.is_alive() or self.compaction_stopped.is_set():
+                return
+
+            self.compaction = Thread(target=self.runNameIndexCompaction, daemon=True)
+            self.compaction.start()
+
+    def runNameIndexCompaction(self) -> None:
+        name_index = self.name_index
+        assert name_index is not None
+        started = monotonic()
+        # the database is read after the writes frozen in the writer thread are committed
+        self.write(lambda storage: name_index.freeze(), StoragePriority.BACKGROUND)
+        storage = FileSystemStorage(self.db_path, read_only=True)
+        try:
+            if name_index.compact(storage.iterNameIndexEntries(), self.compaction_stopped):
+                logger.info(f'file name index compacted in {monotonic() - started:.1f} s')
+        except Exception as ex:
+            logger.exception(f"failed to compact the file name index: {ex}")
+        finally:
+            storage.close()
+
+    def migrateFilePaths(self, storage: FileSystemStorage) -> None:
+        """ runs in the writer thread, one batch per write so other writes interleave """
+        if storage.migrateFilePaths():
+            self.submit(self.migrateFilePaths, StoragePriority.BACKGROUND)
+        else:
+            self.submit(self.fillNameForms, StoragePriority.BACKGROUND)
+
+    def fillNameForms(self, storage: FileSystemStorage) -> None:
+        """ runs in the writer thread, one batch per write so other writes interleave """
+        if storage.fillNameForms():
+            self.submit(self.fillNameForms, StoragePriority.BACKGROUND)
+
+    def beginBulkIngest(self) -> None:
+        """ the writer stops checkpointing the WAL on commit, a background connection
+        checkpoints it instead. Nested and concurrent bulk ingests share the mode """
+        with self.bulk_lock:
+            self.bulk_ingests += 1
+            if self.bulk_ingests > 1:
+                return
+
+            self.write(lambda storage: storage.setAutoCheckpoint(0))
+            self.checkpointer = WalCheckpointer(self.db_path, self.checkpoint_interval)
+
+    def endBulkIngest(self) -> None:
+        with self.bulk_lock:
+            self.bulk_ingests -= 1
+            if self.bulk_ingests > 0 or self.checkpointer is None:
+                return
+
+            self.checkpointer.stop()
+            with self.stats_lock:
+                self.checkpoints += self.checkpointer.checkpoints
+                self.wal_restarts += self.checkpointer.restarts
+
+            self.checkpointer = None
+            self.write(lambda storage: storage.setAutoCheckpoint(DEFAULT_AUTOCHECKPOINT))
+            # shrink the WAL grown by the ingest, without waiting for the readers
+            self.submit(lambda storage: storage.checkpoint('TRUNCATE'), StoragePriority.BACKGROUND)
+
+    @contextmanager
+    def bulkIngest(self) -> Iterator[None]:
+        self.beginBulkIngest()
+        try:
+            yield
+        finally:
+            self.endBulkIngest()
+
+    def getStats(self) -> StorageServiceStats:
+        with self.condition:
+            stats = StorageServiceStats(
+                reader_connections=self.reader_connections,
+                idle_readers=len(self.idle_readers),
+                max_readers=self.max_readers,
+                waiting_reads=len(self.waiting_reads),
+                read_waits={name: wait.model_copy() for name, wait in self.read_waits.items()}
+            )
+
+        with self.stats_lock:
+            stats.writer_connections = 0 if not self.thread.is_alive() else 1
+            stats.queued_writes = self.queue.qsize()
+            stats.write_waits = {name: wait.model_copy() for name, wait in self.write_waits.items()}
+            stats.checkpoints = self.checkpoints
+            stats.wal_restarts = self.wal_restarts
+
+        stats.search_cache = self.search_cache.getStats()
+
+        checkpointer = self.checkpointer
+        stats.bulk_ingests = self.bulk_ingests
+        if checkpointer is not None:
+            with checkpointer.lock:
+                stats.checkpoints += checkpointer.checkpoints
+                stats.wal_restarts += checkpointer.restarts
+                stats.wal_frames = checkpointer.wal_frames
+
+        return stats
+
+    def close(self) -> None:
+        """ wait for the queued writes and close all connections """
+        with self.compaction_lock:
+            self.compaction_stopped.set()
+
+        if self.compaction is not None:
+            self.compaction.join()
+
+        self.closed = True
+        self.queue.put(StorageWrite(len(StoragePriority), next(self.sequence), monotonic(), None, None))
+        self.thread.join()
+        with self.condition:
+            for storage in self.idle_readers:
+                storage.close()
+
+            self.reader_connections -= len(self.idle_readers)
+            self.idle_readers.clear()
+
+        if self.name_index is not None:
+            self.name_index.close()
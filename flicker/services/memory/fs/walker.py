@@ -0,0 +1,104 @@
+from collections import deque
+from threading import Thread, Condition
+from typing import Callable, Generic, TypeVar, Iterable
+from traceback import format_exc
+from loguru import logger
+
+
+T = TypeVar('T')
+
+
+class ParallelDirectoryWalker(Generic[T]):
+    """ traverse a directory tree with a pool of worker threads. Each worker owns a
+    deque of pending directories, it pops the most recently discovered directory from
+    its own deque (depth first, good locality) and steals the oldest directory from
+    the other workers (usually the largest unexplored subtrees) when it runs out of work.
+
+    `visit` is called with a pending item and returns the items found below it, it is
+    invoked concurrently and therefore must be thread safe. """
+
+    def __init__(self, visit: Callable[[T], Iterable[T]], parallelism: int) -> None:
+        self.visit = visit
+        self.parallelism = max(1, parallelism)
+        self.queues: list[deque[T]] = [deque() for _ in range(self.parallelism)]
+        self.condition = Condition()
+        self.pending = 0
+        self.idle_workers = 0
+        self.stopped = False
+
+    def walk(self, roots: Iterable[T]) -> None:
+        """ visit all the roots and their descendants, blocks until finished """
+        for i, root in enumerate(roots):
+            self.queues[i % self.parallelism].append(root)
+            self.pending += 1
+
+        workers = [Thread(target=self.work, args=(i,), daemon=True) for i in range(self.parallelism)]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+    def stop(self) -> None:
+        """ stop the traversal, directories not visited yet are dropped """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def take(self, index: int) -> T | None:
+        try:
+            return self.queues[index].pop()
+        except IndexError:
+            pass
+
+        for offset in range(1, self.parallelism):
+            try:
+                return self.queues[(index + offset) % self.parallelism].popleft()
+            except IndexError:
+                continue
+
+        return None
+
+    def work(self, index: int) -> None:
+        queue = self.queues[index]
+        while True:
+            item = self.take(index)
+            if item is None:
+                with self.condition:
+                    # re-check under the lock, work might be published in the meantime
+                    while not self.stopped and self.pending > 0:
+                        item = self.take(index)
+                        if item is not None:
+                            break
+
+                        self.idle_workers += 1
+                        self.condition.wait()
+                        self.idle_workers -= 1
+
+                    if item is None:
+                        return
+
+            if self.stopped:
+                return
+
+            children: list[T] = []
+            try:
+                children = list(self.visit(item))
+            except Exception:
+                logger.error(f'failed to visit {item}')
+                logger.info(format_exc())
+
+            if len(children) > 0:
+                # account for the children before publishing them, so the pending
+                # counter never drops to zero while there is still work to do
+                with self.condition:
+                    self.pending += len(children)
+
+                queue.extend(children)
+
+            with self.condition:
+                self.pending -= 1
+                if self.pending == 0:
+                    self.condition.notify_all()
+                elif len(children) > 0 and self.idle_workers > 0:
+                    self.condition.notify(min(len(children), self.idle_workers))
@@ -0,0 +1,362 @@
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.scanner import FileScanner, FileScanningOptions, ScanPriority
+from flicker.services.memory.fs.exclusion import ExclusionRules, IGNORE_FILE_NAME
+
+from PySide6.QtCore import QThread, QObject, Signal
+from pydantic import BaseModel
+from typing import Optional
+from os import scandir
+from os.path import join, isfile, isdir, dirname
+from pathlib import Path
+from time import monotonic, sleep
+from loguru import logger
+from traceback import format_exc
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class WatchLimitError(Exception):
+    """ raised when the kernel limit of inotify watches is reached """
+
+
+class Inotify:
+    """ minimal ctypes binding of the linux inotify api """
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported on this platform')
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def addWatch(self, path: str) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code == errno.ENOSPC:
+                raise WatchLimitError(f'inotify watch limit reached when watching {path}')
+
+            raise OSError(code, os.strerror(code), path)
+
+        return wd
+
+    def removeWatch(self, wd: int) -> None:
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> list[tuple[int, int, str]]:
+        """ returns a list of (wd, mask, name) """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class FileSystemWatcherStats(BaseModel):
+    degraded: bool = False
+    watch_count: int = 0
+    total_events: int = 0
+    event_rate: float = 0.0
+    applied_batches: int = 0
+    last_apply_latency: float = 0.0
+    max_apply_latency: float = 0.0
+
+
+class FileSystemWatcher(QObject):
+    """ keeps the storage in sync with the changes under the root directory. Bursts of
+    inotify events are coalesced per path and applied as small upserts and deletes, the
+    watcher degrades to periodic incremental rescans when inotify is unavailable or the
+    kernel watch limit is reached """
+
+    watchingFinished = Signal()
+    statsUpdated = Signal(FileSystemWatcherStats)
+
+    def __init__(
+        self, options: FileScanningOptions,
+        debounce_interval: float = 0.5,
+        max_delay: float = 2.0,
+        rescan_interval: float = 300.0
+    ) -> None:
+        super().__init__()
+        self.options = options
+        self.debounce_interval = debounce_interval
+        self.max_delay = max_delay
+        self.rescan_interval = rescan_interval
+        self.working_thread = QThread()
+        self.stats = FileSystemWatcherStats()
+        self.stopped = False
+        self.inotify: Optional[Inotify] = None
+        self.watches: dict[int, str] = dict()
+        # exclusion rules of each watched directory, including its ignore file
+        self.rules: dict[str, ExclusionRules] = dict()
+        # path -> whether the path is a directory, the action is decided when applying
+        self.pending: dict[str, bool] = dict()
+        self.burst_started = 0.0
+        self.last_event = 0.0
+        self.overflowed = False
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def watchTree(self, directory: str, rules: ExclusionRules) -> list[Path]:
+        """ watch the directory and its sub directories, returns the matched files """
+        assert self.inotify is not None
+        paths: list[Path] = []
+        pending = [(directory, rules)]
+        while len(pending) > 0:
+            current_directory, current_rules = pending.pop()
+            try:
+                wd = self.inotify.addWatch(current_directory)
+                with scandir(current_directory) as it:
+                    entries = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+            except WatchLimitError:
+                raise
+            except OSError as ex:
+                logger.warning(f'failed to watch {current_directory}: {ex}')
+                continue
+
+            self.watches[wd] = current_directory
+            if any(name == IGNORE_FILE_NAME for name, _ in entries):
+                current_rules = current_rules.loadIgnoreFile(current_directory)
+
+            self.rules[current_directory] = current_rules
+            for name, is_directory in entries:
+                path = join(current_directory, name)
+                if is_directory:
+                    if not current_rules.isExcludedDirectory(path, name):
+                        pending.append((path, current_rules))
+                elif self.options.isMatchedFile(name) and not current_rules.isExcludedFile(path, name):
+                    paths.append(Path(path))
+
+        self.stats.watch_count = len(self.watches)
+        return paths
+
+    def unwatchTree(self, directory: str) -> None:
+        assert self.inotify is not None
+        prefix = join(directory, '')
+        for wd, path in list(self.watches.items()):
+            if path == directory or path.startswith(prefix):
+                self.inotify.removeWatch(wd)
+                self.watches.pop(wd, None)
+                self.rules.pop(path, None)
+
+        self.stats.watch_count = len(self.watches)
+
+    def handleEvent(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return
+
+        if mask & IN_IGNORED:
+            directory = self.watches.pop(wd, None)
+            if directory is not None:
+                self.rules.pop(directory, None)
+            self.stats.watch_count = len(self.watches)
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None or name == '' or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # changes of the watched directory itself are reported by its parent
+            return
+
+        is_directory = bool(mask & IN_ISDIR)
+        path = join(directory, name)
+        rules = self.rules[directory]
+        if is_directory and rules.isExcludedDirectory(path, name):
+            return
+
+        if not is_directory and (not self.options.isMatchedFile(name) or rules.isExcludedFile(path, name)):
+            return
+
+        now = monotonic()
+        if len(self.pending) == 0:
+            self.burst_started = now
+
+        self.last_event = now
+        self.pending[path] = is_directory
+
+    def applyPendingChanges(self) -> None:
+        pending = self.pending
+        burst_started = self.burst_started
+        self.pending = dict()
+
+        upserts: list[Path] = []
+        deletes: list[str] = []
+        service = StorageShards.getInstance().getService(self.options.root_directory)
+        for path, is_directory in pending.items():
+            if is_directory:
+                if isdir(path):
+                    # a new or moved-in directory, its content is not watched yet
+                    parent_rules = self.rules.get(dirname(path))
+                    if parent_rules is not None:
+                        upserts.extend(self.watchTree(path, parent_rules))
+                else:
+                    self.unwatchTree(path)
+                    service.write(lambda storage: storage.removeDirectory(path))
+            elif isfile(path):
+                upserts.append(Path(path))
+            else:
+                deletes.append(path)
+
+        if len(upserts) > 0:
+            service.write(lambda storage: storage.addFiles(upserts))
+
+        if len(deletes) > 0:
+            service.write(lambda storage: storage.removeFiles(deletes))
+
+        latency = monotonic() - burst_started
+        self.stats.applied_batches += 1
+        self.stats.last_apply_latency = latency
+        self.stats.max_apply_latency = max(self.stats.max_apply_latency, latency)
+        logger.info(f'applied {len(upserts)} upserts and {len(deletes)} deletes in {latency:.2f} seconds')
+
+    def rescan(self, priority: ScanPriority = ScanPriority.NORMAL) -> None:
+        options = self.options.model_copy(update={'incremental': True})
+        FileScanner.requestScanning(options, priority)
+
+    def startWatching(self) -> None:
+        assert self.inotify is not None
+        window_started = monotonic()
+        window_events = 0
+
+        while not self.stopped:
+            events = self.inotify.read(timeout=0.2)
+            for wd, mask, name in events:
+                self.handleEvent(wd, mask, name)
+
+            window_events += len(events)
+            self.stats.total_events += len(events)
+
+            now = monotonic()
+            if self.overflowed:
+                logger.warning(f'inotify event queue overflowed, rescan {self.options.root_directory}')
+                self.overflowed = False
+                self.pending.clear()
+                self.rescan()
+            elif len(self.pending) > 0:
+                if now - self.last_event >= self.debounce_interval or now - self.burst_started >= self.max_delay:
+                    self.applyPendingChanges()
+
+            if now - window_started >= 1.0:
+                self.stats.event_rate = window_events / (now - window_started)
+                window_started = now
+                window_events = 0
+                self.statsUpdated.emit(self.stats.model_copy())
+
+    def startPeriodicRescanning(self) -> None:
+        self.stats.degraded = True
+        self.statsUpdated.emit(self.stats.model_copy())
+        next_rescan = monotonic() + self.rescan_interval
+        while not self.stopped:
+            if monotonic() < next_rescan:
+                sleep(0.5)
+                continue
+
+            self.rescan(ScanPriority.LOW)
+            next_rescan = monotonic() + self.rescan_interval
+
+    def start(self) -> None:
+        logger.info(f'start watching {self.options.root_directory}')
+        try:
+            try:
+                self.inotify = Inotify()
+                rules = ExclusionRules.compile(
+                    self.options.root_directory, self.options.excluded_directories, self.options.nested_roots
+                )
+                self.watchTree(self.options.root_directory, rules)
+                logger.info(f'watching {len(self.watches)} directories under {self.options.root_directory}')
+                self.startWatching()
+            except (OSError, WatchLimitError) as ex:
+                logger.warning(f'failed to watch {self.options.root_directory}, fall back to periodic rescanning: {ex}')
+            finally:
+                if self.inotify is not None:
+                    self.inotify.close()
+                    self.inotify = None
+
+                self.watches.clear()
+                self.rules.clear()
+                self.stats.watch_count = 0
+
+            if not self.stopped:
+                self.startPeriodicRescanning()
+        except Exception as ex:
+            logger.error(f'file system watcher of {self.options.root_directory} stopped: {ex}')
+            logger.info(format_exc())
+
+        self.watchingFinished.emit()
+
+
+class FileSystemWatcherService:
+    watchers: dict[str, FileSystemWatcher] = dict()
+
+    @classmethod
+    def startWatching(cls, options: FileScanningOptions) -> FileSystemWatcher:
+        if options.root_directory in cls.watchers:
+            return cls.watchers[options.root_directory]
+
+        watcher = FileSystemWatcher(options)
+        cls.watchers[options.root_directory] = watcher
+        watcher.working_thread.started.connect(watcher.start)
+        watcher.watchingFinished.connect(watcher.working_thread.quit)
+        watcher.moveToThread(watcher.working_thread)
+        watcher.working_thread.start()
+        return watcher
+
+    @classmethod
+    def stopWatching(cls, root_directory: str) -> None:
+        watcher = cls.watchers.pop(root_directory, None)
+        if watcher is not None:
+            watcher.stop()
+
+    @classmethod
+    def getStats(cls, root_directory: str) -> Optional[FileSystemWatcherStats]:
+        watcher = cls.watchers.get(root_directory)
+        return None if watcher is None else watcher.stats.model_copy()
@@ -80,6 +80,15 @@ class Settings(BaseModel):
             settings_dir = Path(appdata) / "flicker"
             if not settings_dir.exists():
                 settings_dir.mkdir()
+        elif sys.platform == "darwin":
+            settings_dir = Path.home() / "Library" / "Application Support" / "flicker"
+            if not settings_dir.exists():
+                settings_dir.mkdir(parents=True)
+        elif sys.platform.startswith("linux"):
+            config_home = os.environ.get("XDG_CONFIG_HOME", "")
+            settings_dir = (Path(config_home) if config_home != "" else Path.home() / ".config") / "flicker"
+            if not settings_dir.exists():
+                settings_dir.mkdir(parents=True)
         else:
             raise NotImplementedError(sys.platform)
 
@@ -0,0 +1,121 @@
+""" Benchmark of the search cache of StorageService
+
+Fills a temporary database with synthetic file rows, then replays the searches of a user
+typing the queries in the hotkey window one character at a time, erasing the last few
+characters and typing them again. Reports the latency of the searches with and without
+the cache, its hit rate and footprint, and the hit rate while an ingest commits batches.
+
+Usage: run from repository root:
+    python scripts/benchmarks/cache_benchmark.py --rows 1000000
+"""
+from loguru import logger
+from pathlib import Path
+from random import Random
+from time import perf_counter
+
+import argparse
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import (  # noqa: E402
+    FileSystemStorage, StorageService, StoragePriority, FileInfoFilter
+)
+from search_benchmark import generateFileInfos, generateQueries, report  # noqa: E402
+
+
+def generateKeystrokes(queries: list[str], seed: int) -> list[str]:
+    """ the text of the input after each keystroke """
+    random = Random(seed)
+    texts = []
+    for query in queries:
+        for i in range(1, len(query) + 1):
+            texts.append(query[:i])
+
+        for _ in range(random.randint(0, 2)):
+            erased = random.randint(1, max(1, len(query) // 2))
+            for i in range(len(query) - 1, len(query) - erased - 1, -1):
+                texts.append(query[:i])
+            for i in range(len(query) - erased + 1, len(query) + 1):
+                texts.append(query[:i])
+
+    return [text for text in texts if text.strip() != ""]
+
+
+def replay(service: StorageService, texts: list[str], limit: int) -> list[float]:
+    samples = []
+    for text in texts:
+        filter = FileInfoFilter(keywords=[text], limit=limit)
+        started = perf_counter()
+        service.searchFiles(filter)
+        samples.append(perf_counter() - started)
+
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--cache-entries", type=int, default=256)
+    parser.add_argument("--cache-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--ingest-batch", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    db_path = Path(tempfile.mkdtemp()) / "fsmemory.db"
+    storage = FileSystemStorage(db_path)
+    storage.db_initialize()
+    batch = []
+    for info in generateFileInfos(args.rows, args.seed):
+        batch.append(info)
+        if len(batch) >= 50_000:
+            storage.addFileInfos(batch, 1)
+            batch = []
+
+    if len(batch) > 0:
+        storage.addFileInfos(batch, 1)
+
+    storage.mergeSearchIndex()
+    storage.close()
+
+    texts = generateKeystrokes(generateQueries(args.queries, args.seed), args.seed)
+    service = StorageService(db_path, cache_entries=0)
+    report("uncached", replay(service, texts, args.limit))
+    service.close()
+
+    service = StorageService(db_path, cache_entries=args.cache_entries, cache_size=args.cache_size)
+    report("cached", replay(service, texts, args.limit))
+    stats = service.getStats().search_cache
+    print(
+        f"{len(texts)} keystrokes, hit rate {stats.hit_rate * 100:.1f}%, {stats.entries} entries, "
+        f"{stats.size / 1024:.0f} KiB, {stats.evictions} evictions"
+    )
+
+    # an ingest commits a batch between every few keystrokes
+    infos = generateFileInfos((len(texts) // 4 + 1) * args.ingest_batch, args.seed + 1)
+    service.search_cache.clear()
+    hits = service.getStats().search_cache.hits
+    samples = []
+    for i, text in enumerate(texts):
+        if i % 4 == 0:
+            batch = [next(infos) for _ in range(args.ingest_batch)]
+            service.write(lambda storage: storage.addFileInfos(batch, 1), StoragePriority.BACKGROUND)
+
+        filter = FileInfoFilter(keywords=[text], limit=args.limit)
+        started = perf_counter()
+        service.searchFiles(filter)
+        samples.append(perf_counter() - started)
+
+    report("ingesting", samples)
+    stats = service.getStats().search_cache
+    print(f"hit rate while ingesting {(stats.hits - hits) / len(texts) * 100:.1f}%, {stats.invalidations} invalidated entries")
+    service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+""" Benchmark of the concurrent embedding requests
+
+Starts a local stub of the OpenAI embeddings endpoint which answers each request after a
+fixed latency plus a cost per token, throttles with 429 when more requests than its
+capacity are in flight, and fails a share of the requests with 503. Embeds the same
+synthetic corpus one batch at a time, as the serial loop did, and with several batches in
+flight, and reports the tokens/sec, the retries and the throttled requests of each.
+
+Usage: run from repository root:
+    python scripts/benchmarks/embedding_benchmark.py --texts 20000 --in-flight 8 --capacity 6
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+import argparse
+import base64
+import json
+import random
+import struct
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.llm.embedding import EmbeddingService, EmbeddingOptions  # noqa: E402
+from flicker.utils.settings import ModelInstance  # noqa: E402
+
+
+class StubEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, token_cost: float, capacity: int, error_rate: float, dimension: int) -> None:
+        super().__init__(("127.0.0.1", 0), StubEmbeddingHandler)
+        self.latency = latency
+        self.token_cost = token_cost
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.dimension = dimension
+        self.lock = Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    server: StubEmbeddingServer
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            throttled = server.in_flight >= server.capacity
+            failed = not throttled and random.random() < server.error_rate
+            if throttled:
+                server.throttled += 1
+            elif failed:
+                server.failed += 1
+            else:
+                server.in_flight += 1
+
+        if throttled or failed:
+            status = 429 if throttled else 503
+            self.reply(status, {"error": {"message": "stub error", "type": "stub", "code": status}})
+            return
+
+        try:
+            tokens = sum(len(text.split()) for text in request["input"])
+            sleep(server.latency + tokens * server.token_cost)
+            vector = struct.pack(f"<{server.dimension}f", *([0.5] * server.dimension))
+            encoded = base64.b64encode(vector).decode("ascii")
+            data = [
+                {"object": "embedding", "index": i, "embedding": encoded if request.get("encoding_format") == "base64" else [0.5] * server.dimension}
+                for i in range(len(request["input"]))
+            ]
+            self.reply(200, {
+                "object": "list", "data": data, "model": request["model"],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def run(name: str, server: StubEmbeddingServer, texts: list[str], options: EmbeddingOptions) -> None:
+    model = ModelInstance(base_url=f"http://127.0.0.1:{server.server_port}/v1", model_name="stub", api_key="stub")
+    with server.lock:
+        server.requests = server.throttled = server.failed = 0
+
+    started = perf_counter()
+    result = EmbeddingService.startEmbedding(model, texts, options)
+    cost = perf_counter() - started
+    print(
+        f"{name:>10}: {result.total_tokens} tokens in {cost:.1f} s, {result.total_tokens / cost:.0f} tokens/sec, "
+        f"{server.requests} requests, {server.throttled} throttled, {server.failed} failed, "
+        f"{result.failed_batches} batches given up"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--in-flight", type=int, default=8)
+    parser.add_argument("--capacity", type=int, default=6, help="requests in flight before the stub throttles")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds of each request")
+    parser.add_argument("--token-cost", type=float, default=0.00002, help="seconds per token of each request")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of the requests failed with 503")
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    random.seed(args.seed)
+    words = [f"word{i}" for i in range(5000)]
+    texts = [" ".join(random.choices(words, k=random.randint(20, 200))) for _ in range(args.texts)]
+    server = StubEmbeddingServer(args.latency, args.token_cost, args.capacity, args.error_rate, args.dimension)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    # the store would answer the second run
+    options = EmbeddingOptions(batch_size=args.batch_size, use_store=False, backoff_base=0.1)
+    run("serial", server, texts, options.model_copy(update={"max_in_flight": 1}))
+    run("concurrent", server, texts, options.model_copy(update={"max_in_flight": args.in_flight}))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+""" Benchmark of the embedding store
+
+Appends random vectors of synthetic chunks in batches as the embedding service does, then
+looks every chunk up by the hash of its text as a second run of the same texts would, and
+reads random vectors through the memory mapping. Removes a share of the chunks and reports
+the time to compact the matrix and its size before and after.
+
+Usage: run from repository root:
+    python scripts/benchmarks/embedding_store_benchmark.py --chunks 200000 --dimension 1024
+"""
+from loguru import logger
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Sequence
+
+import argparse
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.llm.embeddingstore import EmbeddingStore, getContentHash  # noqa: E402
+from search_benchmark import report  # noqa: E402
+
+
+MODEL = "benchmark"
+
+
+def chunked(items: Sequence, size: int) -> Iterator[Sequence]:
+    """ the items in slices of `size`, the last one may be shorter """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--reads", type=int, default=10_000)
+    parser.add_argument("--remove", type=float, default=0.3, help="share of the chunks removed before compaction")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    rng = random.Random(args.seed)
+    store = EmbeddingStore(Path(tempfile.mkdtemp()) / "embeddings.db")
+    texts = [f"chunk {i} of a synthetic document" for i in range(args.chunks)]
+    hashes = [getContentHash(text) for text in texts]
+    vector = [rng.random() for _ in range(args.dimension)]
+
+    started = perf_counter()
+    for batch in chunked(range(args.chunks), args.batch_size):
+        store.addEmbeddings(MODEL, [hashes[i] for i in batch], [vector] * len(batch))
+        store.assignChunks(MODEL, [(str(i), hashes[i]) for i in batch])
+
+    cost = perf_counter() - started
+    print(f"    append: {args.chunks} vectors in {cost:.1f} s, {args.chunks / cost:.0f} vectors/sec")
+
+    started = perf_counter()
+    found = 0
+    for batch in chunked(hashes, args.batch_size):
+        found += len(store.findRows(MODEL, batch))
+
+    cost = perf_counter() - started
+    print(f"    lookup: {found} / {args.chunks} texts found in {cost:.2f} s, hit ratio {found / args.chunks:.2%}")
+
+    samples = []
+    for _ in range(args.reads):
+        row = rng.randrange(args.chunks)
+        started = perf_counter()
+        store.getVectors([row])
+        samples.append(perf_counter() - started)
+
+    report("read", samples)
+
+    removed = rng.sample(range(args.chunks), int(args.chunks * args.remove))
+    for batch in chunked(removed, 1000):
+        store.removeChunks(MODEL, [str(i) for i in batch])
+
+    size = store.getStats().matrix_size
+    started = perf_counter()
+    store.compact()
+    print(
+        f"   compact: {len(removed)} tombstones dropped in {perf_counter() - started:.2f} s, "
+        f"matrix {size / 2**20:.1f} MiB -> {store.getStats().matrix_size / 2**20:.1f} MiB"
+    )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
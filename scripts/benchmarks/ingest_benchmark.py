@@ -0,0 +1,110 @@
+""" Benchmark of the bulk ingest of FileSystemStorage with concurrent searches
+
+Writes synthetic file rows through `StorageService` in bulk ingest mode while another
+thread keeps searching, then reports the ingest throughput and the search latency
+during the ingest and once the database is idle.
+
+Usage: run from repository root:
+    python scripts/benchmarks/ingest_benchmark.py --rows 1000000
+"""
+from loguru import logger
+from pathlib import Path
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+import argparse
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import StorageService, StoragePriority, FileInfoFilter  # noqa: E402
+from flicker.services.memory.fs.pinyin import getNameForms, isPinyinSupported  # noqa: E402
+from search_benchmark import generateFileInfos, generateQueries, report  # noqa: E402
+
+
+def search(
+    service: StorageService, queries: list[str], limit: int, interval: float,
+    samples: list[float], stopped: Event
+) -> None:
+    """ searches like a user typing, one query every `interval` seconds """
+    i = 0
+    while not stopped.is_set():
+        filter = FileInfoFilter(keywords=[queries[i % len(queries)]], limit=limit)
+        started = perf_counter()
+        service.read(lambda storage: storage.findFiles(filter), StoragePriority.INTERACTIVE)
+        samples.append(perf_counter() - started)
+        i += 1
+        sleep(interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--search-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    db_path = Path(tempfile.mkdtemp()) / "fsmemory.db"
+    service = StorageService(db_path)
+    queries = generateQueries(args.queries, args.seed)
+
+    samples: list[float] = []
+    stopped = Event()
+    searcher = Thread(target=search, args=(service, queries, args.limit, args.search_interval, samples, stopped), daemon=True)
+    searcher.start()
+
+    started = perf_counter()
+    conversion_seconds = 0.0
+    with service.bulkIngest():
+        batch = []
+        for info in generateFileInfos(args.rows, args.seed, name_forms=False):
+            # the pinyin forms are computed here to measure their share of the ingest
+            conversion_started = perf_counter()
+            forms = getNameForms(info["file_name"])
+            info["file_name_pinyin"], info["file_name_initials"] = forms
+            conversion_seconds += perf_counter() - conversion_started
+            batch.append(info)
+            if len(batch) >= args.batch_size:
+                service.write(lambda storage: storage.addFileInfos(batch, 1), StoragePriority.BACKGROUND)
+                batch = []
+
+        if len(batch) > 0:
+            service.write(lambda storage: storage.addFileInfos(batch, 1), StoragePriority.BACKGROUND)
+
+    cost = perf_counter() - started
+    stopped.set()
+    searcher.join()
+
+    stats = service.getStats()
+    wal_path = db_path.with_name(db_path.name + "-wal")
+    wal_size = wal_path.stat().st_size if wal_path.exists() else 0
+    print(
+        f"ingested {args.rows} rows in {cost:.1f} s, {args.rows / cost:.0f} rows/sec, "
+        f"{stats.checkpoints} checkpoints, {stats.wal_restarts} wal restarts, wal {wal_size / 1024 / 1024:.1f} MiB"
+    )
+    print(
+        f"pinyin forms {'enabled' if isPinyinSupported() else 'disabled, pypinyin is not installed'}: "
+        f"{conversion_seconds:.2f} s, {conversion_seconds / cost * 100:.1f}% of the ingest"
+    )
+    report("ingesting", samples)
+
+    service.write(lambda storage: storage.mergeSearchIndex(), StoragePriority.BACKGROUND)
+    samples = []
+    for query in queries:
+        filter = FileInfoFilter(keywords=[query], limit=args.limit)
+        started = perf_counter()
+        service.read(lambda storage: storage.findFiles(filter), StoragePriority.INTERACTIVE)
+        samples.append(perf_counter() - started)
+
+    report("idle", samples)
+    service.close()
+
+
+if __name__ == "__main__":
+    main()
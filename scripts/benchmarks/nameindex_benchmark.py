@@ -0,0 +1,95 @@
+""" Benchmark of the in process file name index of the hotkey window
+
+Writes the base of a `FileNameIndex` from synthetic file rows without a database, opens
+it again as a fresh process would, then reports the latency of the top 20 searches, which
+rank the latest candidates like the database, and of the writes kept in the delta.
+
+Usage: run from repository root:
+    python scripts/benchmarks/nameindex_benchmark.py --rows 5000000
+"""
+from loguru import logger
+from pathlib import Path
+from time import perf_counter
+
+import argparse
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import FileInfoFilter  # noqa: E402
+from flicker.services.memory.fs.nameindex import FileNameIndex, createEntry, writeFileNameIndex  # noqa: E402
+from search_benchmark import generateFileInfos, generateQueries, report  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--delta-rows", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    path = Path(tempfile.mkdtemp()) / "fsmemory.names"
+    entries = (
+        createEntry(
+            rowid + 1, info["file_path"], info["file_name"].lower(), info["file_name_pinyin"],
+            info["file_name_initials"], info["modified_time"]
+        )
+        for rowid, info in enumerate(generateFileInfos(args.rows, args.seed))
+    )
+    started = perf_counter()
+    writeFileNameIndex(path, entries)
+    print(f"wrote {args.rows} files in {perf_counter() - started:.1f} s, {path.stat().st_size / 1024 / 1024:.0f} MiB")
+
+    started = perf_counter()
+    index = FileNameIndex(path)
+    print(f"opened in {(perf_counter() - started) * 1000:.2f} ms")
+
+    queries = generateQueries(args.queries, args.seed)
+    filters = [FileInfoFilter(keywords=[query], limit=args.limit) for query in queries]
+    samples = []
+    for filter in filters:
+        started = perf_counter()
+        index.search(filter)
+        samples.append(perf_counter() - started)
+
+    report("base", samples)
+    # the kinds of queries generated in turn by generateQueries
+    for kind, name in enumerate(["common", "rare", "two terms", "number"]):
+        report(name, samples[kind::4])
+
+    started = perf_counter()
+    delta = [
+        createEntry(
+            args.rows + rowid + 1, info["file_path"], info["file_name"].lower(), info["file_name_pinyin"],
+            info["file_name_initials"], info["modified_time"]
+        )
+        for rowid, info in enumerate(generateFileInfos(args.delta_rows, args.seed + 1))
+    ]
+    index.addEntries(delta)
+    print(f"added {args.delta_rows} files to the delta in {perf_counter() - started:.1f} s")
+
+    samples = []
+    for filter in filters:
+        started = perf_counter()
+        index.search(filter)
+        samples.append(perf_counter() - started)
+
+    report("delta", samples)
+
+    samples = []
+    for query in queries:
+        started = perf_counter()
+        FileInfoFilter(keywords=[query], limit=args.limit)
+        samples.append(perf_counter() - started)
+
+    report("filter", samples)
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+""" Benchmark of the normalized file paths of FileSystemStorage
+
+Fills a temporary database of the schema before the paths were normalized with synthetic
+file rows, where every row kept its full path and the lowercase copies of its path and
+name. Reports the time of the online migration to the directory table, and the size of
+each table and index before the migration, after it and in a database ingested directly.
+
+Usage: run from repository root:
+    python scripts/benchmarks/path_benchmark.py --rows 1000000
+"""
+from loguru import logger
+from pathlib import Path
+from time import perf_counter
+
+import argparse
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import FileSystemStorage, SCHEMA_MIGRATIONS  # noqa: E402
+from search_benchmark import generateFileInfos  # noqa: E402
+
+
+# the schema version before the paths were normalized
+LEGACY_SCHEMA_VERSION = 8
+
+LEGACY_INSERT_FILE_INFO = """
+INSERT INTO fileinfo (
+    file_path, file_path_lower,
+    file_name, file_name_lower,
+    created_time, modified_time, accessed_time,
+    file_size, inode, scan_generation,
+    file_name_pinyin, file_name_initials
+) VALUES (
+    :file_path, lower(:file_path),
+    :file_name, lower(:file_name),
+    :created_time, :modified_time, :accessed_time,
+    :file_size, :inode, 1,
+    :file_name_pinyin, :file_name_initials
+);
+"""
+
+SELECT_OBJECT_SIZE = """
+SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC;
+"""
+
+
+def getObjectSizes(db_path: Path) -> dict[str, int]:
+    connection = sqlite3.connect(db_path)
+    sizes = dict(connection.execute(SELECT_OBJECT_SIZE).fetchall())
+    connection.close()
+    return sizes
+
+
+def vacuum(db_path: Path) -> float:
+    """ returns the MiB of the file after the free pages are released """
+    connection = sqlite3.connect(db_path)
+    connection.execute("VACUUM")
+    connection.close()
+    return db_path.stat().st_size / 1024 / 1024
+
+
+def report(columns: list[str], sizes: list[dict[str, int]], top: int) -> None:
+    names = sorted(set().union(*sizes), key=lambda name: -max(size.get(name, 0) for size in sizes))
+    print(f"{'':>32}" + "".join(f"{column:>12}" for column in columns))
+    for name in names[:top]:
+        print(f"{name:>32}" + "".join(f"{size.get(name, 0) / 1024 / 1024:>10.1f} M" for size in sizes))
+
+    print(f"{'total':>32}" + "".join(f"{sum(size.values()) / 1024 / 1024:>10.1f} M" for size in sizes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    directory = Path(tempfile.mkdtemp())
+    legacy_path = directory / "legacy.db"
+    connection = sqlite3.connect(legacy_path, isolation_level=None)
+    connection.execute("PRAGMA journal_mode = WAL")
+    for migration in SCHEMA_MIGRATIONS[:LEGACY_SCHEMA_VERSION]:
+        connection.executescript("BEGIN;" + migration + "COMMIT;")
+
+    connection.execute(f"PRAGMA user_version = {LEGACY_SCHEMA_VERSION}")
+    started = perf_counter()
+    batch = []
+    for info in generateFileInfos(args.rows, args.seed):
+        batch.append(info)
+        if len(batch) >= 50_000:
+            connection.execute("BEGIN")
+            connection.executemany(LEGACY_INSERT_FILE_INFO, batch)
+            connection.execute("COMMIT")
+            batch = []
+
+    if len(batch) > 0:
+        connection.execute("BEGIN")
+        connection.executemany(LEGACY_INSERT_FILE_INFO, batch)
+        connection.execute("COMMIT")
+
+    connection.execute("INSERT INTO filesearch (filesearch) VALUES ('optimize')")
+    connection.close()
+    print(f"ingested {args.rows} rows of schema {LEGACY_SCHEMA_VERSION} in {perf_counter() - started:.1f} s")
+    legacy_sizes = getObjectSizes(legacy_path)
+    legacy_size = vacuum(legacy_path)
+
+    # the first batch is moved by db_initialize, the service moves the others in the background
+    started = perf_counter()
+    storage = FileSystemStorage(legacy_path)
+    storage.db_initialize()
+    batches = 1
+    while storage.migrateFilePaths(args.batch_size):
+        batches += 1
+
+    cost = perf_counter() - started
+    storage.close()
+    print(f"migrated {args.rows} rows in {batches} batches in {cost:.1f} s, {args.rows / cost:.0f} rows/sec")
+    migrated_size = legacy_path.stat().st_size / 1024 / 1024
+    migrated_sizes = getObjectSizes(legacy_path)
+    vacuumed_size = vacuum(legacy_path)
+
+    fresh_path = directory / "fresh.db"
+    storage = FileSystemStorage(fresh_path)
+    storage.db_initialize()
+    started = perf_counter()
+    batch = []
+    for info in generateFileInfos(args.rows, args.seed):
+        batch.append(info)
+        if len(batch) >= 50_000:
+            storage.addFileInfos(batch, 1)
+            batch = []
+
+    if len(batch) > 0:
+        storage.addFileInfos(batch, 1)
+
+    storage.mergeSearchIndex()
+    storage.close()
+    print(f"ingested {args.rows} rows in {perf_counter() - started:.1f} s")
+    fresh_size = vacuum(fresh_path)
+
+    print(
+        f"db {legacy_size:.0f} MiB before, {migrated_size:.0f} MiB after the migration, "
+        f"{vacuumed_size:.0f} MiB vacuumed, {fresh_size:.0f} MiB ingested directly"
+    )
+    report(["legacy", "migrated", "fresh"], [legacy_sizes, migrated_sizes, getObjectSizes(fresh_path)], args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+""" Benchmark of a rescan of FileSystemStorage where few files changed
+
+Fills a temporary database with synthetic file rows, then writes the same rows again with
+a small share of them modified, as a full rescan of a mostly static tree does. Reports the
+time and the bytes written to the WAL by the change-aware `addFileInfos` and by the upsert
+it replaced, which rewrote every row.
+
+Usage: run from repository root:
+    python scripts/benchmarks/rescan_benchmark.py --rows 1000000 --churn 0.01
+"""
+from loguru import logger
+from pathlib import Path
+from random import Random
+from time import perf_counter
+
+import argparse
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import FileSystemStorage, FileUpsertCounts, INSERT_FILE_INFO  # noqa: E402
+from search_benchmark import generateFileInfos  # noqa: E402
+
+
+def getWalSize(db_path: Path) -> int:
+    wal_path = db_path.with_name(db_path.name + "-wal")
+    return wal_path.stat().st_size if wal_path.exists() else 0
+
+
+def rescan(storage: FileSystemStorage, infos: list[dict], batch_size: int, baseline: bool) -> None:
+    """ the previous upsert is run on the connection of the storage for the baseline """
+    storage.checkpoint('TRUNCATE')
+    counts = FileUpsertCounts()
+    started = perf_counter()
+    for i in range(0, len(infos), batch_size):
+        batch = infos[i:i + batch_size]
+        if baseline:
+            connection = storage._FileSystemStorage__connection  # type: ignore[attr-defined]
+            for info in batch:
+                info["scan_generation"] = 2
+            connection.execute("BEGIN TRANSACTION")
+            connection.executemany(INSERT_FILE_INFO, batch)
+            connection.commit()
+        else:
+            result = storage.addFileInfos(batch, 2)
+            assert result is not None
+            counts = FileUpsertCounts(*(a + b for a, b in zip(counts, result)))
+
+    cost = perf_counter() - started
+    summary = "" if baseline else f", {counts.inserted} inserted, {counts.updated} updated, {counts.unchanged} unchanged"
+    print(
+        f"{'upsert' if baseline else 'change aware':>12}: {cost:.1f} s, {len(infos) / cost:.0f} rows/sec, "
+        f"wal {getWalSize(storage.db_path) / 1024 / 1024:.1f} MiB{summary}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--churn", type=float, default=0.01)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    db_path = Path(tempfile.mkdtemp()) / "fsmemory.db"
+    storage = FileSystemStorage(db_path)
+    storage.db_initialize()
+    infos = list(generateFileInfos(args.rows, args.seed))
+    started = perf_counter()
+    for i in range(0, len(infos), args.batch_size):
+        storage.addFileInfos(infos[i:i + args.batch_size], 1)
+
+    print(f"ingested {args.rows} rows in {perf_counter() - started:.1f} s, db {db_path.stat().st_size / 1024 / 1024:.0f} MiB")
+
+    # the WAL keeps every frame written by the rescan until it is measured
+    storage.setAutoCheckpoint(0)
+    random = Random(args.seed + 1)
+    for info in random.sample(infos, int(len(infos) * args.churn)):
+        info["file_size"] += 1
+        info["modified_time"] += 60
+
+    rescan(storage, infos, args.batch_size, baseline=False)
+    for info in random.sample(infos, int(len(infos) * args.churn)):
+        info["file_size"] += 1
+        info["modified_time"] += 60
+
+    rescan(storage, infos, args.batch_size, baseline=True)
+    storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+""" Benchmark of the file name search of FileSystemStorage
+
+Fills a temporary database with synthetic file rows and compares the latency of
+`FileSystemStorage.findFiles` with the previous INSTR scan.
+
+Usage: run from repository root:
+    python scripts/benchmarks/search_benchmark.py --rows 5000000
+"""
+from loguru import logger
+from pathlib import Path
+from random import Random
+from time import perf_counter
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import FileSystemStorage, FileInfoFilter  # noqa: E402
+from flicker.services.memory.fs.pinyin import NameForms, getNameForms  # noqa: E402
+
+
+SYLLABLES = [
+    "ba", "ce", "di", "fo", "gu", "ha", "ji", "ke", "lo", "mu", "na", "pe", "qi", "ro",
+    "su", "ta", "vi", "we", "xu", "yo", "za", "an", "en", "in", "on", "un", "ri", "te",
+]
+
+COMMON_WORDS = [
+    "report", "invoice", "budget", "meeting", "notes", "draft", "final", "review", "design",
+    "project", "summary", "contract", "photo", "scan", "slides", "paper", "thesis", "backup",
+    "会议纪要", "年度报告", "合同", "发票", "项目计划", "周报", "论文", "简历", "方案", "总结",
+]
+
+EXTENSIONS = [".pdf", ".docx", ".pptx", ".txt", ".png", ".jpg"]
+
+# the query used by findFiles before the trigram index, it scanned the table as there was
+# no index on the modified time
+BASELINE_QUERY = """
+SELECT d.directory_path || f.file_name FROM fileinfo f JOIN filedirectory d ON d.directory_id = f.directory_id
+WHERE INSTR(f.file_name, ?) ORDER BY +f.modified_time DESC;
+"""
+
+
+def generateWords(random: Random, count: int) -> list[str]:
+    words = set(COMMON_WORDS)
+    while len(words) < count:
+        words.add("".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))))
+
+    return sorted(words)
+
+
+def generateFileInfos(rows: int, seed: int, name_forms: bool = True):
+    """ a tree of bounded depth, names are made of a few words from a large vocabulary
+    where some words are much more frequent than others like real file names. The pinyin
+    forms of the names are left empty unless `name_forms` """
+    random = Random(seed)
+    words = generateWords(random, 5000)
+
+    def pickWord() -> str:
+        return random.choice(COMMON_WORDS) if random.random() < 0.2 else random.choice(words)
+
+    directories = [(os.path.join(os.sep, "data"), 0)]
+    for i in range(max(rows // 50, 1)):
+        parent, depth = random.choice(directories)
+        if depth >= 8:
+            parent, depth = directories[0]
+
+        directories.append((os.path.join(parent, f"{pickWord()}{random.randint(0, 99)}"), depth + 1))
+
+    now = 1_700_000_000
+    for i in range(rows):
+        directory, _ = random.choice(directories)
+        name = f"{pickWord()}_{pickWord()}_{random.randint(0, 9999)}{random.choice(EXTENSIONS)}"
+        path = os.path.join(directory, name)
+        modified_time = now - random.randint(0, 5 * 365 * 86400)
+        forms = getNameForms(name) if name_forms else NameForms('', '')
+        yield {
+            "file_path": path,
+            "file_name": name,
+            "file_name_pinyin": forms.pinyin,
+            "file_name_initials": forms.initials,
+            "created_time": modified_time,
+            "modified_time": modified_time,
+            "accessed_time": modified_time,
+            "file_size": random.randint(0, 1 << 24),
+            "inode": i,
+        }
+
+
+def generateQueries(count: int, seed: int) -> list[str]:
+    """ a mix of frequent words, rare words, two terms and numbers """
+    random = Random(seed + 1)
+    words = generateWords(Random(seed), 5000)
+    queries = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            queries.append(random.choice(COMMON_WORDS))
+        elif kind == 1:
+            queries.append(random.choice(words))
+        elif kind == 2:
+            queries.append(f"{random.choice(words)} {random.choice(EXTENSIONS)[1:]}")
+        else:
+            queries.append(f"{random.choice(COMMON_WORDS)[:3]} {random.randint(100, 9999)}")
+
+    return queries
+
+
+def percentile(samples: list[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(name: str, samples: list[float]) -> None:
+    print(
+        f"{name:>10}: {len(samples)} queries, p50 {percentile(samples, 0.5) * 1000:.2f} ms, "
+        f"p99 {percentile(samples, 0.99) * 1000:.2f} ms, max {max(samples) * 1000:.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--baseline-queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", type=str, default="", help="database file, a temporary one by default")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    db_path = Path(args.db) if args.db != "" else Path(tempfile.mkdtemp()) / "fsmemory.db"
+    storage = FileSystemStorage(db_path)
+    storage.db_initialize()
+
+    started = perf_counter()
+    batch = []
+    for info in generateFileInfos(args.rows, args.seed):
+        batch.append(info)
+        if len(batch) >= 50_000:
+            storage.addFileInfos(batch, 1)
+            batch = []
+
+    if len(batch) > 0:
+        storage.addFileInfos(batch, 1)
+
+    cost = perf_counter() - started
+    started = perf_counter()
+    storage.mergeSearchIndex()
+    print(f"merged search index in {perf_counter() - started:.1f} s")
+    print(f"ingested {args.rows} rows in {cost:.1f} s, {args.rows / cost:.0f} rows/sec, db {db_path.stat().st_size / 1024 / 1024:.0f} MiB")
+
+    queries = generateQueries(args.queries, args.seed)
+    samples = []
+    for query in queries:
+        started = perf_counter()
+        storage.findFiles(FileInfoFilter(keywords=[query], limit=args.limit))
+        samples.append(perf_counter() - started)
+
+    report("trigram", samples)
+
+    # the same queries narrowed by the predicates of the query syntax
+    predicates = ["ext:pdf", "after:2023-06-01", "ext:docx,pptx before:2021-01-01", "size:>8mb", "in:ba"]
+    samples = []
+    for i, query in enumerate(queries):
+        filter = FileInfoFilter.parse(f"{query} {predicates[i % len(predicates)]}", now=1_700_000_000, limit=args.limit)
+        started = perf_counter()
+        storage.findFiles(filter)
+        samples.append(perf_counter() - started)
+
+    report("predicates", samples)
+    samples = []
+    for i in range(args.queries):
+        filter = FileInfoFilter.parse(predicates[i % len(predicates)], now=1_700_000_000, limit=args.limit)
+        started = perf_counter()
+        storage.findFiles(filter)
+        samples.append(perf_counter() - started)
+
+    report("only", samples)
+    started = perf_counter()
+    storage.getExtensionCounts()
+    print(f"extension facets in {(perf_counter() - started) * 1000:.2f} ms")
+
+    connection = sqlite3.connect(db_path)
+    samples = []
+    for query in queries[:args.baseline_queries]:
+        started = perf_counter()
+        connection.execute(BASELINE_QUERY, (query.split()[0],)).fetchall()
+        samples.append(perf_counter() - started)
+
+    report("instr", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+""" Benchmark of the storage shards of the data sources
+
+Writes synthetic file rows of several roots from one thread per root, first into a single
+database as before the shards, then into a shard per root through `StorageShards`.
+Reports the ingest throughput of both, the search latency of the single database and of
+the fan-out over the shards, and the time to remove a root from each.
+
+Usage: run from repository root:
+    python scripts/benchmarks/shard_benchmark.py --rows 1000000 --roots 4
+"""
+from loguru import logger
+from pathlib import Path
+from threading import Thread
+from time import perf_counter
+from typing import Callable
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from flicker.services.memory.fs.storage import StorageService, StoragePriority, FileInfoFilter  # noqa: E402
+from flicker.services.memory.fs.shards import StorageShards, getShardPath  # noqa: E402
+from search_benchmark import generateFileInfos, generateQueries, report  # noqa: E402
+
+
+def ingest(
+    getService: Callable[[str], StorageService], roots: list[str], rows: int, batch_size: int, seed: int
+) -> float:
+    """ writes the rows of each root from its own thread, returns the seconds taken """
+    def write(root: str, seed: int) -> None:
+        service = getService(root)
+        with service.bulkIngest():
+            batch = []
+            for info in generateFileInfos(rows // len(roots), seed):
+                # the synthetic paths all start with the separator
+                info["file_path"] = root + info["file_path"]
+                batch.append(info)
+                if len(batch) >= batch_size:
+                    service.write(lambda storage: storage.addFileInfos(batch, 1), StoragePriority.BACKGROUND)
+                    batch = []
+
+            if len(batch) > 0:
+                service.write(lambda storage: storage.addFileInfos(batch, 1), StoragePriority.BACKGROUND)
+
+            service.write(lambda storage: storage.mergeSearchIndex(), StoragePriority.BACKGROUND)
+
+    started = perf_counter()
+    threads = [Thread(target=write, args=(root, seed + i)) for i, root in enumerate(roots)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return perf_counter() - started
+
+
+def search(service: StorageService | StorageShards, queries: list[str], limit: int) -> list[float]:
+    samples = []
+    for query in queries:
+        filter = FileInfoFilter(keywords=[query], limit=limit)
+        started = perf_counter()
+        service.searchFiles(filter)
+        samples.append(perf_counter() - started)
+
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--roots", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    directory = Path(tempfile.mkdtemp())
+    roots = [os.path.join(os.sep, f"source{i}") for i in range(args.roots)]
+    queries = generateQueries(args.queries, args.seed)
+
+    # the cache would answer the repeated queries
+    single = StorageService(directory / "fsmemory.db", cache_entries=0)
+    cost = ingest(lambda root: single, roots, args.rows, args.batch_size, args.seed)
+    print(f"    single: ingested {args.rows} rows of {args.roots} roots in {cost:.1f} s, {args.rows / cost:.0f} rows/sec")
+
+    shards = StorageShards(directory / "shards")
+    shards.configure({root: getShardPath(shards.directory, root) for root in roots})
+    cost = ingest(shards.getService, roots, args.rows, args.batch_size, args.seed)
+    print(f"    shards: ingested {args.rows} rows of {args.roots} roots in {cost:.1f} s, {args.rows / cost:.0f} rows/sec")
+    for service in shards.services.values():
+        service.search_cache.max_entries = 0
+        service.search_cache.clear()
+
+    report("single", search(single, queries, args.limit))
+    report("fan-out", search(shards, queries, args.limit))
+
+    started = perf_counter()
+    single.write(lambda storage: storage.removeDirectory(roots[0]))
+    print(f"    single: removed a root in {perf_counter() - started:.2f} s")
+    started = perf_counter()
+    shards.removeShard(roots[0])
+    print(f"    shards: removed a root in {perf_counter() - started:.2f} s")
+
+    single.close()
+    shards.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.storage import SCHEMA_MIGRATIONS, NORMALIZE_FILE_PATHS, FileSystemStorage
+from flicker.services.memory.fs.pinyin import getNameForms
+
+from pathlib import Path
+from typing import Iterator
+
+import os
+import pytest
+import sqlite3
+
+
+@pytest.fixture(autouse=True)
+def settings_directory(tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ the snapshots, checkpoints and shards of a test are kept out of the user settings """
+    directory = tmp_path_factory.mktemp("config")
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(directory))
+    monkeypatch.setenv("APPDATA", str(directory))
+    return directory / "flicker"
+
+
+def makeTree(root: Path, files: list[str]) -> None:
+    """ create the files, given relative to the root with `/` as separator """
+    for file in files:
+        path = root.joinpath(*file.split('/'))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(file, encoding='utf-8')
+
+
+@pytest.fixture
+def shards(settings_directory: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[StorageShards]:
+    """ the storage shards of the test, closed at its end """
+    monkeypatch.setattr(StorageShards, "_instance", None)
+    instance = StorageShards.getInstance()
+    yield instance
+    instance.close()
+
+
+def makeFileInfo(path: str, modified_time: int = 1_700_000_000, file_size: int = 1, inode: int = 0) -> dict:
+    """ the row of a file which does not exist, like `getFileInfo` builds from a stat result """
+    name = os.path.basename(path)
+    forms = getNameForms(name)
+    return {
+        "file_path": path,
+        "file_name": name,
+        "file_name_pinyin": forms.pinyin,
+        "file_name_initials": forms.initials,
+        "created_time": modified_time,
+        "modified_time": modified_time,
+        "accessed_time": modified_time,
+        "file_size": file_size,
+        "inode": inode,
+    }
+
+
+@pytest.fixture
+def storage(tmp_path: Path) -> Iterator[FileSystemStorage]:
+    instance = FileSystemStorage(tmp_path / "fsmemory.db")
+    instance.db_initialize()
+    yield instance
+    instance.close()
+
+
+def createLegacyDatabase(path: Path, files: list[str]) -> None:
+    """ the database shared by the data sources, at the schema before the paths were
+    normalized, with the content and the fingerprint of each file """
+    connection = sqlite3.connect(path)
+    for migration in SCHEMA_MIGRATIONS[:SCHEMA_MIGRATIONS.index(NORMALIZE_FILE_PATHS)]:
+        connection.executescript(migration)
+    connection.execute(f"PRAGMA user_version = {SCHEMA_MIGRATIONS.index(NORMALIZE_FILE_PATHS)};")
+    for i, file in enumerate(files):
+        name = os.path.basename(file)
+        connection.execute(
+            "INSERT INTO fileinfo (file_path, file_path_lower, file_name, file_name_lower, created_time,"
+            " modified_time, accessed_time, scan_generation, file_size, inode) VALUES (?, ?, ?, ?, 1, ?, 1, 1, ?, 0)",
+            (file, file.lower(), name, name.lower(), 1_700_000_000 + i, 10 + i)
+        )
+        connection.execute(
+            "INSERT INTO filecontent (file_path, file_size, modified_time, status, chunk_count) VALUES (?, ?, ?, 'ok', 1)",
+            (file, 10 + i, 1_700_000_000 + i)
+        )
+        connection.execute("INSERT INTO filechunk (file_path, chunk_index, content) VALUES (?, 0, ?)", (file, f"text of {name}"))
+        connection.execute(
+            "INSERT INTO filefingerprint (file_path, file_size, modified_time, sample_hash, full_hash) VALUES (?, ?, ?, 's', ?)",
+            (file, 10 + i, 1_700_000_000 + i, f"hash{i}")
+        )
+    connection.commit()
+    connection.close()
@@ -0,0 +1,76 @@
+from pathlib import Path
+from threading import Lock
+from types import SimpleNamespace
+
+import pytest
+import sys
+
+if sys.version_info < (3, 12):
+    pytest.skip("the embedding service uses itertools.batched of Python 3.12", allow_module_level=True)
+
+from flicker.services.llm import embedding  # noqa: E402
+from flicker.services.llm.embeddingstore import EmbeddingStore  # noqa: E402
+from flicker.utils.settings import ModelInstance  # noqa: E402
+from openai import APIStatusError  # noqa: E402
+
+
+class FailingClient:
+    """ embeds every text as [1.0, 2.0] and fails the batches holding a text starting with `bad` """
+    requests = 0
+    lock = Lock()
+
+    def __init__(self, **kwargs) -> None:
+        self.embeddings = self
+
+    def create(self, model: str, input: list[str], **kwargs) -> SimpleNamespace:
+        with FailingClient.lock:
+            FailingClient.requests += 1
+
+        if any(text.startswith("bad") for text in input):
+            raise ValueError("rejected batch")
+
+        data = [SimpleNamespace(index=i, embedding=[1.0, 2.0]) for i in range(len(input))]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=len(input)))
+
+
+def test_failed_batches_do_not_stop_the_run(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(embedding, "OpenAI", FailingClient)
+    store = EmbeddingStore(tmp_path / "embeddings.db")
+    texts = [f"text {i}" for i in range(10)] + ["bad 0", "bad 1"]
+    model = ModelInstance(base_url="http://127.0.0.1/v1", model_name="stub", api_key="stub")
+    options = embedding.EmbeddingOptions(batch_size=2, max_in_flight=1)
+
+    result = embedding.EmbeddingService.startEmbedding(
+        model, texts, options, chunk_ids=[str(i) for i in range(len(texts))], store=store
+    )
+    # the failed batch is the last one, the batches before it are embedded anyway
+    assert FailingClient.requests == 6
+    assert result.failed_batches == 1 and result.failed_texts == 2
+    assert result.embedded_texts == 10 and result.total_tokens == 10
+    assert result.rows[-2:] == [-1, -1]
+    assert len(set(result.rows[:-2])) == 10 and min(result.rows[:-2]) >= 0
+
+    # only the failed texts are sent again
+    FailingClient.requests = 0
+    result = embedding.EmbeddingService.startEmbedding(model, texts, options, store=store)
+    assert FailingClient.requests == 1 and result.cached_texts == 10 and result.failed_texts == 2
+
+
+def statusError(status_code: int) -> Exception:
+    response = SimpleNamespace(request=None, status_code=status_code, headers={})
+    return APIStatusError(f"status {status_code}", response=response, body=None)  # type: ignore[arg-type]
+
+
+def test_rejected_requests_do_not_raise_the_limit() -> None:
+    limiter = embedding.AdaptiveConcurrency(8)
+    limiter.limit = 2.0
+    # released like the service releases a request failing with the error
+    for status_code in (400, 401, 422):
+        ex = statusError(status_code)
+        limiter.release(limiter.acquire(), False, embedding.isRetryable(ex))
+        assert limiter.limit == 2.0
+
+    limiter.release(limiter.acquire(), True)
+    assert limiter.limit == 2.5
+    limiter.release(limiter.acquire(), False, embedding.isRetryable(statusError(429)))
+    assert limiter.limit == 1.25
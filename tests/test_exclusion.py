@@ -0,0 +1,87 @@
+from flicker.services.memory.fs import exclusion
+from flicker.services.memory.fs.exclusion import ExclusionRule, ExclusionRules
+
+import ntpath
+import os
+import pytest
+
+
+ROOT = os.path.join(os.sep, "data", "root")
+
+
+def path(*names: str) -> str:
+    return os.path.join(ROOT, *names)
+
+
+def test_parse_rule() -> None:
+    assert ExclusionRule.parse("# comment") is None
+    assert ExclusionRule.parse("   ") is None
+    rule = ExclusionRule.parse("!/docs/build/\n")
+    assert rule is not None
+    assert (rule.pattern, rule.negated, rule.directory_only, rule.anchored) == ("docs/build", True, True, True)
+    rule = ExclusionRule.parse("*.log")
+    assert rule is not None and not rule.anchored and not rule.isLiteralName()
+
+
+def test_names_match_at_any_depth() -> None:
+    rules = ExclusionRules.compile(ROOT, ["node_modules", "*.tmp"])
+    assert rules.isExcludedDirectory(path("node_modules"), "node_modules")
+    assert rules.isExcludedDirectory(path("a", "b", "node_modules"), "node_modules")
+    assert rules.isExcludedFile(path("a", "x.tmp"), "x.tmp")
+    assert not rules.isExcludedFile(path("a", "x.tmpl"), "x.tmpl")
+
+
+def test_anchored_and_double_star_patterns() -> None:
+    rules = ExclusionRules.compile(ROOT, ["/build", "docs/**/drafts"])
+    assert rules.isExcludedDirectory(path("build"), "build")
+    assert not rules.isExcludedDirectory(path("src", "build"), "build")
+    assert rules.isExcludedDirectory(path("docs", "drafts"), "drafts")
+    assert rules.isExcludedDirectory(path("docs", "a", "b", "drafts"), "drafts")
+    assert not rules.isExcludedDirectory(path("src", "drafts"), "drafts")
+
+
+def test_last_matching_rule_wins() -> None:
+    rules = ExclusionRules.compile(ROOT, ["*.md", "!keep.md"])
+    assert rules.isExcludedFile(path("a.md"), "a.md")
+    assert not rules.isExcludedFile(path("keep.md"), "keep.md")
+
+
+def test_directory_only_rules_skip_files() -> None:
+    rules = ExclusionRules.compile(ROOT, ["cache/"])
+    assert rules.isExcludedDirectory(path("cache"), "cache")
+    assert not rules.isExcludedFile(path("cache"), "cache")
+
+
+def test_ignore_file_rules_are_relative_to_their_directory() -> None:
+    rules = ExclusionRules.compile(ROOT, []).extend(path("sub"), ["/out", "*.bak"])
+    assert rules.isExcludedDirectory(path("sub", "out"), "out")
+    assert not rules.isExcludedDirectory(path("out"), "out")
+    assert rules.isExcludedFile(path("sub", "deep", "a.bak"), "a.bak")
+
+
+def test_absolute_prefixes() -> None:
+    rules = ExclusionRules.compile(ROOT, [path("private")])
+    assert rules.prefixes == [path("private")]
+    assert rules.isExcludedDirectory(path("private"), "private")
+    assert rules.isExcludedDirectory(path("private", "deep"), "deep")
+    assert not rules.isExcludedDirectory(path("public"), "public")
+    assert ExclusionRules.compile(ROOT, [ROOT]).isExcludedRoot()
+
+
+def test_absolute_prefixes_ignore_case_on_windows(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(exclusion, "normcase", ntpath.normcase)
+    monkeypatch.setattr(exclusion, "isabs", ntpath.isabs)
+    rules = ExclusionRules.compile("C:\\Users\\x", ["c:\\users\\x\\node_modules"])
+    # kept as a prefix instead of being parsed as a pattern
+    assert len(rules.rules) == 0
+    assert rules.isExcludedDirectory("C:\\Users\\x\\Node_Modules", "Node_Modules")
+    assert rules.isExcludedDirectory("C:\\Users\\x\\node_modules\\pkg", "pkg")
+    assert not rules.isExcludedDirectory("C:\\Users\\x\\src", "src")
+
+
+def test_nested_roots_are_excluded() -> None:
+    rules = ExclusionRules.compile(ROOT, [], [path("inner")])
+    assert rules.isExcludedDirectory(path("inner"), "inner")
+    assert not rules.isExcludedDirectory(path("innerx"), "innerx")
+    # kept when the rules are extended by an ignore file
+    assert rules.extend(path("a"), ["*.tmp"]).isExcludedDirectory(path("inner"), "inner")
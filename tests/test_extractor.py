@@ -0,0 +1,60 @@
+from flicker.services.memory.fs import extractor
+from flicker.services.memory.fs.extractor import ContentExtractorInstance, ContentExtractionOptions
+from flicker.services.memory.fs.parsers import ExtractedFile, ExtractionLimits
+from flicker.services.memory.fs.shards import StorageShards
+from flicker.services.memory.fs.storage import FileContentState
+
+from pathlib import Path
+from time import monotonic, sleep
+
+import pytest
+
+
+def extractStuckFile(path: str, limits: ExtractionLimits) -> ExtractedFile:
+    """ runs in the workers, a stuck file blocks in C code like a pathological document """
+    if Path(path).name.startswith("stuck"):
+        sleep(600)
+
+    return ExtractedFile(path, 'ok', [Path(path).name], 1)
+
+
+class RecordingStorage:
+    def __init__(self) -> None:
+        self.contents: dict[str, str] = dict()
+
+    def getFingerprints(self, root_directory: str) -> dict[str, str]:
+        return dict()
+
+    def saveContents(self, contents: list[tuple[FileContentState, str, list[str]]]) -> bool:
+        for state, status, _ in contents:
+            self.contents[state.file_path] = status
+
+        return True
+
+
+class RecordingService:
+    def __init__(self) -> None:
+        self.storage = RecordingStorage()
+
+    def read(self, function, priority):
+        return function(self.storage)
+
+    def write(self, function, priority):
+        return function(self.storage)
+
+
+def test_stuck_worker_is_recycled(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    service = RecordingService()
+    monkeypatch.setattr(StorageShards, "getService", lambda self, root: service)
+    monkeypatch.setattr(extractor, "extractFile", extractStuckFile)
+    names = ["stuck.txt"] + [f"file{i}.txt" for i in range(6)]
+    pending = [FileContentState(str(tmp_path / name), 1, 0, False) for name in names]
+    # the grace covers the start of the spawned workers on a busy machine
+    options = ContentExtractionOptions(
+        root_directory=str(tmp_path), max_workers=2, time_limit=1.0, time_limit_grace=3.0, batch_size=1
+    )
+
+    started = monotonic()
+    ContentExtractorInstance(options).startExtraction(pending)
+    assert monotonic() - started < 60
+    assert service.storage.contents == {state.file_path: 'timeout' if i == 0 else 'ok' for i, state in enumerate(pending)}
@@ -0,0 +1,136 @@
+from flicker.services.memory.fs.nameindex import FileNameIndex, createEntry, writeFileNameIndex
+from flicker.services.memory.fs.storage import FileSystemStorage, FileInfoFilter, FileSearchCursor, FileSearchPage
+
+from conftest import makeFileInfo
+from pathlib import Path
+from typing import Iterator, Optional
+
+import os
+import pytest
+
+
+NOW = 1_700_000_000
+DAY = 86400
+
+
+def path(*names: str) -> str:
+    return os.path.join(os.sep, *names)
+
+
+@pytest.fixture
+def index(tmp_path: Path, storage: FileSystemStorage) -> Iterator[FileNameIndex]:
+    """ the index of the files of the storage, the files added to the storage before
+    `build` is called are in the base """
+    index = FileNameIndex(tmp_path / "fsmemory.names")
+    yield index
+    index.close()
+
+
+def build(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    index.freeze()
+    assert index.compact(storage.iterNameIndexEntries())
+
+
+def search(index: FileNameIndex, filter: FileInfoFilter) -> FileSearchPage:
+    """ the page of a filter the index answers """
+    page = index.search(filter)
+    assert page is not None
+    return page
+
+
+def searchAll(search, filter: FileInfoFilter) -> list[str]:
+    paths: list[str] = []
+    cursor: Optional[FileSearchCursor] = None
+    while True:
+        page = search(filter.model_copy(update={'cursor': cursor}))
+        paths.extend(page.file_paths)
+        if page.cursor is None:
+            return paths
+
+        cursor = page.cursor
+
+
+def test_pages_agree_with_the_database(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    storage.addFileInfos([
+        makeFileInfo(path("work", f"team{i % 5}", f"{['report', 'notes', 'budget'][i % 3]}_{i}.txt"), NOW - i * DAY)
+        for i in range(300)
+    ], 1)
+    build(index, storage)
+    for keywords in (["report"], ["team2"], ["team1 notes"], ["rk"], ["_2"], ["budget 9"], ["am 2"]):
+        # the windows are cut by the time, it is enough for all the matches
+        filter = FileInfoFilter(keywords=keywords, limit=7, search_seconds=60, cursor=FileSearchCursor(now=NOW))
+        expected = searchAll(storage.searchFiles, filter)
+        assert len(expected) > 0
+        assert searchAll(index.search, filter) == expected
+
+    # the windows of the latest candidates are the same, with the files named after a term
+    # in the first one
+    storage.addFileInfos([makeFileInfo(path("old", "budget.txt"), NOW - 900 * DAY)], 1)
+    index.addEntries(list(storage.iterNameIndexEntries())[-1:])
+    for keywords in (["report"], ["team1 notes"], ["budget"], ["budget 9"]):
+        filter = FileInfoFilter(keywords=keywords, limit=7, candidates=20, search_seconds=60, cursor=FileSearchCursor(now=NOW))
+        expected = searchAll(storage.searchFiles, filter)
+        assert len(expected) == len(set(expected)) > filter.limit
+        assert searchAll(index.search, filter) == expected
+
+
+def test_search_time_bounds_the_window(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    infos = [makeFileInfo(path("a", f"{'q_report' if i % 2 == 0 else 'note'}_{i}.txt"), NOW - i) for i in range(300)]
+    storage.addFileInfos(infos, 1)
+    build(index, storage)
+    # without time a page searches a single block, the next page goes on below it
+    filter = FileInfoFilter(keywords=["report"], limit=10, cursor=FileSearchCursor(now=NOW), search_seconds=0)
+    page = search(index, filter)
+    assert len(page.file_paths) == 6 and page.cursor is not None and page.cursor.window == 289
+    assert sorted(searchAll(index.search, filter)) == sorted(info["file_path"] for info in infos[::2])
+
+
+def test_latest_matches_of_the_delta_come_first(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    build(index, storage)
+    index.addEntries([createEntry(i, path("d", f"report_{i}.txt"), f"report_{i}.txt", "", "", NOW) for i in range(1, 61)])
+    index.removeFiles([(30, path("d", "report_30.txt"))])
+    filter = FileInfoFilter(keywords=["report"], limit=7, candidates=10, cursor=FileSearchCursor(now=NOW))
+    page = search(index, filter)
+    assert page.window_start == 51 and all(int(file_path[-6:-4]) > 50 for file_path in page.file_paths)
+    paths = searchAll(index.search, filter)
+    assert sorted(paths) == sorted(path("d", f"report_{i}.txt") for i in range(1, 61) if i != 30)
+
+
+def test_terms_match_the_directory(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    storage.addFileInfos([
+        makeFileInfo(path("projects", "alpha", "notes.txt"), NOW),
+        makeFileInfo(path("misc", "alpha.md"), NOW - DAY),
+    ], 1)
+    build(index, storage)
+    filter = FileInfoFilter(keywords=["alpha"], cursor=FileSearchCursor(now=NOW))
+    # a term in the name ranks before a term only in the directory
+    assert search(index, filter).file_paths == [path("misc", "alpha.md"), path("projects", "alpha", "notes.txt")]
+    assert search(index, filter.model_copy(update={'keywords': ["alpha notes"]})).file_paths == [
+        path("projects", "alpha", "notes.txt")
+    ]
+    # the delta matches the directories too
+    index.addEntries([createEntry(3, path("alpha", "x.txt"), "x.txt", "", "", NOW)])
+    assert path("alpha", "x.txt") in search(index, filter).file_paths
+
+
+def test_exact_match_is_ranked_above_later_inserted_matches(index: FileNameIndex, storage: FileSystemStorage) -> None:
+    storage.addFileInfos([makeFileInfo(path("r", "report.txt"), NOW)], 1)
+    storage.addFileInfos([
+        makeFileInfo(path("r", "archive", f"quarterly_financial_report_of_the_department_{i}.txt"), NOW - 400 * DAY)
+        for i in range(3000)
+    ], 1)
+    build(index, storage)
+    page = search(index, FileInfoFilter(keywords=["report"], limit=20, cursor=FileSearchCursor(now=NOW)))
+    assert page.file_paths[0] == path("r", "report.txt")
+
+
+def test_bulk_ingest_compacts_past_the_base(tmp_path: Path) -> None:
+    index = FileNameIndex(tmp_path / "fsmemory.names", compact_size=10, bulk_compact_size=100)
+    writeFileNameIndex(index.path, (createEntry(i, path(f"f{i}"), f"f{i}", "", "", NOW) for i in range(1, 201)))
+    index.close()
+    index = FileNameIndex(index.path, compact_size=10, bulk_compact_size=100)
+    index.addEntries([createEntry(1000 + i, path(f"g{i}"), f"g{i}", "", "", NOW) for i in range(150)])
+    assert index.needsCompaction() and not index.needsCompaction(bulk=True)
+    index.addEntries([createEntry(2000 + i, path(f"h{i}"), f"h{i}", "", "", NOW) for i in range(100)])
+    assert index.needsCompaction(bulk=True)
+    index.close()
@@ -0,0 +1,68 @@
+from flicker.services.memory.fs.query import parseDateRange, parseFileQuery, parseSize, parseSizeRange, parseTimeRange
+from flicker.services.memory.fs.storage import FileInfoFilter
+
+from datetime import datetime
+
+import os
+
+
+NOW = datetime(2026, 10, 18, 15, 30).timestamp()
+
+
+def timestamp(year: int, month: int, day: int) -> int:
+    return int(datetime(year, month, day).timestamp())
+
+
+def test_dates() -> None:
+    assert parseDateRange("2026-10-01", NOW) == (timestamp(2026, 10, 1), timestamp(2026, 10, 2))
+    assert parseDateRange("2026/12", NOW) == (timestamp(2026, 12, 1), timestamp(2027, 1, 1))
+    assert parseDateRange("2025", NOW) == (timestamp(2025, 1, 1), timestamp(2026, 1, 1))
+    assert parseDateRange("Yesterday", NOW) == (timestamp(2026, 10, 17), timestamp(2026, 10, 18))
+    assert parseDateRange("2w", NOW) == (int(NOW) - 14 * 86400, None)
+    assert parseDateRange("2026-02-30", NOW) is None
+    assert parseDateRange("soon", NOW) is None
+
+
+def test_time_ranges() -> None:
+    assert parseTimeRange("2026-01..2026-03", NOW) == (timestamp(2026, 1, 1), timestamp(2026, 4, 1))
+    assert parseTimeRange("..2025", NOW) == (None, timestamp(2026, 1, 1))
+    assert parseTimeRange("7d..", NOW) == (int(NOW) - 7 * 86400, None)
+    assert parseTimeRange("30d..7d", NOW) == (int(NOW) - 30 * 86400, int(NOW) - 7 * 86400)
+    assert parseTimeRange("2026..later", NOW) is None
+
+
+def test_sizes() -> None:
+    assert parseSize("100") == 100
+    assert parseSize("1.5MB") == 3 << 19
+    assert parseSize("2GiB") == 2 << 30
+    assert parseSize("big") is None
+    assert parseSizeRange(">1k") == (1025, None)
+    assert parseSizeRange("<1k") == (None, 1023)
+    assert parseSizeRange("1m..10m") == (1 << 20, 10 << 20)
+    assert parseSizeRange("5k") == (5 << 10, None)
+    assert parseSizeRange("1m..huge") is None
+
+
+def test_operators_and_keywords() -> None:
+    fields = parseFileQuery('Q3 report ext:PDF,.docx in:"My Documents" size:>1mb after:2026-10-01 before:2026-10-05', NOW)
+    assert fields["keywords"] == ["Q3 report"]
+    assert fields["extensions"] == ["pdf", "docx"]
+    assert fields["directories"] == ["My Documents"]
+    assert (fields["min_size"], fields["max_size"]) == ((1 << 20) + 1, None)
+    assert (fields["modified_after"], fields["modified_before"]) == (timestamp(2026, 10, 1), timestamp(2026, 10, 5))
+
+    absolute = os.path.join(os.sep, "data", "projects", "")
+    assert parseFileQuery(f"in:{absolute}", NOW)["directories"] == [os.path.normpath(absolute)]
+    assert parseFileQuery("created:2026 notes", NOW)["created_after"] == timestamp(2026, 1, 1)
+
+
+def test_words_not_understood_are_keywords() -> None:
+    fields = parseFileQuery("http://example.com size:huge after:never", NOW)
+    assert fields["keywords"] == ["http://example.com size:huge after:never"]
+    assert fields["min_size"] is None and fields["modified_after"] is None
+
+
+def test_filter_from_query() -> None:
+    filter = FileInfoFilter.parse("budget ext:xlsx", now=NOW, limit=5)
+    assert filter.getTerms() == ["budget"] and filter.extensions == ["xlsx"] and filter.limit == 5
+    assert FileInfoFilter.parse("ext:pdf", now=NOW).keywords == []
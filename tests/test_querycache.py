@@ -0,0 +1,56 @@
+from flicker.services.memory.fs.storage import StorageService, FileInfoFilter
+
+from conftest import makeFileInfo
+from pathlib import Path
+from typing import Iterator
+
+import os
+import pytest
+
+
+NOW = 1_700_000_000
+
+
+def path(*names: str) -> str:
+    return os.path.join(os.sep, *names)
+
+
+@pytest.fixture
+def service(tmp_path: Path) -> Iterator[StorageService]:
+    instance = StorageService(tmp_path / "fsmemory.db")
+    yield instance
+    instance.close()
+
+
+def test_committed_write_invalidates_the_pages(service: StorageService) -> None:
+    service.write(lambda storage: storage.addFileInfos([makeFileInfo(path("a", "report.txt"), NOW)], 1))
+    filter = FileInfoFilter(keywords=["report"])
+    page = service.searchFiles(filter)
+    assert page.file_paths == [path("a", "report.txt")]
+    assert service.estimateFileCount(filter).count == 1
+    # answered from the cache until the next write
+    assert service.searchFiles(filter) is page
+    assert service.search_cache.getStats().hits == 1
+
+    service.write(lambda storage: storage.addFileInfos([makeFileInfo(path("b", "report.md"), NOW + 1)], 1))
+    assert service.searchFiles(filter).file_paths == [path("b", "report.md"), path("a", "report.txt")]
+    assert service.estimateFileCount(filter).count == 2
+    assert service.search_cache.getStats().invalidations == 2
+
+
+def test_cursor_is_part_of_the_key(service: StorageService) -> None:
+    service.write(lambda storage: storage.addFileInfos([
+        makeFileInfo(path("a", f"report{i}.txt"), NOW + i) for i in range(3)
+    ], 1))
+    filter = FileInfoFilter(keywords=["report"], limit=1)
+    page = service.searchFiles(filter)
+    paths = list(page.file_paths)
+    for _ in range(2):
+        page = service.searchFiles(filter.model_copy(update={'cursor': page.cursor}))
+        paths.extend(page.file_paths)
+
+    # a key without the cursor would answer the first page again
+    assert paths == [path("a", f"report{i}.txt") for i in (2, 1, 0)]
+    # the first page is still cached under the filter without a cursor
+    assert service.searchFiles(filter).file_paths == [path("a", "report2.txt")]
+    assert service.search_cache.getStats().hits == 1
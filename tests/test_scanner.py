@@ -0,0 +1,135 @@
+from flicker.services.memory.fs.scanner import (
+    FileScanner, FileScannerInstance, FileScanningOptions, FileScanningResult
+)
+
+from flicker.services.memory.fs.shards import StorageShards, getShardPath
+from flicker.services.memory.fs.progress import ScanProgressLog
+
+from pathlib import Path
+from threading import Thread
+from typing import Iterator
+
+import pytest
+
+
+@pytest.fixture
+def source(shards: StorageShards, tmp_path: Path) -> Path:
+    """ a data source whose nested roots share its database """
+    shards.configure({str(tmp_path): getShardPath(shards.directory, str(tmp_path))})
+    return tmp_path
+
+
+@pytest.fixture
+def scheduler(source: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[type[FileScanner]]:
+    """ the scheduler with no free slot, so the tasks stay pending """
+    monkeypatch.setattr(FileScanner, "scanning_tasks", dict())
+    monkeypatch.setattr(FileScanner, "pending_tasks", [])
+    monkeypatch.setattr(FileScanner, "max_concurrent_scans", 0)
+    yield FileScanner
+
+
+def getOptions(root: Path, **kwargs) -> FileScanningOptions:
+    return FileScanningOptions(
+        root_directory=str(root), extension_names={".txt"}, excluded_directories=[], progress_interval=0, **kwargs
+    )
+
+
+def test_covers_requires_the_stricter_options(source: Path, tmp_path: Path) -> None:
+    inner = tmp_path / "inner"
+    assert FileScanner.covers(getOptions(tmp_path), getOptions(inner, incremental=True))
+    assert not FileScanner.covers(getOptions(tmp_path, incremental=True), getOptions(inner))
+    assert not FileScanner.covers(getOptions(tmp_path, streaming=True), getOptions(inner))
+    assert not FileScanner.covers(getOptions(inner), getOptions(tmp_path))
+    assert not FileScanner.covers(getOptions(tmp_path), getOptions(Path(str(tmp_path) + "2")))
+
+
+def test_full_scan_upgrades_the_pending_incremental_scan(scheduler: type[FileScanner], tmp_path: Path) -> None:
+    first = scheduler.startScanning(getOptions(tmp_path, incremental=True, streaming=True))
+    second = scheduler.startScanning(getOptions(tmp_path / "inner"))
+    assert first == second
+    [task] = scheduler.pending_tasks
+    assert not task.options.incremental and not task.options.streaming
+    assert task.options.root_directory == str(tmp_path)
+
+
+def test_outer_scan_merges_the_pending_inner_scans(scheduler: type[FileScanner], tmp_path: Path) -> None:
+    results: list[str] = []
+    scheduler.startScanning(getOptions(tmp_path / "a"), lambda result: results.append("a"))
+    scheduler.startScanning(getOptions(tmp_path / "b", incremental=True), lambda result: results.append("b"))
+    scheduler.startScanning(getOptions(tmp_path, incremental=True), lambda result: results.append("root"))
+    [task] = scheduler.pending_tasks
+    # the full scan of `a` is still done
+    assert not task.options.incremental
+    for callback in task.callbacks:
+        callback(FileScanningResult())
+
+    assert sorted(results) == ["a", "b", "root"]
+
+
+def test_outer_scan_takes_over_the_running_inner_scan(scheduler: type[FileScanner], tmp_path: Path) -> None:
+    running = FileScannerInstance(getOptions(tmp_path / "inner"))
+    running.callbacks.append(lambda result: None)
+    scheduler.scanning_tasks[running.instance_id] = running
+    instance_id = scheduler.startScanning(getOptions(tmp_path))
+    assert running.cancelled and running.callbacks == []
+    [task] = scheduler.pending_tasks
+    assert task.instance_id == instance_id and len(task.callbacks) == 1
+
+
+def test_running_incremental_scan_does_not_absorb_a_full_scan(scheduler: type[FileScanner], tmp_path: Path) -> None:
+    running = FileScannerInstance(getOptions(tmp_path, incremental=True))
+    scheduler.scanning_tasks[running.instance_id] = running
+    assert scheduler.startScanning(getOptions(tmp_path / "inner")) != running.instance_id
+    assert not running.cancelled and len(scheduler.pending_tasks) == 1
+
+
+def test_failed_scan_still_finishes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    inst = FileScannerInstance(getOptions(tmp_path))
+    finished: list[bool] = []
+    inst.scanningFinished.connect(lambda: finished.append(True))
+
+    def fail() -> None:
+        raise OSError("disk error")
+
+    monkeypatch.setattr(inst, "startFileScanning", fail)
+    inst.start()
+    assert finished == [True] and inst.finished.is_set() and inst.result.failed
+
+
+def test_failed_streaming_writer_stops_the_traversal(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    for i in range(50):
+        directory = tmp_path / f"d{i}"
+        directory.mkdir()
+        (directory / "a.txt").write_text("a")
+
+    inst = FileScannerInstance(getOptions(tmp_path, streaming=True, queue_size=1, batch_size=1, bulk_batch_size=1))
+
+    class FailingStorage:
+        def write(self, *args, **kwargs) -> None:
+            raise OSError("database is locked")
+
+    monkeypatch.setattr(StorageShards, "getService", lambda self, root: FailingStorage())
+    traversal = Thread(target=inst.startStreamingTraversal)
+    traversal.start()
+    with pytest.raises(OSError):
+        inst.startStreamingWriter()
+
+    traversal.join(timeout=10)
+    assert not traversal.is_alive() and inst.cancelled
+
+
+def test_progress_log_path_is_resolved_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[Path] = []
+    path = tmp_path / "progress.jsonl"
+
+    def getLogPath() -> Path:
+        calls.append(path)
+        return path
+
+    monkeypatch.setattr(ScanProgressLog, "getLogPath", staticmethod(getLogPath))
+    inst = FileScannerInstance(getOptions(tmp_path))
+    for _ in range(3):
+        inst.reportProgress()
+
+    assert len(calls) == 1
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 3
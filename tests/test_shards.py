@@ -0,0 +1,162 @@
+from flicker.services.memory.fs.datasource import FileSystemDataSource
+from flicker.services.memory.fs.extractor import ContentExtractorInstance
+from flicker.services.memory.fs.fingerprint import FileFingerprinterInstance, FingerprintingOptions
+from flicker.services.memory.fs.scanner import FileScannerInstance
+from flicker.services.memory.fs.shards import StorageShards, LEGACY_DATABASE_FILE
+from flicker.services.memory.fs.snapshot import ScanSnapshot
+from flicker.services.memory.fs.storage import FileInfoFilter
+
+from conftest import createLegacyDatabase, makeTree
+from pathlib import Path
+
+import os
+
+
+def test_legacy_database_is_split_into_the_shards(shards: StorageShards, settings_directory: Path) -> None:
+    root_a = os.path.join(os.sep, "data", "a")
+    root_b = os.path.join(os.sep, "data", "b")
+    files_a = [os.path.join(root_a, "report.txt"), os.path.join(root_a, "sub", "notes.txt")]
+    files_b = [os.path.join(root_b, "budget.xlsx")]
+    removed = [os.path.join(os.sep, "data", "removed", "old.txt")]
+    legacy_path = settings_directory / LEGACY_DATABASE_FILE
+    createLegacyDatabase(legacy_path, files_a + files_b + removed)
+    ScanSnapshot(root_directory=root_a, options_digest="digest").save()
+
+    shards.configure({root_a: shards.directory / "a.db", root_b: shards.directory / "b.db"})
+    assert not legacy_path.exists()
+    # the snapshot describes the files copied into the shard
+    assert ScanSnapshot.load(root_a, "digest") is not None
+
+    service_a = shards.getService(root_a)
+    service_b = shards.getService(root_b)
+    assert sorted(service_a.searchFiles(FileInfoFilter(keywords=["txt"])).file_paths) == sorted(files_a)
+    assert service_b.searchFiles(FileInfoFilter(keywords=["budget"])).file_paths == files_b
+    assert shards.searchFiles(FileInfoFilter(keywords=["old"])).file_paths == []
+    # the contents and fingerprints are up to date, the files are not extracted or hashed again
+    states = service_a.read(lambda storage: storage.getContentStates(root_a))
+    assert sorted(state.file_path for state in states if state.unchanged) == sorted(files_a)
+    assert service_a.read(lambda storage: storage.getFingerprints(root_a)) == {files_a[0]: "hash0", files_a[1]: "hash1"}
+    assert [chunk.content for chunk in service_a.read(lambda storage: storage.getChunks(files_a[1]))] == ["text of notes.txt"]
+
+
+def scan(source: FileSystemDataSource) -> None:
+    options = source.getScanningOptions().model_copy(update={'progress_interval': 0})
+    FileScannerInstance(options).start()
+
+
+def test_nested_roots_are_scanned_into_their_own_shard(shards: StorageShards, tmp_path: Path) -> None:
+    makeTree(tmp_path, [f"report{i}.txt" for i in range(3)] + [f"inner/report{i}.txt" for i in range(3)])
+    outer = FileSystemDataSource(root_directory=str(tmp_path), extension_names=[".txt"])
+    inner = FileSystemDataSource(root_directory=str(tmp_path / "inner"), extension_names=[".txt"])
+    # the outer source was scanned before the inner one was added
+    shards.configure({outer.root_directory: outer.getDatabasePath()})
+    scan(outer)
+    shards.configure({source.root_directory: source.getDatabasePath() for source in (outer, inner)})
+    scan(outer)
+    scan(inner)
+
+    filter = FileInfoFilter(keywords=["report"], limit=4)
+    outer_files = shards.getService(outer.root_directory).searchFiles(filter.model_copy(update={'limit': 10}))
+    inner_files = shards.getService(inner.root_directory).searchFiles(filter.model_copy(update={'limit': 10}))
+    assert sorted(outer_files.file_paths) == [str(tmp_path / f"report{i}.txt") for i in range(3)]
+    assert sorted(inner_files.file_paths) == [str(tmp_path / "inner" / f"report{i}.txt") for i in range(3)]
+
+    # the pages of the merged search are full and hold every file once
+    page = shards.searchFiles(filter)
+    paths = list(page.file_paths)
+    assert len(paths) == 4
+    page = shards.searchFiles(filter.model_copy(update={'cursor': page.cursor}))
+    paths.extend(page.file_paths)
+    assert page.cursor is None
+    assert sorted(paths) == sorted(outer_files.file_paths + inner_files.file_paths)
+
+
+def test_pages_of_small_windows_hold_every_file_once(shards: StorageShards, tmp_path: Path) -> None:
+    makeTree(tmp_path, [f"a/q_report{i}.txt" for i in range(40)] + [f"b/q_report{i}.txt" for i in range(40)])
+    sources = [FileSystemDataSource(root_directory=str(tmp_path / name), extension_names=[".txt"]) for name in "ab"]
+    shards.configure({source.root_directory: source.getDatabasePath() for source in sources})
+    for source in sources:
+        scan(source)
+
+    # the pages take part of the windows of a shard, the shard continues in the same window
+    filter = FileInfoFilter(keywords=["report"], limit=7, candidates=10, search_seconds=60)
+    paths: list[str] = []
+    while True:
+        page = shards.searchFiles(filter)
+        paths.extend(page.file_paths)
+        if page.cursor is None:
+            break
+
+        filter = filter.model_copy(update={'cursor': page.cursor})
+
+    assert len(paths) == len(set(paths)) == 80
+
+
+def test_legacy_files_of_a_nested_root_are_copied_once(shards: StorageShards, settings_directory: Path) -> None:
+    outer = os.path.join(os.sep, "data", "a")
+    inner = os.path.join(outer, "inner")
+    outer_files = [os.path.join(outer, "report.txt"), os.path.join(outer, "innerx", "notes.txt")]
+    inner_files = [os.path.join(inner, "budget.txt")]
+    createLegacyDatabase(settings_directory / LEGACY_DATABASE_FILE, outer_files + inner_files)
+
+    shards.configure({outer: shards.directory / "a.db", inner: shards.directory / "inner.db"})
+    filter = FileInfoFilter(keywords=["txt"])
+    assert sorted(shards.getService(outer).searchFiles(filter).file_paths) == sorted(outer_files)
+    assert shards.getService(inner).searchFiles(filter).file_paths == inner_files
+
+
+def test_copies_under_two_roots_are_hashed_and_extracted_once(shards: StorageShards, tmp_path: Path) -> None:
+    # larger than the samples, so the full hash is only computed for a collision
+    content = "quarterly report\n" * 20_000
+    sources = [FileSystemDataSource(root_directory=str(tmp_path / name), extension_names=[".txt"]) for name in "ab"]
+    shards.configure({source.root_directory: source.getDatabasePath() for source in sources})
+    for source in sources:
+        os.makedirs(source.root_directory)
+        Path(source.root_directory, "report.txt").write_text(content, encoding='utf-8')
+        scan(source)
+
+    # the file of `a` is sampled first, the collision is found by the fingerprinting of `b`
+    for source in sources:
+        FileFingerprinterInstance(FingerprintingOptions(root_directory=source.root_directory)).startFingerprinting()
+
+    fingerprints = [
+        shards.getService(source.root_directory).read(lambda storage: storage.getFingerprints(source.root_directory))
+        for source in sources
+    ]
+    assert len(fingerprints[0]) == 1 and list(fingerprints[0].values()) == list(fingerprints[1].values())
+
+    results = []
+    for source in sources:
+        instance = ContentExtractorInstance(source.getExtractionOptions())
+        instance.startExtraction(instance.getPendingFiles())
+        results.append(instance.result)
+
+    assert (results[0].extracted_files, results[1].extracted_files, results[1].duplicate_files) == (1, 0, 1)
+    chunks = [
+        shards.getService(source.root_directory).read(lambda storage: storage.getChunks(str(Path(source.root_directory, "report.txt"))))
+        for source in sources
+    ]
+    assert [chunk.content for chunk in chunks[0]] == [chunk.content for chunk in chunks[1]] != []
+    [group] = shards.getDuplicateGroups()
+    assert group.file_paths == [str(Path(source.root_directory, "report.txt")) for source in sources]
+    assert group.file_size == len(content) and shards.getService(sources[0].root_directory).getDuplicateGroups() == []
+
+
+def test_identical_files_form_one_group(shards: StorageShards, tmp_path: Path) -> None:
+    # each file holds its own relative path, except for the copy
+    makeTree(tmp_path, ["notes.txt", "other.txt", "report.txt", "copy/report.txt"])
+    (tmp_path / "copy" / "report.txt").write_text("report.txt", encoding='utf-8')
+
+    source = FileSystemDataSource(root_directory=str(tmp_path), extension_names=[".txt"])
+    shards.configure({source.root_directory: source.getDatabasePath()})
+    scan(source)
+    FileFingerprinterInstance(FingerprintingOptions(root_directory=source.root_directory)).startFingerprinting()
+
+    copies = [str(tmp_path / "copy" / "report.txt"), str(tmp_path / "report.txt")]
+    [group] = shards.getDuplicateGroups()
+    assert group.file_paths == copies and group.file_size == len("report.txt")
+    assert shards.getService(source.root_directory).getDuplicateGroups() == [group]
+
+    instance = ContentExtractorInstance(source.getExtractionOptions())
+    instance.startExtraction(instance.getPendingFiles())
+    assert (instance.result.extracted_files, instance.result.duplicate_files) == (3, 1)
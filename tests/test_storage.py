@@ -0,0 +1,135 @@
+from flicker.services.memory.fs.storage import FileSystemStorage, FileInfoFilter, FileSearchCursor
+from flicker.services.memory.fs import storage as storage_module
+
+from conftest import createLegacyDatabase, makeFileInfo
+from pathlib import Path
+from typing import Optional
+
+import os
+import pytest
+
+
+NOW = 1_700_000_000
+DAY = 86400
+
+
+def path(*names: str) -> str:
+    return os.path.join(os.sep, *names)
+
+
+def searchAll(storage: FileSystemStorage, filter: FileInfoFilter) -> list[str]:
+    """ the files of every page of the filter """
+    paths: list[str] = []
+    cursor: Optional[FileSearchCursor] = None
+    while True:
+        page = storage.searchFiles(filter.model_copy(update={'cursor': cursor}))
+        paths.extend(page.file_paths)
+        if page.cursor is None:
+            return paths
+
+        cursor = page.cursor
+
+
+def test_upsert_counts(storage: FileSystemStorage) -> None:
+    infos = [makeFileInfo(path("a", f"f{i}.txt")) for i in range(3)]
+    counts = storage.addFileInfos([dict(info) for info in infos], 1)
+    assert counts is not None and tuple(counts) == (3, 0, 0)
+    infos[0]["file_size"] = 2
+    counts = storage.addFileInfos([dict(info) for info in infos], 2)
+    assert counts is not None and tuple(counts) == (0, 1, 2)
+
+
+def test_sweep_removes_the_unseen_files(storage: FileSystemStorage) -> None:
+    storage.addFileInfos([makeFileInfo(path("a", name)) for name in ("x.txt", "y.txt", "z.txt")], 0)
+    generation = storage.beginScanGeneration()
+    storage.addFileInfos([makeFileInfo(path("a", "x.txt"))], generation)
+    rowids = storage.getUnseenFiles(path("a"), {path("a", "x.txt")})
+    assert storage.sweepFiles(rowids, generation) == 2
+    assert searchAll(storage, FileInfoFilter(keywords=["txt"])) == [path("a", "x.txt")]
+
+
+def test_terms_match_the_name_and_the_directory(storage: FileSystemStorage) -> None:
+    storage.addFileInfos([
+        makeFileInfo(path("projects", "alpha", "notes.txt"), NOW),
+        makeFileInfo(path("misc", "alpha.md"), NOW - DAY),
+        makeFileInfo(path("misc", "beta.md"), NOW - DAY),
+    ], 1)
+    filter = FileInfoFilter(keywords=["alpha"], cursor=FileSearchCursor(now=NOW))
+    # a term in the name ranks before a term only in the directory
+    assert storage.searchFiles(filter).file_paths == [path("misc", "alpha.md"), path("projects", "alpha", "notes.txt")]
+    assert storage.searchFiles(filter.model_copy(update={'keywords': ["al"]})).file_paths[0] == path("projects", "alpha", "notes.txt")
+    assert storage.searchFiles(filter.model_copy(update={'keywords': ["alpha notes"]})).file_paths == [
+        path("projects", "alpha", "notes.txt")
+    ]
+
+
+def test_exact_match_is_ranked_above_later_inserted_matches(storage: FileSystemStorage) -> None:
+    storage.addFileInfos([makeFileInfo(path("r", "report.txt"), NOW)], 1)
+    # inserted after the exact match, so their rowids are larger
+    storage.addFileInfos([
+        makeFileInfo(path("r", "archive", f"quarterly_financial_report_of_the_department_{i}.txt"), NOW - 400 * DAY)
+        for i in range(3000)
+    ], 1)
+    filter = FileInfoFilter(keywords=["report"], limit=20, cursor=FileSearchCursor(now=NOW))
+    assert storage.searchFiles(filter).file_paths[0] == path("r", "report.txt")
+
+
+def test_pages_find_every_match_once(storage: FileSystemStorage) -> None:
+    infos = [
+        makeFileInfo(path("data", f"d{i % 7}", f"{'report' if i % 3 == 0 else 'note'}_{i}.txt"), NOW - i * 3600)
+        for i in range(500)
+    ]
+    storage.addFileInfos(infos, 1)
+    # small windows page through several windows of candidates and of recent files
+    for windows in ({}, {'candidates': 20, 'scan_window': 20, 'search_seconds': 60}):
+        for keywords, expected in ((["report"], 167), (["no"], 333), (["d3 report"], 24)):
+            filter = FileInfoFilter(keywords=keywords, limit=17, cursor=FileSearchCursor(now=NOW)).model_copy(update=windows)
+            paths = searchAll(storage, filter)
+            assert len(paths) == len(set(paths)) == expected
+            terms = keywords[0].split()
+            assert set(paths) == {info["file_path"] for info in infos if all(term in info["file_path"] for term in terms)}
+
+
+def test_search_time_bounds_the_window(storage: FileSystemStorage, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(storage_module, "SEARCH_RANGE_ROWS", 16)
+    infos = [makeFileInfo(path("a", f"{'q_report' if i % 2 == 0 else 'note'}_{i}.txt"), NOW - i) for i in range(300)]
+    storage.addFileInfos(infos, 1)
+    # without time each window is a single range, the next page goes on below it
+    filter = FileInfoFilter(keywords=["report"], limit=10, cursor=FileSearchCursor(now=NOW), search_seconds=0)
+    page = storage.searchFiles(filter)
+    assert len(page.file_paths) == 8 and page.cursor is not None and page.cursor.window == 285
+    assert sorted(searchAll(storage, filter)) == sorted(info["file_path"] for info in infos[::2])
+
+
+def test_predicates(storage: FileSystemStorage) -> None:
+    storage.addFileInfos([
+        makeFileInfo(path("a", "old.pdf"), NOW - 100 * DAY, 10),
+        makeFileInfo(path("a", "new.pdf"), NOW - DAY, 5000),
+        makeFileInfo(path("b", "new.docx"), NOW - DAY, 10),
+    ], 1)
+    assert searchAll(storage, FileInfoFilter(extensions=["pdf"])) == [path("a", "new.pdf"), path("a", "old.pdf")]
+    assert searchAll(storage, FileInfoFilter(keywords=["new"], min_size=100)) == [path("a", "new.pdf")]
+    assert searchAll(storage, FileInfoFilter(modified_before=NOW - 50 * DAY)) == [path("a", "old.pdf")]
+    assert searchAll(storage, FileInfoFilter(keywords=["new"], directories=[path("b")])) == [path("b", "new.docx")]
+    assert storage.estimateFileCount(FileInfoFilter(extensions=["pdf", "docx"])).count == 3
+
+
+def test_file_paths_are_migrated(tmp_path: Path) -> None:
+    files = [path("data", "report.txt"), path("data", "sub", "notes.txt"), path("other", "budget.xlsx")]
+    createLegacyDatabase(tmp_path / "fsmemory.db", files)
+    storage = FileSystemStorage(tmp_path / "fsmemory.db")
+    try:
+        # the upgrade moves the latest rows at once, the legacy table is dropped when empty
+        storage.db_initialize()
+        assert not storage.legacy_files
+        assert searchAll(storage, FileInfoFilter(keywords=["txt"])) == [files[1], files[0]]
+        assert searchAll(storage, FileInfoFilter(directories=[path("data")])) == [files[1], files[0]]
+        assert dict(storage.getExtensionCounts()) == {"txt": 2, "xlsx": 1}
+        # the contents and fingerprints are keyed by the path, they still belong to the files
+        assert storage.getFingerprints(path("data")) == {files[0]: "hash0", files[1]: "hash1"}
+        assert [chunk.content for chunk in storage.getChunks(files[2])] == ["text of budget.xlsx"]
+        # the next rows are numbered after the moved ones
+        storage.addFileInfos([makeFileInfo(path("data", "new.txt"), NOW + DAY)], 1)
+        assert searchAll(storage, FileInfoFilter(keywords=["txt"]))[0] == path("data", "new.txt")
+    finally:
+        storage.close()
@@ -0,0 +1,95 @@
+from flicker.services.memory.fs.walker import ParallelDirectoryWalker
+from flicker.services.memory.fs.scanner import FileScannerInstance, FileScanningOptions
+
+from conftest import makeTree
+from pathlib import Path
+from threading import Lock
+
+import pytest
+
+
+TREE = [
+    "a.txt",
+    "b.md",
+    "skip.bin",
+    "docs/guide.md",
+    "docs/deep/er/notes.txt",
+    "docs/deep/er/scratch.tmp.txt",
+    "node_modules/pkg/readme.md",
+    "src/node_modules/pkg/index.txt",
+    "build/out.txt",
+    "src/build/kept.txt",
+    "src/main.txt",
+    "ignored/.flickerignore",
+    "ignored/drafts/draft.txt",
+    "ignored/final.txt",
+    "ignored/private.md",
+] + [f"wide/d{i}/e{j}/f{k}.txt" for i in range(8) for j in range(4) for k in range(3)]
+
+EXPECTED = {
+    "a.txt",
+    "b.md",
+    "docs/guide.md",
+    "docs/deep/er/notes.txt",
+    "src/build/kept.txt",
+    "src/main.txt",
+    "ignored/final.txt",
+} | {f"wide/d{i}/e{j}/f{k}.txt" for i in range(8) for j in range(4) for k in range(3)}
+
+
+def scan(root: Path, parallelism: int) -> set[str]:
+    options = FileScanningOptions(
+        root_directory=str(root),
+        extension_names={".txt", ".md"},
+        excluded_directories=["node_modules", "/build", "*.tmp.txt"],
+        parallelism=parallelism,
+        progress_interval=0
+    )
+    inst = FileScannerInstance(options)
+    inst.startTraversal()
+    return {path.relative_to(root).as_posix() for path in inst.result.paths}
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / "root"
+    makeTree(root, TREE)
+    (root / "ignored" / ".flickerignore").write_text("drafts/\n*.md\n", encoding='utf-8')
+    return root
+
+
+def test_serial_and_parallel_scans_match(tree: Path) -> None:
+    serial = scan(tree, 1)
+    assert serial == EXPECTED
+    for parallelism in (2, 4, 8):
+        assert scan(tree, parallelism) == serial
+
+
+def test_parallel_walker_visits_each_item_once() -> None:
+    # a complete tree of depth 6 and fan out 4, items are the paths from the root
+    visited: list[tuple[int, ...]] = []
+    lock = Lock()
+
+    def visit(item: tuple[int, ...]) -> list[tuple[int, ...]]:
+        with lock:
+            visited.append(item)
+
+        return [] if len(item) == 6 else [item + (i,) for i in range(4)]
+
+    ParallelDirectoryWalker(visit, 4).walk([()])
+    assert len(visited) == len(set(visited)) == sum(4 ** depth for depth in range(7))
+
+
+def test_parallel_walker_survives_failed_visits() -> None:
+    visited: set[int] = set()
+
+    def visit(item: int) -> list[int]:
+        visited.add(item)
+        if item % 7 == 3:
+            raise OSError(item)
+
+        return [item * 2 + 1, item * 2 + 2] if item < 200 else []
+
+    ParallelDirectoryWalker(visit, 3).walk([0])
+    # the subtree of a failed item is lost, the others are visited
+    assert 3 in visited and 7 not in visited and 4 in visited
@@ -0,0 +1,130 @@
+from flicker.services.memory.fs.exclusion import ExclusionRules
+from flicker.services.memory.fs.scanner import FileScannerInstance, FileScanningOptions, ScanPriority
+from flicker.services.memory.fs.shards import StorageShards, getShardPath
+from flicker.services.memory.fs.watcher import FileSystemWatcher, Inotify, WatchLimitError
+
+from conftest import makeTree
+from pathlib import Path
+from typing import Iterator
+
+import os
+import pytest
+import sys
+
+
+if not sys.platform.startswith('linux'):
+    pytest.skip("the watcher uses inotify", allow_module_level=True)
+
+
+@pytest.fixture
+def watcher(shards: StorageShards, tmp_path: Path) -> Iterator[FileSystemWatcher]:
+    """ a watcher of the scanned tree under `root`, whose events are applied by the test """
+    root = tmp_path / "root"
+    makeTree(root, ["report.txt", "notes.txt", "docs/plan.txt", "docs/old/draft.txt", "build/out.txt"])
+    options = FileScanningOptions(
+        root_directory=str(root), extension_names={".txt"}, excluded_directories=["build"], progress_interval=0
+    )
+    shards.configure({options.root_directory: getShardPath(shards.directory, options.root_directory)})
+    FileScannerInstance(options).start()
+
+    instance = FileSystemWatcher(options)
+    inotify = instance.inotify = Inotify()
+    instance.watchTree(options.root_directory, ExclusionRules.compile(options.root_directory, options.excluded_directories))
+    yield instance
+    inotify.close()
+
+
+def applyEvents(watcher: FileSystemWatcher) -> None:
+    """ handles the events queued so far and applies them as one batch """
+    assert watcher.inotify is not None
+    events = watcher.inotify.read(timeout=1.0)
+    while len(events) > 0:
+        for wd, mask, name in events:
+            watcher.handleEvent(wd, mask, name)
+
+        events = watcher.inotify.read(timeout=0.1)
+
+    watcher.applyPendingChanges()
+
+
+def getFiles(watcher: FileSystemWatcher) -> dict[str, int]:
+    """ the relative paths of the stored files with their size """
+    root = watcher.options.root_directory
+    service = StorageShards.getInstance().getService(root)
+    states = service.read(lambda storage: storage.getContentStates(root))
+    return {Path(state.file_path).relative_to(root).as_posix(): state.file_size for state in states}
+
+
+def test_created_modified_and_deleted_files(watcher: FileSystemWatcher) -> None:
+    root = Path(watcher.options.root_directory)
+    assert sorted(getFiles(watcher)) == ["docs/old/draft.txt", "docs/plan.txt", "notes.txt", "report.txt"]
+    makeTree(root, ["new.txt", "new.log", "build/ignored.txt"])
+    (root / "report.txt").write_text("a longer report", encoding='utf-8')
+    (root / "notes.txt").unlink()
+    applyEvents(watcher)
+
+    files = getFiles(watcher)
+    assert sorted(files) == ["docs/old/draft.txt", "docs/plan.txt", "new.txt", "report.txt"]
+    assert files["report.txt"] == len("a longer report")
+
+
+def test_events_of_a_path_are_coalesced(watcher: FileSystemWatcher) -> None:
+    root = Path(watcher.options.root_directory)
+    for i in range(5):
+        (root / "report.txt").write_text("x" * i, encoding='utf-8')
+
+    (root / "burst.txt").write_text("created", encoding='utf-8')
+    (root / "burst.txt").unlink()
+
+    assert watcher.inotify is not None
+    for wd, mask, name in watcher.inotify.read(timeout=1.0):
+        watcher.handleEvent(wd, mask, name)
+    # the action of a path is decided by its state when the batch is applied
+    assert sorted(watcher.pending) == [str(root / "burst.txt"), str(root / "report.txt")]
+
+    watcher.applyPendingChanges()
+    assert watcher.stats.applied_batches == 1 and watcher.pending == dict()
+    assert getFiles(watcher)["report.txt"] == 4 and "burst.txt" not in getFiles(watcher)
+
+
+def test_moved_files_and_directories(watcher: FileSystemWatcher, tmp_path: Path) -> None:
+    root = Path(watcher.options.root_directory)
+    makeTree(tmp_path / "outside", ["incoming/a.txt", "incoming/sub/b.txt"])
+    os.rename(root / "report.txt", root / "docs" / "report.txt")
+    os.rename(root / "docs" / "old", tmp_path / "old")
+    os.rename(tmp_path / "outside" / "incoming", root / "incoming")
+    applyEvents(watcher)
+    assert sorted(getFiles(watcher)) == [
+        "docs/plan.txt", "docs/report.txt", "incoming/a.txt", "incoming/sub/b.txt", "notes.txt"
+    ]
+    assert str(root / "docs" / "old") not in watcher.watches.values()
+
+    # the moved-in directories are watched, the moved-out one is not
+    makeTree(root, ["incoming/sub/c.txt"])
+    makeTree(tmp_path, ["old/later.txt"])
+    applyEvents(watcher)
+    assert "incoming/sub/c.txt" in getFiles(watcher)
+    assert not any(path.startswith("old") for path in getFiles(watcher))
+
+
+def test_watch_limit_falls_back_to_periodic_rescans(shards: StorageShards, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def addWatch(self: Inotify, path: str) -> int:
+        raise WatchLimitError(f'inotify watch limit reached when watching {path}')
+
+    makeTree(tmp_path, ["report.txt"])
+    options = FileScanningOptions(root_directory=str(tmp_path), extension_names={".txt"}, excluded_directories=[])
+    instance = FileSystemWatcher(options, rescan_interval=0)
+    rescans: list[ScanPriority] = []
+
+    def rescan(priority: ScanPriority = ScanPriority.NORMAL) -> None:
+        rescans.append(priority)
+        instance.stop()
+
+    monkeypatch.setattr(Inotify, "addWatch", addWatch)
+    monkeypatch.setattr(instance, "rescan", rescan)
+    finished: list[bool] = []
+    instance.watchingFinished.connect(lambda: finished.append(True))
+    instance.start()
+
+    assert instance.stats.degraded and instance.stats.watch_count == 0 and instance.inotify is None
+    assert rescans == [ScanPriority.LOW] and finished == [True]